@@ -4,3 +4,9 @@ from django.apps import AppConfig
 class BaseConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'apps.base'
+
+    def ready(self):
+        from apps.base.cache import catalog_cache
+        from apps.base.metrics import connect_query_recorder
+        catalog_cache.connect_signals()
+        connect_query_recorder()
@@ -0,0 +1,279 @@
+import threading
+import time
+from hashlib import md5
+
+from cacheops import invalidate_obj
+from cacheops.conf import settings as cacheops_settings
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete, m2m_changed
+
+# Cache backends whose entries are only seen by the process that wrote them
+PROCESS_LOCAL_CACHE_BACKENDS = (LocMemCache, DummyCache)
+
+
+def is_shared_cache(cache):
+    """
+    Return True when the entries of the cache backend are seen by every process, e.g. Redis, so that they can
+    carry signals between processes.
+    """
+
+    return not isinstance(cache, PROCESS_LOCAL_CACHE_BACKENDS)
+
+
+class CatalogCache:
+    """
+    Versioned cache for serialized catalog responses.
+
+    Every cached entry is keyed with the current version of the models it was built from. Saving or deleting
+    an instance of one of those models replaces the model version, so all entries built from it stop being
+    found and age out of the cache through its TTL and size limits, without scanning or deleting any key.
+
+    Models listed in `scopes` are versioned per value of their scope fields instead, e.g. products per owner
+    and per id: saving a product only replaces the versions of its owner and of its id, and an entry depends
+    on a `(model, field, value)` scope, e.g. the products of the requesting user. The whole model version is
+    still replaced by `invalidate()`, for the bulk changes.
+
+    The cache backend is the `CACHE_ALIAS` entry of `settings.CACHES`, an in-process `LocMemCache` by default
+    and Redis when `REDIS_URL` is configured. Hits, misses and invalidations are counted per process.
+
+    Attributes:
+        hits (int): Number of entries served from the cache.
+        misses (int): Number of entries that had to be built.
+        invalidations (int): Number of model version changes.
+
+    Example:
+        data = catalog_cache.get_or_set(("product-list", user.id, path), build_data,
+                                        models=[(Product, "created_by_id", user.id), ProductCategory])
+    """
+
+    def __init__(self, alias="catalog", model_labels=(), scopes=None):
+        self.alias = alias
+        self.model_labels = model_labels
+        self.scopes = scopes or {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    @staticmethod
+    def version_key(model, field=None, value=None):
+        if field is None:
+            return f"catalog:version:{model._meta.label_lower}"
+        return f"catalog:version:{model._meta.label_lower}:{field}={value}"
+
+    def get_scope_fields(self, model):
+        return self.scopes.get(model._meta.label, ())
+
+    def get_version_keys(self, models):
+        """
+        Return the version keys of the models an entry is built from, with the timeout of their versions.
+        There is a scope version per row or owner, they expire like the entries, which are rebuilt when it does.
+        """
+
+        keys = {}
+        for model in models:
+            if isinstance(model, tuple):
+                keys[self.version_key(*model)] = DEFAULT_TIMEOUT
+                model = model[0]
+            keys[self.version_key(model)] = None
+        return keys
+
+    def get_versions(self, models):
+        keys = self.get_version_keys(models)
+        versions = self.cache.get_many(keys)
+        for key, timeout in keys.items():
+            if key not in versions:
+                # A new version is time based, so a version evicted from the cache can never be reused
+                versions[key] = time.time_ns()
+                self.cache.add(key, versions[key], timeout=timeout)
+        return [versions[key] for key in keys]
+
+    async def aget_versions(self, models):
+        keys = self.get_version_keys(models)
+        versions = await self.cache.aget_many(keys)
+        for key, timeout in keys.items():
+            if key not in versions:
+                versions[key] = time.time_ns()
+                await self.cache.aadd(key, versions[key], timeout=timeout)
+        return [versions[key] for key in keys]
+
+    @staticmethod
+    def entry_key(parts, versions):
+        raw = ":".join(str(part) for part in list(parts) + versions)
+        return f"catalog:entry:{md5(raw.encode()).hexdigest()}"
+
+    def make_key(self, parts, models):
+        return self.entry_key(parts, self.get_versions(models))
+
+    def get_or_set(self, parts, default, models):
+        """
+        Return the cached value for the key parts, building and storing it with `default()` when missing.
+
+        Args:
+            parts (tuple): Values identifying the entry, e.g. the view name, the user id and the request path.
+            default (callable): Builds the value on a miss, it may return None to skip caching.
+            models (list): Models the value is built from, saving any of their instances invalidates it. A
+                `(model, field, value)` tuple restricts a scoped model to its rows with that value.
+
+        Returns:
+            tuple: The value and a boolean telling whether it was served from the cache.
+        """
+
+        key = self.make_key(parts, models)
+        value = self.cache.get(key)
+        if value is not None:
+            self.count("hits")
+            return value, True
+
+        self.count("misses")
+        value = default()
+        if value is not None:
+            self.cache.set(key, value)
+        return value, False
+
+    async def aget_or_set(self, parts, default, models):
+        """
+        Async variant of `get_or_set()` for async views, `default` is a coroutine function. The cache is read
+        and written with the async methods of the backend, so the event loop never waits on Redis.
+        """
+
+        key = self.entry_key(parts, await self.aget_versions(models))
+        value = await self.cache.aget(key)
+        if value is not None:
+            self.count("hits")
+            return value, True
+
+        self.count("misses")
+        value = await default()
+        if value is not None:
+            await self.cache.aset(key, value)
+        return value, False
+
+    def invalidate(self, *models):
+        """
+        Invalidate all entries built from the given models, now and again when the transaction commits so that
+        entries cached from not yet committed data by concurrent requests are dropped as well.
+        """
+
+        self.replace_versions([self.version_key(model) for model in models], timeout=None)
+
+    def invalidate_scopes(self, model, field, values):
+        """
+        Invalidate the entries built from the rows of a model with the given values of one of its scope fields,
+        e.g. the products of some owners, like `invalidate()` does.
+        """
+
+        self.replace_versions([self.version_key(model, field, value) for value in set(values)],
+                              timeout=DEFAULT_TIMEOUT)
+
+    def invalidate_instances(self, model, instances):
+        """
+        Invalidate the entries built from the given instances: the scopes they belong to for a scoped model,
+        all entries built from the model otherwise.
+        """
+
+        scope_fields = self.get_scope_fields(model)
+        if not scope_fields:
+            self.invalidate(model)
+        for field in scope_fields:
+            self.invalidate_scopes(model, field, [getattr(instance, field) for instance in instances])
+
+    def invalidate_pks(self, model, pks):
+        """
+        Invalidate the entries built from the rows with the given primary keys, reading their scope values
+        with one query for a scoped model.
+        """
+
+        pks = list(pks)
+        scope_fields = self.get_scope_fields(model)
+        if not scope_fields:
+            self.invalidate(model)
+        elif pks:
+            rows = list(model.objects.nocache().filter(pk__in=pks).values_list(*scope_fields))
+            for index, field in enumerate(scope_fields):
+                self.invalidate_scopes(model, field, [row[index] for row in rows])
+
+    def replace_versions(self, keys, timeout):
+        if not keys:
+            return
+
+        def replace():
+            self.cache.set_many({key: time.time_ns() for key in keys}, timeout=timeout)
+            self.count("invalidations")
+
+        replace()
+        transaction.on_commit(replace)
+
+    def invalidate_rows(self, model, pks):
+        """
+        Invalidate the cache after rows have been changed with `QuerySet.update()`, which sends no signals.
+
+        Args:
+            model (Model): The updated model.
+            pks (iterable): Primary keys of the updated rows.
+        """
+
+        pks = list(pks)
+        self.invalidate_pks(model, pks)
+        if cacheops_settings.CACHEOPS_ENABLED and pks:
+            for obj in model.objects.nocache().filter(pk__in=pks):
+                invalidate_obj(obj)
+
+    def count(self, counter):
+        with self.lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def stats(self):
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "invalidations": self.invalidations,
+                "hit_ratio": round(self.hits / total, 4) if total else 0.0,
+            }
+
+    def reset_stats(self):
+        with self.lock:
+            self.hits = self.misses = self.invalidations = 0
+
+    def connect_signals(self):
+        """
+        Connect the save, delete and many-to-many signals of the cached models to their invalidation.
+        """
+
+        for label in self.model_labels:
+            model = apps.get_model(label)
+            post_save.connect(self.handle_model_change, sender=model, dispatch_uid=f"catalog-cache-save-{label}")
+            post_delete.connect(self.handle_model_change, sender=model, dispatch_uid=f"catalog-cache-delete-{label}")
+            for field in model._meta.local_many_to_many:
+                m2m_changed.connect(self.handle_model_change, sender=field.remote_field.through,
+                                    dispatch_uid=f"catalog-cache-m2m-{label}-{field.name}")
+
+    def handle_model_change(self, sender, instance, **kwargs):
+        if "action" not in kwargs:
+            self.invalidate_instances(sender, [instance])
+        elif kwargs["action"].startswith("post_"):
+            # Many-to-many changes affect the models on both sides of the relation
+            self.invalidate_instances(instance.__class__, [instance])
+            if kwargs["pk_set"] is None:
+                self.invalidate(kwargs["model"])
+            else:
+                self.invalidate_pks(kwargs["model"], kwargs["pk_set"])
+
+
+catalog_cache = CatalogCache(
+    alias=settings.CATALOG_CACHE["CACHE_ALIAS"],
+    model_labels=settings.CATALOG_CACHE["MODELS"],
+    scopes=settings.CATALOG_CACHE["SCOPES"],
+)
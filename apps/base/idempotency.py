@@ -0,0 +1,158 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from apps.base.models import IdempotencyKey
+
+
+class IdempotencyKeyLost(Exception):
+    """
+    Raised when the key of a request was taken over by another request before it completed, the request must
+    roll back its changes.
+    """
+
+
+class LRUCache:
+    """
+    Thread safe cache of the `max_size` most recently used entries, each with its own expiry time.
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at <= time.time():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, expires_at):
+        with self.lock:
+            self.entries[key] = (value, expires_at)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+class IdempotencyStore:
+    """
+    Outcomes of the requests made with an `Idempotency-Key` header.
+
+    The keys are rows of the `IdempotencyKey` table, shared by all processes: inserting the row of a key claims
+    it, and the unique constraint lets only one of concurrent requests with the same key claim it. Completed
+    outcomes never change, the most recent ones are also kept in an LRU cache of each process so that replays
+    do not query the database.
+
+    Keys are forgotten `IDEMPOTENCY['TTL']` seconds after their request, and the key of a request that did not
+    complete within `IDEMPOTENCY['IN_FLIGHT_TIMEOUT']` seconds (e.g. its process died) can be claimed again. A
+    claim is identified by the `created_at` of its row: a request whose key was taken over in the meantime can
+    neither complete nor release it.
+    """
+
+    def __init__(self, max_size):
+        self.completed = LRUCache(max_size)
+
+    def claim(self, user, scope, key, fingerprint):
+        """
+        Claim a key for a request, or return the outcome of the request that claimed it.
+
+        Returns:
+            tuple: The `IdempotencyKey`, and True when the key was claimed for this request. The key is None
+                when it is claimed and released concurrently.
+        """
+
+        cache_key = (user.pk, scope, key)
+        record = self.completed.get(cache_key)
+        if record is not None:
+            return record, False
+
+        ttl = timedelta(seconds=settings.IDEMPOTENCY["TTL"])
+        in_flight_timeout = timedelta(seconds=settings.IDEMPOTENCY["IN_FLIGHT_TIMEOUT"])
+        for _ in range(3):
+            now = timezone.now()
+            record = IdempotencyKey.objects.filter(user_id=user.pk, scope=scope, key=key).first()
+            if record is None:
+                try:
+                    with transaction.atomic():
+                        record = IdempotencyKey.objects.create(user_id=user.pk, scope=scope, key=key,
+                                                               fingerprint=fingerprint, created_at=now,
+                                                               expires_at=now + ttl)
+                    return record, True
+                except IntegrityError:
+                    # Claimed by a concurrent request
+                    continue
+
+            if record.expires_at <= now or (record.response_status is None
+                                            and record.created_at <= now - in_flight_timeout):
+                # Forgotten or abandoned key, taken over unless a concurrent request just did
+                changes = {"fingerprint": fingerprint, "response_status": None, "response_data": None,
+                           "created_at": now, "expires_at": now + ttl}
+                if IdempotencyKey.objects.filter(pk=record.pk, created_at=record.created_at).update(**changes):
+                    for name, value in changes.items():
+                        setattr(record, name, value)
+                    return record, True
+                continue
+            if record.response_status is not None:
+                self.completed.set(cache_key, record, record.expires_at.timestamp())
+            return record, False
+        return None, False
+
+    def complete(self, record, status, data):
+        """
+        Store the response of the request that claimed a key, in the transaction of the request when there is
+        one so that the outcome and the changes of the request are committed together.
+
+        Raises:
+            IdempotencyKeyLost: The key was taken over by another request, the transaction of the request must
+                be rolled back.
+        """
+
+        record.response_status = status
+        record.response_data = json.loads(json.dumps(data, cls=DjangoJSONEncoder))
+        updated = IdempotencyKey.objects.filter(
+            pk=record.pk, created_at=record.created_at, response_status__isnull=True
+        ).update(response_status=record.response_status, response_data=record.response_data)
+        if not updated:
+            raise IdempotencyKeyLost(f"Idempotency key {record.key!r} was claimed by another request")
+        cache_key = (record.user_id, record.scope, record.key)
+        transaction.on_commit(lambda: self.completed.set(cache_key, record, record.expires_at.timestamp()))
+
+    def release(self, record):
+        """
+        Forget the key of a request that failed, so that it can be sent again.
+        """
+
+        IdempotencyKey.objects.filter(pk=record.pk, created_at=record.created_at,
+                                      response_status__isnull=True).delete()
+
+    def purge(self):
+        """
+        Delete the expired keys.
+
+        Returns:
+            int: The number of keys deleted.
+        """
+
+        return IdempotencyKey.objects.filter(expires_at__lte=timezone.now()).delete()[0]
+
+
+idempotency_store = IdempotencyStore(max_size=settings.IDEMPOTENCY["LRU_SIZE"])
@@ -0,0 +1,327 @@
+import codecs
+import csv
+import json
+from decimal import InvalidOperation
+from itertools import islice
+
+from django.core.exceptions import ValidationError
+from django.db import DatabaseError, connections
+from django.db.models import F
+from import_export import resources, widgets
+from import_export.instance_loaders import CachedInstanceLoader
+from import_export.results import RowResult
+from tablib import Dataset
+
+FORMATS = ("csv", "jsonl")
+CONTENT_TYPES = {"csv": "text/csv", "jsonl": "application/x-ndjson"}
+MAX_REPORTED_ERRORS = 1000
+
+
+class ChunkInstanceLoader(CachedInstanceLoader):
+    """
+    Load the existing instances of a whole chunk with one query. Unlike `CachedInstanceLoader`, ids that do
+    not parse are skipped, their rows are reported as invalid by the import instead of failing the chunk.
+    """
+
+    def __init__(self, resource, dataset=None):
+        self.resource = resource
+        self.dataset = dataset
+        self.pk_field = resource.fields[resource.get_import_id_fields()[0]]
+        self.all_instances = {}
+
+        ids = set()
+        if dataset is not None and self.pk_field.column_name in dataset.headers:
+            for row in dataset.dict:
+                try:
+                    ids.add(self.pk_field.clean(row))
+                except (KeyError, ValueError):
+                    pass
+        ids.discard(None)
+        if ids:
+            self.all_instances = self.load_instances(ids)
+
+    def load_instances(self, ids):
+        queryset = self.get_queryset().filter(**{f"{self.pk_field.attribute}__in": ids})
+        return {self.pk_field.get_value(instance): instance for instance in queryset}
+
+    def get_instance(self, row):
+        try:
+            return self.all_instances.get(self.pk_field.clean(row))
+        except ValueError:
+            return None
+
+
+class LockingChunkInstanceLoader(ChunkInstanceLoader):
+    """
+    Lock the existing rows of a chunk until its transaction ends, in primary key order like the other updates
+    of several rows, e.g. for columns that concurrent requests update from their current value.
+    """
+
+    def get_queryset(self):
+        return super().get_queryset().select_for_update().order_by("pk")
+
+    def load_instances(self, ids):
+        if not connections[self.resource.get_db_connection_name()].features.has_select_for_update:
+            # SQLite has no row locks, a write takes the lock of the database before the rows are read
+            attribute = self.pk_field.attribute
+            self.get_queryset().filter(**{f"{attribute}__in": ids}).update(**{attribute: F(attribute)})
+        return super().load_instances(ids)
+
+
+class NumberWidgetMixin:
+    """
+    Report malformed numbers as invalid values of their row, the number widgets of django-import-export let
+    `InvalidOperation` fail the whole chunk.
+    """
+
+    def clean(self, value, row=None, **kwargs):
+        try:
+            return super().clean(value, row, **kwargs)
+        except InvalidOperation:
+            raise ValueError(f"Enter a number, not {value!r}.")
+
+
+class DecimalWidget(NumberWidgetMixin, widgets.DecimalWidget):
+    pass
+
+
+class IntegerWidget(NumberWidgetMixin, widgets.IntegerWidget):
+    pass
+
+
+class ChunkedModelResource(resources.ModelResource):
+    """
+    Base of the resources imported with `import_stream()`, tuned for large files.
+
+    New and changed rows are written with `bulk_create()` and `bulk_update()`, the existing rows of a chunk
+    are loaded with one query, diffs are not computed and the model validation skips the relations and the
+    uniqueness checks, which would cost a query per row: the database checks them when the chunk is written.
+
+    Subclasses get the saved instances of every imported chunk in `after_chunk()`, e.g. to update caches, and
+    the report of the whole import in `after_import_stream()`.
+    """
+
+    WIDGETS_MAP = {
+        **resources.ModelResource.WIDGETS_MAP,
+        **{internal_type: IntegerWidget for internal_type, widget in resources.ModelResource.WIDGETS_MAP.items()
+           if widget is widgets.IntegerWidget},
+        "DecimalField": DecimalWidget,
+    }
+
+    class Meta:
+        use_bulk = True
+        skip_diff = True
+        clean_model_instances = True
+        instance_loader_class = ChunkInstanceLoader
+
+    def before_import(self, dataset, using_transactions, dry_run, **kwargs):
+        self.saved_instances = []
+
+    def save_instance(self, instance, is_create, using_transactions=True, dry_run=False):
+        super().save_instance(instance, is_create, using_transactions, dry_run)
+        self.saved_instances.append(instance)
+
+    def validate_instance(self, instance, import_validation_errors=None, validate_unique=True):
+        errors = dict(import_validation_errors or {})
+        attributes = {field.attribute for field in self.get_import_fields()}
+        exclude = set(errors) | {field.name for field in self._meta.model._meta.fields
+                                 if field.is_relation or field.attname not in attributes}
+        try:
+            instance.full_clean(exclude=exclude, validate_unique=False)
+        except ValidationError as exc:
+            errors = exc.update_error_dict(errors)
+        if errors:
+            raise ValidationError(errors)
+
+    def after_import(self, dataset, result, using_transactions, dry_run, **kwargs):
+        if not dry_run and not result.has_errors():
+            self.after_chunk(self.saved_instances)
+
+    def after_chunk(self, instances):
+        pass
+
+    def after_import_stream(self, report):
+        pass
+
+
+class ImportReport:
+    """
+    Totals and errors of a chunked import.
+
+    Attributes:
+        totals (dict): Number of rows per import type, `new`, `update`, `skip`, `invalid` and `error`.
+        errors (list): The first `MAX_REPORTED_ERRORS` errors, as `(line, message)` tuples. Lines are numbered
+            from 1, the header of CSV files included.
+        error_count (int): Number of errors, reported or not.
+    """
+
+    def __init__(self):
+        self.totals = {import_type: 0 for import_type in (
+            RowResult.IMPORT_TYPE_NEW, RowResult.IMPORT_TYPE_UPDATE, RowResult.IMPORT_TYPE_SKIP,
+            RowResult.IMPORT_TYPE_INVALID, RowResult.IMPORT_TYPE_ERROR)}
+        self.errors = []
+        self.error_count = 0
+
+    def add_error(self, line, message):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append((line, message))
+
+    def add_chunk(self, result, lines):
+        """
+        Add the result of the import of a chunk, `lines` being the line numbers of its rows.
+        """
+
+        if result.has_errors():
+            # A bulk write or a row failed, the transaction of the whole chunk was rolled back
+            self.totals[RowResult.IMPORT_TYPE_ERROR] += len(lines)
+            for error in result.base_errors:
+                self.add_error(lines[0], f"Lines {lines[0]}-{lines[-1]} not imported: {error.error}")
+            for number, errors in result.row_errors():
+                self.add_error(lines[number - 1], f"Lines {lines[0]}-{lines[-1]} not imported: "
+                                                  + "; ".join(str(error.error) for error in errors))
+            return
+
+        for import_type, count in result.totals.items():
+            if import_type in self.totals:
+                self.totals[import_type] += count
+        for invalid_row in result.invalid_rows:
+            messages = "; ".join(f"{field}: {' '.join(errors)}" for field, errors in invalid_row.error_dict.items())
+            self.add_error(lines[invalid_row.number - 1], messages)
+
+    @property
+    def imported(self):
+        return self.totals[RowResult.IMPORT_TYPE_NEW] + self.totals[RowResult.IMPORT_TYPE_UPDATE]
+
+    def summary(self):
+        return ", ".join(f"{count} {import_type}" for import_type, count in self.totals.items())
+
+
+def iter_rows(stream, file_format):
+    """
+    Read the rows of a binary CSV or JSONL stream one at a time.
+
+    Yields:
+        tuple: The line number, and the row as a dict or None with the error message for unreadable lines.
+    """
+
+    lines = codecs.iterdecode(stream, "utf-8-sig")
+    if file_format == "csv":
+        reader = csv.DictReader(lines)
+        for row in reader:
+            yield reader.line_num, row, None
+    elif file_format == "jsonl":
+        for line_number, line in enumerate(lines, 1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError as exc:
+                yield line_number, None, f"Invalid JSON: {exc}"
+                continue
+            if isinstance(row, dict):
+                yield line_number, row, None
+            else:
+                yield line_number, None, "Invalid row: expected a JSON object"
+    else:
+        raise ValueError(f"Unsupported format {file_format!r}, use one of {', '.join(FORMATS)}")
+
+
+def import_stream(resource, stream, file_format, chunk_size=1000, dry_run=False, log=None):
+    """
+    Import a CSV or JSONL stream with a `ChunkedModelResource`, in chunks of `chunk_size` rows.
+
+    Only one chunk is held in memory at a time. Each chunk is imported in its own transaction with one query
+    loading its existing rows and bulk inserts and updates when the resource sets `use_bulk`. Invalid rows are
+    reported and skipped, the other rows of their chunk are imported.
+
+    Args:
+        resource (ChunkedModelResource): The resource mapping the columns to the model.
+        stream (file): Binary file object, e.g. an open file or an uploaded file.
+        file_format (str): `csv` or `jsonl`.
+        chunk_size (int): Number of rows per chunk.
+        dry_run (bool): Validate the rows without saving them.
+        log (callable, optional): Called with the report after every chunk.
+
+    Returns:
+        ImportReport: The totals and errors of the import.
+    """
+
+    if file_format not in FORMATS:
+        raise ValueError(f"Unsupported format {file_format!r}, use one of {', '.join(FORMATS)}")
+
+    report = ImportReport()
+    rows = iter_rows(stream, file_format)
+    # JSONL lines may have different keys, the columns of the resource are used for all chunks
+    headers = [field.column_name for field in resource.get_import_fields()]
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            break
+
+        dataset, lines = Dataset(headers=headers), []
+        for line, row, error in chunk:
+            if error:
+                report.totals[RowResult.IMPORT_TYPE_INVALID] += 1
+                report.add_error(line, error)
+                continue
+            dataset.append([row.get(header, "") for header in headers])
+            lines.append(line)
+        if lines:
+            try:
+                result = resource.import_data(dataset, dry_run=dry_run, use_transactions=True)
+            except DatabaseError as exc:
+                # Deferred constraints are only checked when the transaction of the chunk commits
+                report.totals[RowResult.IMPORT_TYPE_ERROR] += len(lines)
+                report.add_error(lines[0], f"Lines {lines[0]}-{lines[-1]} not imported: {exc}")
+            else:
+                report.add_chunk(result, lines)
+        if log:
+            log(report)
+
+    if not dry_run:
+        resource.after_import_stream(report)
+    report.errors.sort(key=lambda error: error[0])
+    return report
+
+
+def iter_export(resource, queryset, file_format, chunk_size=1000):
+    """
+    Export a queryset with a django-import-export resource as CSV or JSONL, yielding one encoded chunk of rows
+    at a time, so the memory used does not depend on the number of rows.
+    """
+
+    if file_format not in FORMATS:
+        raise ValueError(f"Unsupported format {file_format!r}, use one of {', '.join(FORMATS)}")
+
+    headers = resource.get_export_headers()
+    buffer = Buffer()
+    writer = csv.writer(buffer)
+    if file_format == "csv":
+        writer.writerow(headers)
+
+    for index, instance in enumerate(queryset.iterator(chunk_size=chunk_size), 1):
+        values = resource.export_resource(instance)
+        if file_format == "csv":
+            writer.writerow(values)
+        else:
+            buffer.write(json.dumps(dict(zip(headers, values)), default=str) + "\n")
+        if index % chunk_size == 0:
+            yield buffer.pop()
+    yield buffer.pop()
+
+
+class Buffer:
+    """
+    Write target of `csv.writer` keeping the written text until it is popped.
+    """
+
+    def __init__(self):
+        self.parts = []
+
+    def write(self, text):
+        self.parts.append(text)
+
+    def pop(self):
+        text, self.parts = "".join(self.parts), []
+        return text.encode()
@@ -0,0 +1,67 @@
+import time
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.renderers import JSONRenderer
+
+from apps.base.serializers import compiled_serializers
+from apps.order.models import OrderItem
+from apps.order.serializers import OrderItemReadSerializer
+from apps.product.models import Product, ProductReview
+from apps.product.serializers import ProductReviewSerializer, ProductSerializer
+
+
+class Command(BaseCommand):
+    """
+    Micro-benchmark of the read serializers, DRF representations against the compiled ones.
+
+    The rows are built in memory, so only the serialization and the JSON rendering are measured. The command
+    fails when the compiled JSON differs from the DRF one.
+
+    Example:
+        python manage.py bench_serializers --rows 100 --repeat 200
+    """
+
+    help = "Compare the rows/sec of the DRF and compiled representations of the read serializers."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=100, help="Number of rows per page.")
+        parser.add_argument("--repeat", type=int, default=100, help="Number of pages serialized per run.")
+
+    def handle(self, *args, **options):
+        rows, repeat = options["rows"], options["repeat"]
+        products, reviews, items = self.build_rows(rows)
+        renderer = JSONRenderer()
+
+        self.stdout.write(f"{'serializer':<26} {'DRF rows/s':>12} {'compiled rows/s':>16} {'speedup':>8}")
+        for serializer_class, instances in ((ProductSerializer, products), (ProductReviewSerializer, reviews),
+                                            (OrderItemReadSerializer, items)):
+            results = {}
+            for compiled in (False, True):
+                with compiled_serializers(compiled):
+                    started = time.perf_counter()
+                    for _ in range(repeat):
+                        content = renderer.render(serializer_class(instances, many=True).data)
+                    elapsed = time.perf_counter() - started
+                results[compiled] = (rows * repeat / elapsed, content)
+
+            if results[False][1] != results[True][1]:
+                raise CommandError(f"The compiled JSON of {serializer_class.__name__} differs from the DRF one")
+            self.stdout.write(f"{serializer_class.__name__:<26} {results[False][0]:>12.0f} "
+                              f"{results[True][0]:>16.0f} {results[True][0] / results[False][0]:>7.2f}x")
+
+    @staticmethod
+    def build_rows(count):
+        user = get_user_model()(id=1, username="bench@example.com", first_name="Bench", last_name="User")
+        products = [
+            Product(id=index, name=f"Product {index}", description="", price=Decimal("19.99") + index,
+                    stock_quantity=index, created_by=user, review_count=index % 7, rating_sum=index % 7 * 4,
+                    rating_average=Decimal("4.00") if index % 7 else Decimal("0"), rating_4_count=index % 7)
+            for index in range(1, count + 1)
+        ]
+        reviews = [ProductReview(id=index, user=user, product=product, text="Great product!", rating=index % 5 + 1)
+                   for index, product in enumerate(products, 1)]
+        items = [OrderItem(id=index, product=product, quantity=index % 3 + 1)
+                 for index, product in enumerate(products, 1)]
+        return products, reviews, items
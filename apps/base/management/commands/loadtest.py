@@ -0,0 +1,126 @@
+import http.client
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+from django.core.management.base import BaseCommand, CommandError
+
+DEFAULT_PATHS = ["/api/products/", "/api/products/?pagination=cursor", "/api/orders/"]
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+class Command(BaseCommand):
+    """
+    Load test running deployments of the API and compare their throughput and latency.
+
+    Every client thread keeps its own HTTP connection and sends the GET requests back to back, the requests
+    per second and the latency percentiles are reported per server and path. To compare the WSGI and ASGI
+    deployments, start both with the same number of worker processes (the same core count), e.g.:
+
+        gunicorn ecommerce_project.wsgi:application -w 4 -b 127.0.0.1:8000
+        gunicorn ecommerce_project.asgi:application -w 4 -k uvicorn.workers.UvicornWorker -b 127.0.0.1:8001
+
+    Example:
+        python manage.py loadtest http://127.0.0.1:8000 http://127.0.0.1:8001 --username admin@gmail.com \\
+            --password 1111 --concurrency 64 --requests 5000
+    """
+
+    help = "Load test API servers and report requests/sec and p50/p95/p99 latencies."
+
+    def add_arguments(self, parser):
+        parser.add_argument("servers", nargs="+", help="Base URLs of the servers, e.g. http://127.0.0.1:8000.")
+        parser.add_argument("--path", action="append", dest="paths", help="Path to request, can be repeated.")
+        parser.add_argument("--concurrency", type=int, default=32, help="Number of concurrent clients.")
+        parser.add_argument("--requests", type=int, default=2000, help="Number of requests per server and path.")
+        parser.add_argument("--warmup", type=int, default=100, help="Requests sent before measuring.")
+        parser.add_argument("--token", help="Access token sent as Bearer authorization.")
+        parser.add_argument("--username", help="Log in with these credentials to get an access token.")
+        parser.add_argument("--password")
+
+    def handle(self, *args, **options):
+        paths = options["paths"] or DEFAULT_PATHS
+        self.stdout.write(f"{'server':<28} {'path':<36} {'req/s':>9} {'p50 ms':>8} {'p95 ms':>8} "
+                          f"{'p99 ms':>8} {'errors':>7}")
+
+        for server in options["servers"]:
+            token = options["token"] or self.login(server, options["username"], options["password"])
+            headers = {"Authorization": f"Bearer {token}"} if token else {}
+            for path in paths:
+                self.run(server, path, headers, options["concurrency"], options["warmup"])
+                result = self.run(server, path, headers, options["concurrency"], options["requests"])
+                self.stdout.write(
+                    f"{server:<28} {path:<36} {result['rps']:>9.1f} {result['p50']:>8.1f} {result['p95']:>8.1f} "
+                    f"{result['p99']:>8.1f} {result['errors']:>7}")
+
+    @staticmethod
+    def connect(server):
+        url = urlsplit(server)
+        connection_class = http.client.HTTPSConnection if url.scheme == "https" else http.client.HTTPConnection
+        return connection_class(url.hostname, url.port, timeout=30)
+
+    def login(self, server, username, password):
+        if not username:
+            return None
+        connection = self.connect(server)
+        body = json.dumps({"username": username, "password": password})
+        connection.request("POST", "/api/user/login/", body, {"Content-Type": "application/json"})
+        response = connection.getresponse()
+        payload = response.read()
+        connection.close()
+        if response.status != 200:
+            raise CommandError(f"Login on {server} failed with status {response.status}: {payload[:200]!r}")
+        return json.loads(payload)["access"]
+
+    def run(self, server, path, headers, concurrency, total):
+        """
+        Send `total` GET requests from `concurrency` clients and return the throughput and latencies.
+        """
+
+        latencies, errors = [], 0
+        lock = threading.Lock()
+        remaining = iter(range(total))
+
+        def client():
+            nonlocal errors
+            connection, timings, failures = self.connect(server), [], 0
+            while True:
+                with lock:
+                    if next(remaining, None) is None:
+                        break
+                started = time.perf_counter()
+                try:
+                    connection.request("GET", path, headers=headers)
+                    response = connection.getresponse()
+                    response.read()
+                    failures += response.status != 200
+                except (OSError, http.client.HTTPException):
+                    failures += 1
+                    connection.close()
+                    connection = self.connect(server)
+                timings.append(time.perf_counter() - started)
+            connection.close()
+            with lock:
+                latencies.extend(timings)
+                errors += failures
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            for _ in range(concurrency):
+                executor.submit(client)
+        elapsed = time.perf_counter() - started
+
+        return {
+            "rps": len(latencies) / elapsed if elapsed else 0.0,
+            "p50": percentile(latencies, 0.50) * 1000,
+            "p95": percentile(latencies, 0.95) * 1000,
+            "p99": percentile(latencies, 0.99) * 1000,
+            "errors": errors,
+        }
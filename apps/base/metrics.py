@@ -0,0 +1,214 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+# Upper bounds of the histogram buckets, in seconds for the durations
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 200)
+
+# Statistics of the request being processed, shared with the worker threads of async views
+current_stats = ContextVar("current_stats", default=None)
+
+
+class Histogram:
+    """
+    Histogram with fixed bucket bounds, its memory use does not grow with the number of observations.
+    """
+
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # the last one counts the values above all bounds
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative_counts(self):
+        total = 0
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            total += count
+            yield bound, total
+
+
+class MetricsRegistry:
+    """
+    Per-process registry of histograms and counters labelled by view, rendered in the Prometheus text format.
+
+    Every worker process keeps its own metrics, Prometheus aggregates the scrapes of all of them.
+
+    Example:
+        metrics.observe("http_request_duration_seconds", "ProductAPIViewSet.list", 0.012)
+        metrics.render()
+    """
+
+    histograms = {
+        "http_request_duration_seconds": ("Total latency of the requests.", DURATION_BUCKETS),
+        "db_query_count": ("Number of database queries per request.", QUERY_COUNT_BUCKETS),
+        "db_query_duration_seconds": ("Time spent in database queries per request.", DURATION_BUCKETS),
+        "serializer_duration_seconds": ("Time spent serializing the response data per request.", DURATION_BUCKETS),
+    }
+    counters = {
+        "query_budget_exceeded_total": "Number of requests that ran more queries than the budget of their view.",
+    }
+
+    def __init__(self, prefix="django"):
+        self.prefix = prefix
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def observe(self, name, view, value):
+        with self.lock:
+            histogram = self.values.get((name, view))
+            if histogram is None:
+                histogram = self.values[(name, view)] = Histogram(self.histograms[name][1])
+            histogram.observe(value)
+
+    def increment(self, name, view, amount=1):
+        with self.lock:
+            self.values[(name, view)] = self.values.get((name, view), 0) + amount
+
+    def get(self, name, view):
+        with self.lock:
+            return self.values.get((name, view))
+
+    def reset(self):
+        with self.lock:
+            self.values = {}
+
+    def render(self):
+        """
+        Return all metrics in the Prometheus text exposition format.
+        """
+
+        with self.lock:
+            values = sorted(self.values.items(), key=lambda item: item[0])
+            lines = []
+            for name in list(self.histograms) + list(self.counters):
+                metric = f"{self.prefix}_{name}"
+                is_histogram = name in self.histograms
+                help_text = self.histograms[name][0] if is_histogram else self.counters[name]
+                lines.append(f"# HELP {metric} {help_text}")
+                lines.append(f"# TYPE {metric} {'histogram' if is_histogram else 'counter'}")
+                for (value_name, view), value in values:
+                    if value_name != name:
+                        continue
+                    label = f'view="{escape_label(view)}"'
+                    if not is_histogram:
+                        lines.append(f"{metric}{{{label}}} {value}")
+                        continue
+                    for bound, count in value.cumulative_counts():
+                        lines.append(f'{metric}_bucket{{{label},le="{format_bound(bound)}"}} {count}')
+                    lines.append(f"{metric}_sum{{{label}}} {value.sum}")
+                    lines.append(f"{metric}_count{{{label}}} {value.count}")
+        return "\n".join(lines) + "\n"
+
+
+class RequestStats:
+    """
+    Database and serializer statistics of one request.
+
+    Attributes:
+        query_count (int): Number of queries run.
+        query_time (float): Time spent in the queries, in seconds.
+        serializer_time (float): Time spent in the outermost `to_representation()` calls, in seconds.
+        queries (list): SQL of the first `max_queries` queries, reported when the query budget is exceeded.
+    """
+
+    def __init__(self, max_queries=100):
+        self.query_count = 0
+        self.query_time = 0.0
+        self.serializer_time = 0.0
+        self.serializer_depth = 0
+        self.queries = []
+        self.max_queries = max_queries
+
+    def add_query(self, sql, duration):
+        self.query_count += 1
+        self.query_time += duration
+        if len(self.queries) < self.max_queries:
+            self.queries.append(sql)
+
+
+@contextmanager
+def collect_stats(max_queries=100):
+    """
+    Collect the statistics of the queries and serializers run inside the `with` block.
+    """
+
+    stats = RequestStats(max_queries)
+    token = current_stats.set(stats)
+    try:
+        yield stats
+    finally:
+        current_stats.reset(token)
+
+
+@contextmanager
+def timed_serialization():
+    """
+    Add the time spent inside the `with` block to the serializer time of the current request. Nested blocks
+    are not counted twice.
+    """
+
+    stats = current_stats.get()
+    if stats is None or stats.serializer_depth:
+        yield
+        return
+
+    stats.serializer_depth += 1
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        stats.serializer_time += time.perf_counter() - started
+        stats.serializer_depth -= 1
+
+
+def record_query(execute, sql, params, many, context):
+    """
+    Database execute wrapper counting and timing the queries of the current request.
+    """
+
+    stats = current_stats.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.add_query(sql, time.perf_counter() - started)
+
+
+def install_query_recorder(connection, **kwargs):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+def connect_query_recorder():
+    """
+    Install the query recorder on the connections of the current thread and on every new connection.
+    """
+
+    for connection in connections.all():
+        install_query_recorder(connection)
+    connection_created.connect(install_query_recorder, dispatch_uid="metrics-query-recorder")
+
+
+def escape_label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_bound(bound):
+    return "+Inf" if bound == float("inf") else repr(float(bound))
+
+
+metrics = MetricsRegistry()
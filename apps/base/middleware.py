@@ -1,24 +1,104 @@
+import logging
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
 from django.contrib.auth.middleware import AuthenticationMiddleware
-import threading
 
-# Create a thread-local storage to store the current request object.
-request_local = threading.local()
+from apps.base.metrics import collect_stats, metrics
+
+logger = logging.getLogger(__name__)
+
+# The request being processed and the user acting outside of a request. Context variables follow the code
+# that runs for a request (threads of sync views, tasks of async views), and are reset once it is done.
+current_request = ContextVar("current_request", default=None)
+current_acting_user = ContextVar("current_acting_user", default=None)
+
+
+@contextmanager
+def request_context(request):
+    """
+    Make the request the current request for the code run inside the `with` block.
+
+    Args:
+        request (HttpRequest): The request being processed.
+    """
+
+    token = current_request.set(request)
+    try:
+        yield request
+    finally:
+        current_request.reset(token)
+
+
+@contextmanager
+def acting_user(user):
+    """
+    Attribute the changes made inside the `with` block to the user, e.g. in background jobs or management
+    commands where there is no request. It takes precedence over the user of the current request.
+
+    Args:
+        user (User): The user stamped into the `created_by` and `updated_by` audit fields.
+
+    Example:
+        with acting_user(order.user):
+            order.save()
+    """
+
+    token = current_acting_user.set(user)
+    try:
+        yield user
+    finally:
+        current_acting_user.reset(token)
+
+
+def get_current_request():
+    """
+    Return the request being processed in the current context, or None.
+    """
+
+    return current_request.get()
+
+
+def get_current_user():
+    """
+    Return the user acting in the current context: the user set with `acting_user()`, or the authenticated
+    user of the current request.
+
+    Returns:
+        User or None: The acting user, or None outside a request or for anonymous requests.
+    """
+
+    user = current_acting_user.get()
+    if user is not None:
+        return user
+    request = current_request.get()
+    if request and request.user and request.user.is_authenticated:
+        return request.user
+    return None
 
 
 class RequestTrackerMiddleware(AuthenticationMiddleware):
+    sync_capable = True
+    async_capable = True
 
     def __init__(self, get_response):
         """
         Initialize the middleware.
 
         Args:
-            get_response (callable): The next middleware or view function in the chain.
+            get_response (callable): The next middleware or view function in the chain, sync or async.
         """
         self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
 
     def __call__(self, request):
         """
-        Process the incoming request and store the request object in thread-local storage.
+        Process the incoming request and make it the current request while the rest of the chain runs.
 
         Args:
             request (HttpRequest): The incoming request.
@@ -26,10 +106,102 @@ class RequestTrackerMiddleware(AuthenticationMiddleware):
         Returns:
             HttpResponse: The response generated by the next middleware or view function.
         """
-        # Store the current request in thread-local storage for access in the same thread.
-        request_local.current_request = request
+        if self.async_mode:
+            return self.__acall__(request)
+
+        # Store the current request in the context for the audit fields, it is reset after the response
+        with request_context(request):
+            return self.get_response(request)
+
+    async def __acall__(self, request):
+        with request_context(request):
+            return await self.get_response(request)
+
+
+class QueryBudgetExceeded(Exception):
+    """
+    Raised when a view runs more database queries than its budget and the budget mode is `raise`.
+    """
+
+
+def get_view_label(request):
+    """
+    Return the label of the view that handled the request, e.g. `ProductAPIViewSet.list` for viewsets and
+    `OrderListCreateView.get` for other views, or `unresolved` when no URL matched.
+    """
+
+    match = getattr(request, "resolver_match", None)
+    if match is None:
+        return "unresolved"
+    view = match.func
+    method = request.method.lower()
+    if getattr(view, "actions", None):
+        return f"{view.cls.__name__}.{view.actions.get(method, method)}"
+    view_class = getattr(view, "cls", None) or getattr(view, "view_class", None)
+    return f"{view_class.__name__ if view_class else view.__name__}.{method}"
+
+
+class InstrumentationMiddleware:
+    """
+    Record the latency, database query count, database time and serializer time of every request into the
+    histograms of `apps.base.metrics`, labelled by view and exposed at the metrics endpoint.
+
+    Views running more queries than their budget in `settings.INSTRUMENTATION['QUERY_BUDGETS']` are logged
+    with their SQL, or fail with `QueryBudgetExceeded` when `QUERY_BUDGET_MODE` is `raise` (as in the tests).
+    Budgets are keyed by view label or by view class name.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        """
+        Initialize the middleware.
+
+        Args:
+            get_response (callable): The next middleware or view function in the chain, sync or async.
+        """
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
 
-        # Continue processing the request and response in the middleware chain.
-        response = self.get_response(request)
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
 
+        started = time.perf_counter()
+        with collect_stats() as stats:
+            response = self.get_response(request)
+        self.record(request, stats, time.perf_counter() - started)
         return response
+
+    async def __acall__(self, request):
+        started = time.perf_counter()
+        with collect_stats() as stats:
+            response = await self.get_response(request)
+        self.record(request, stats, time.perf_counter() - started)
+        return response
+
+    def record(self, request, stats, duration):
+        label = get_view_label(request)
+        metrics.observe("http_request_duration_seconds", label, duration)
+        metrics.observe("db_query_count", label, stats.query_count)
+        metrics.observe("db_query_duration_seconds", label, stats.query_time)
+        metrics.observe("serializer_duration_seconds", label, stats.serializer_time)
+        self.check_query_budget(label, stats)
+
+    @staticmethod
+    def check_query_budget(label, stats):
+        config = settings.INSTRUMENTATION
+        budgets = config["QUERY_BUDGETS"]
+        budget = budgets.get(label, budgets.get(label.split(".")[0]))
+        if config["QUERY_BUDGET_MODE"] == "off" or budget is None or stats.query_count <= budget:
+            return
+
+        metrics.increment("query_budget_exceeded_total", label)
+        message = f"{label} ran {stats.query_count} queries, its budget is {budget}:\n" + "\n".join(
+            f"  {index}. {sql}" for index, sql in enumerate(stats.queries, 1))
+        if config["QUERY_BUDGET_MODE"] == "raise":
+            raise QueryBudgetExceeded(message)
+        logger.warning(message)
@@ -0,0 +1,48 @@
+from rest_framework import status
+from rest_framework.response import Response
+
+from apps.base.cache import catalog_cache
+
+
+class CatalogCacheMixin:
+    """
+    Serve the `list` and `retrieve` responses of a viewset from the catalog cache.
+
+    The serialized data of successful responses is cached per view, action, user and full request path,
+    and invalidated whenever an instance of one of the `cache_models` is saved or deleted. Views built from
+    some rows of a scoped model only (see `CatalogCache`), e.g. the products of the user, return these scopes
+    from `get_cache_models()`. Every response carries an `X-Cache` header telling whether it was a cache `HIT`
+    or `MISS`.
+
+    Attributes:
+        cache_models (tuple): Models the serialized data is built from.
+    """
+
+    cache_models = ()
+
+    def list(self, request, *args, **kwargs):
+        return self.get_cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.get_cached_response(super().retrieve, request, *args, **kwargs)
+
+    def get_cache_models(self, request):
+        return self.cache_models
+
+    def get_cache_key_parts(self, request):
+        return self.__class__.__name__, self.action, request.user.pk, request.get_full_path()
+
+    def get_cached_response(self, handler, request, *args, **kwargs):
+        response = None
+
+        def build():
+            nonlocal response
+            response = handler(request, *args, **kwargs)
+            return response.data if response.status_code == status.HTTP_200_OK else None
+
+        data, hit = catalog_cache.get_or_set(self.get_cache_key_parts(request), build,
+                                             self.get_cache_models(request))
+        if hit:
+            response = Response(data)
+        response["X-Cache"] = "HIT" if hit else "MISS"
+        return response
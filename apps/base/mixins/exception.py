@@ -1,3 +1,4 @@
+from django.conf import settings
 from django.http import Http404
 from rest_framework.response import Response
 from rest_framework import status
@@ -7,20 +8,44 @@ from rest_framework import exceptions
 
 
 class StockInsufficient(Exception):
-    pass
+    def __init__(self, message="", failed_items=None):
+        super().__init__(message)
+        self.failed_items = failed_items or []
 
 
 class OrderException(Exception):
     pass
 
 
+class LoginPoolSaturated(Exception):
+    pass
+
+
+class LoginPoolTimeout(Exception):
+    pass
+
+
 class OrderExceptionMixin:
     def handle_exception(self, exc):
-        if isinstance(exc, (StockInsufficient, OrderException)):
+        if isinstance(exc, StockInsufficient):
+            return Response({'detail': str(exc), 'failed_items': exc.failed_items},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if isinstance(exc, OrderException):
             return Response({'detail': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
         return super().handle_exception(exc)
 
 
+class LoginExceptionMixin:
+    def handle_exception(self, exc):
+        if isinstance(exc, LoginPoolSaturated):
+            return Response({'detail': str(exc)}, status=status.HTTP_429_TOO_MANY_REQUESTS,
+                            headers={'Retry-After': str(settings.LOGIN_POOL['RETRY_AFTER'])})
+        if isinstance(exc, LoginPoolTimeout):
+            return Response({'detail': str(exc)}, status=status.HTTP_503_SERVICE_UNAVAILABLE,
+                            headers={'Retry-After': str(settings.LOGIN_POOL['RETRY_AFTER'])})
+        return super().handle_exception(exc)
+
+
 class JWTExceptionMixin:
     def handle_exception(self, exc):
         if isinstance(exc, (jwt.ExpiredSignatureError, jwt.DecodeError)):
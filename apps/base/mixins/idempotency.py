@@ -0,0 +1,76 @@
+import hashlib
+import json
+
+from django.db import transaction
+from rest_framework import status
+from rest_framework.response import Response
+
+from apps.base.idempotency import IdempotencyKeyLost, idempotency_store
+
+
+class IdempotencyMixin:
+    """
+    Make the `create()` of a view idempotent for the requests sending an `Idempotency-Key` header.
+
+    The first request with a key runs as usual and its response is stored with the key, in the same
+    transaction as its changes. The same request sent again with the key gets the stored response, with an
+    `Idempotent-Replayed: true` header, without running again. While the first request is in progress, the
+    others get a `409 Conflict` to retry later. Requests that fail are not stored, they can be sent again. A
+    request outliving `IDEMPOTENCY['IN_FLIGHT_TIMEOUT']` whose key was taken over by a retry is rolled back
+    and gets a `409 Conflict` as well, the retry creates the object.
+
+    Keys are scoped per user and view, see `IdempotencyStore`.
+
+    Example:
+        class OrderListCreateView(IdempotencyMixin, generics.ListCreateAPIView):
+            ...
+    """
+
+    idempotency_header = "Idempotency-Key"
+    idempotency_key_max_length = 255
+
+    def get_idempotency_scope(self):
+        return self.__class__.__name__
+
+    @staticmethod
+    def get_request_fingerprint(request):
+        content = json.dumps([request.path, request.data], sort_keys=True, default=str)
+        return hashlib.sha256(content.encode()).hexdigest()
+
+    def create(self, request, *args, **kwargs):
+        key = request.headers.get(self.idempotency_header)
+        if not key:
+            return super().create(request, *args, **kwargs)
+        if len(key) > self.idempotency_key_max_length:
+            return Response({"detail": f"{self.idempotency_header} is longer than "
+                                       f"{self.idempotency_key_max_length} characters."},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        fingerprint = self.get_request_fingerprint(request)
+        record, claimed = idempotency_store.claim(request.user, self.get_idempotency_scope(), key, fingerprint)
+        if not claimed:
+            return self.replay(record, fingerprint)
+
+        try:
+            with transaction.atomic():
+                response = super().create(request, *args, **kwargs)
+                if response.status_code < status.HTTP_500_INTERNAL_SERVER_ERROR:
+                    idempotency_store.complete(record, response.status_code, response.data)
+                else:
+                    idempotency_store.release(record)
+        except IdempotencyKeyLost:
+            return self.replay(None, fingerprint)
+        except BaseException:
+            idempotency_store.release(record)
+            raise
+        return response
+
+    def replay(self, record, fingerprint):
+        if record is None or record.response_status is None:
+            return Response({"detail": f"A request with this {self.idempotency_header} is in progress."},
+                            status=status.HTTP_409_CONFLICT, headers={"Retry-After": "1"})
+        if record.fingerprint != fingerprint:
+            return Response({"detail": f"This {self.idempotency_header} was used for another request."},
+                            status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+        return Response(record.response_data, status=record.response_status,
+                        headers={"Idempotent-Replayed": "true"})
@@ -0,0 +1,48 @@
+from django.http import StreamingHttpResponse
+from rest_framework.settings import api_settings
+
+
+class StreamingExportMixin:
+    """
+    Export the whole queryset of a view as a JSON array streamed with a `StreamingHttpResponse`.
+
+    The rows are read with `QuerySet.iterator()` and serialized, rendered and sent by chunks of
+    `export_chunk_size`, so the memory used does not depend on the number of rows. Prefetches of the queryset
+    are done once per chunk.
+
+    Attributes:
+        export_chunk_size (int): Number of rows read, serialized and written at a time.
+        export_filename (str): File name suggested to the client.
+
+    Example:
+        class OrderExportAPIView(StreamingExportMixin, generics.GenericAPIView):
+            def get(self, request, *args, **kwargs):
+                return self.stream_export(request)
+    """
+
+    export_chunk_size = 500
+    export_filename = 'export.json'
+
+    def stream_export(self, request):
+        queryset = self.filter_queryset(self.get_queryset())
+        response = StreamingHttpResponse(self.iter_export(queryset), content_type='application/json')
+        response['Content-Disposition'] = f'attachment; filename="{self.export_filename}"'
+        return response
+
+    def iter_export(self, queryset):
+        renderer = api_settings.DEFAULT_RENDERER_CLASSES[0]()
+        separator = b'['
+        chunk = []
+        for row in queryset.iterator(chunk_size=self.export_chunk_size):
+            chunk.append(row)
+            if len(chunk) == self.export_chunk_size:
+                yield self.render_chunk(renderer, chunk, separator)
+                separator, chunk = b',', []
+        if chunk:
+            yield self.render_chunk(renderer, chunk, separator)
+            separator = b','
+        yield b'[]' if separator == b'[' else b']'
+
+    def render_chunk(self, renderer, rows, separator):
+        data = self.get_serializer(rows, many=True).data
+        return separator + b','.join(renderer.render(row) for row in data)
@@ -1,3 +1,4 @@
+from django.core.serializers.json import DjangoJSONEncoder
 from django.db import models
 from django.conf import settings
 
@@ -30,6 +31,22 @@ class DateTimeAuditModel(models.Model):
         abstract = True
 
 
+class UserHistoryAuditQuerySet(models.QuerySet):
+    """
+    QuerySet for models with user history audit fields.
+
+    `bulk_create()` does not call `save()` on the objects, so the `created_by` and `updated_by` fields are
+    populated here with the current user before the objects are inserted in a single query. The
+    `created_at` and `updated_at` fields are filled by Django itself through their `auto_now` options.
+    """
+
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = list(objs)
+        for obj in objs:
+            obj.populate_user_history()
+        return super().bulk_create(objs, *args, **kwargs)
+
+
 class UserHistoryAuditModel(models.Model):
     """
     Abstract base model that includes user history audit fields.
@@ -50,10 +67,16 @@ class UserHistoryAuditModel(models.Model):
       the deletion will be protected and prevented if there are objects referencing the user.
 
     Methods:
+        populate_user_history(self, user=None): Populates the 'created_by' and 'updated_by' fields
+        with the given user, or with the current user if available.
+
         save(self, *args, **kwargs): Overrides the default save method to
         automatically populate the 'created_by' and 'updated_by' fields
         with the current user if available.
 
+    Managers:
+        objects: Its `bulk_create()` populates the user history fields the same way `save()` does.
+
     Usage:
         You can inherit from this model to add user history tracking to models, which allows to keep a record of who
         created and updated each record.
@@ -64,6 +87,8 @@ class UserHistoryAuditModel(models.Model):
     Note:
     - Ensure that the `settings.AUTH_USER_MODEL` setting is correctly configured in project's settings
       to reference custom user model.
+    - Outside of a request (background jobs, management commands), wrap the changes in
+      `apps.base.middleware.acting_user(user)` to attribute them to a user.
     """
 
     created_by = models.ForeignKey(settings.AUTH_USER_MODEL, null=True, blank=True, on_delete=models.PROTECT,
@@ -71,16 +96,21 @@ class UserHistoryAuditModel(models.Model):
     updated_by = models.ForeignKey(settings.AUTH_USER_MODEL, null=True, blank=True, on_delete=models.PROTECT,
                                    related_name="%(class)s_updated")
 
+    objects = UserHistoryAuditQuerySet.as_manager()
+
     class Meta:
         abstract = True
 
+    def populate_user_history(self, user=None):
+        from apps.base.middleware import get_current_user
+        user = user or get_current_user()
+        if user:
+            if not self.created_by_id:
+                self.created_by = user
+            self.updated_by = user
+
     def save(self, *args, **kwargs):
-        from apps.base.middleware import request_local
-        request = getattr(request_local, "current_request", None)
-        if request and request.user and request.user.is_authenticated:
-            if not self.created_by:
-                self.created_by = request.user
-            self.updated_by = request.user
+        self.populate_user_history()
         super().save(*args, **kwargs)
 
 
@@ -114,3 +144,37 @@ class BaseModel(DateTimeAuditModel, UserHistoryAuditModel):
 
     class Meta:
         abstract = True
+
+
+class IdempotencyKey(models.Model):
+    """
+    Outcome of a request made with an `Idempotency-Key` header, see `apps.base.mixins.idempotency`.
+
+    Attributes:
+        user (User): The user who made the request, keys are scoped per user.
+        scope (str): The view handling the request.
+        key (str): The value of the header.
+        fingerprint (str): SHA-256 of the request path and data, a key sent again with another request is
+            rejected.
+        response_status (int): The status of the response, None while the request is in progress.
+        response_data (dict): The data of the response.
+        created_at (datetime): When the request started.
+        expires_at (datetime): When the key is forgotten.
+    """
+
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="+")
+    scope = models.CharField(max_length=100)
+    key = models.CharField(max_length=255)
+    fingerprint = models.CharField(max_length=64)
+    response_status = models.PositiveSmallIntegerField(null=True, blank=True)
+    response_data = models.JSONField(null=True, blank=True, encoder=DjangoJSONEncoder)
+    created_at = models.DateTimeField()
+    expires_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["user", "scope", "key"], name="idempotency_key_user_scope_key"),
+        ]
+
+    def __str__(self):
+        return f"{self.scope} {self.key}"
@@ -0,0 +1,214 @@
+from collections import OrderedDict
+
+from django.core import signing
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Keyset (cursor) pagination over a unique ordering of the queryset.
+
+    Instead of `COUNT(*)` and `OFFSET`, the next page is selected with a `WHERE` condition on the ordering
+    values of the last row of the current page, e.g. `created_at < c OR (created_at = c AND id < i)` for
+    `("-created_at", "-id")`, so every page costs the same as the first one when an index covers the ordering.
+    Cursors are signed and opaque to clients, and stay valid while rows are added or removed.
+
+    The total count is skipped unless the client asks for it with `?count=true`.
+
+    Attributes:
+        ordering (tuple): Default ordering, overridden by the `keyset_ordering` attribute of the view.
+            The last field must be unique, usually the primary key.
+    """
+
+    page_size = api_settings.PAGE_SIZE
+    page_size_query_param = 'size'
+    max_page_size = 100
+    cursor_query_param = 'cursor'
+    count_query_param = 'count'
+    ordering = ('-id',)
+    invalid_cursor_message = 'Invalid cursor'
+    cursor_salt = 'apps.base.pagination.keyset'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        self.ordering = tuple(getattr(view, 'keyset_ordering', None) or self.ordering)
+        self.fields = [(field.lstrip('-'), field.startswith('-')) for field in self.ordering]
+
+        include_count = request.query_params.get(self.count_query_param, '').lower() in ('1', 'true', 'yes')
+        self.count = queryset.count() if include_count else None
+
+        cursor = self.decode_cursor(request, queryset.model)
+        reverse = bool(cursor and cursor['reverse'])
+        if cursor:
+            queryset = queryset.filter(self.get_keyset_filter(cursor['values'], reverse))
+
+        ordering = [self.reverse_field(field) for field in self.ordering] if reverse else self.ordering
+        rows = list(queryset.order_by(*ordering)[:self.page_size + 1])
+        has_more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        if reverse:
+            rows.reverse()
+
+        self.has_next = has_more if not reverse else True
+        self.has_previous = has_more if reverse else cursor is not None
+        self.page = rows
+        return rows
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(size, self.max_page_size) if size > 0 else self.page_size
+
+    @staticmethod
+    def reverse_field(field):
+        return field[1:] if field.startswith('-') else f'-{field}'
+
+    def get_keyset_filter(self, values, reverse):
+        """
+        Build the lexicographic condition selecting the rows after (or before, when reversed) the key values.
+        """
+
+        condition = Q()
+        for index, (name, descending) in enumerate(self.fields):
+            lookups = {field_name: values[position] for position, (field_name, _) in enumerate(self.fields[:index])}
+            lookups[f"{name}__{'lt' if descending != reverse else 'gt'}"] = values[index]
+            condition |= Q(**lookups)
+        return condition
+
+    def encode_cursor(self, row, reverse):
+        values = [getattr(row, name) for name, _ in self.fields]
+        payload = {'v': [value.isoformat() if hasattr(value, 'isoformat') else str(value) for value in values],
+                   'r': int(reverse)}
+        cursor = signing.dumps(payload, salt=self.cursor_salt, compress=True)
+        return replace_query_param(self.base_url, self.cursor_query_param, cursor)
+
+    def decode_cursor(self, request, model):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            payload = signing.loads(encoded, salt=self.cursor_salt)
+            if len(payload['v']) != len(self.fields):
+                raise ValueError(encoded)
+            values = [model._meta.get_field(name).to_python(value)
+                      for (name, _), value in zip(self.fields, payload['v'])]
+        except (signing.BadSignature, FieldDoesNotExist, ValidationError, KeyError, TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        return {'values': values, 'reverse': bool(payload.get('r'))}
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        return self.encode_cursor(self.page[0], reverse=True)
+
+    def get_paginated_response(self, data):
+        response = OrderedDict()
+        if self.count is not None:
+            response['count'] = self.count
+        response['next'] = self.get_next_link()
+        response['previous'] = self.get_previous_link()
+        response['results'] = data
+        return Response(response)
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'count': {'type': 'integer', 'example': 123},
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+    def get_schema_operation_parameters(self, view):
+        return [
+            {
+                'name': self.cursor_query_param,
+                'required': False,
+                'in': 'query',
+                'description': 'The pagination cursor value.',
+                'schema': {'type': 'string'},
+            },
+            {
+                'name': self.page_size_query_param,
+                'required': False,
+                'in': 'query',
+                'description': 'Number of results to return per page.',
+                'schema': {'type': 'integer'},
+            },
+            {
+                'name': self.count_query_param,
+                'required': False,
+                'in': 'query',
+                'description': 'Include the total count of results (costs a COUNT query).',
+                'schema': {'type': 'boolean'},
+            },
+        ]
+
+
+class HybridPagination(BasePagination):
+    """
+    Page number pagination by default, keyset pagination on demand.
+
+    The keyset mode is used when the request has a `cursor` or `?pagination=cursor` parameter, or when the
+    view sets `pagination_mode = 'cursor'`, and only for views declaring a `keyset_ordering`. Clients can go
+    back to page numbers with `?pagination=page`.
+
+    Example:
+        class MyListView(generics.ListAPIView):
+            keyset_ordering = ('-created_at', '-id')
+            pagination_mode = 'page'  # default, ?pagination=cursor switches to keyset pagination
+    """
+
+    mode_query_param = 'pagination'
+    page_number_class = PageNumberPagination
+    keyset_class = KeysetPagination
+
+    def __init__(self):
+        self.paginator = self.page_number_class()
+
+    def get_mode(self, request, view):
+        mode = request.query_params.get(self.mode_query_param)
+        if not mode:
+            mode = 'cursor' if self.keyset_class.cursor_query_param in request.query_params else getattr(
+                view, 'pagination_mode', 'page')
+        return 'cursor' if mode == 'cursor' and getattr(view, 'keyset_ordering', None) else 'page'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        paginator_class = self.keyset_class if self.get_mode(request, view) == 'cursor' else self.page_number_class
+        self.paginator = paginator_class()
+        return self.paginator.paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        return self.paginator.get_paginated_response(data)
+
+    def get_paginated_response_schema(self, schema):
+        return self.page_number_class().get_paginated_response_schema(schema)
+
+    def get_schema_operation_parameters(self, view):
+        parameters = self.page_number_class().get_schema_operation_parameters(view)
+        if getattr(view, 'keyset_ordering', None):
+            parameters += [{
+                'name': self.mode_query_param,
+                'required': False,
+                'in': 'query',
+                'description': 'Pagination mode, `page` or `cursor`.',
+                'schema': {'type': 'string', 'enum': ['page', 'cursor']},
+            }] + self.keyset_class().get_schema_operation_parameters(view)
+        return parameters
@@ -0,0 +1,44 @@
+import decimal
+
+from rest_framework.utils import encoders
+from rest_framework.renderers import JSONRenderer
+from rest_framework.settings import api_settings
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    JSON renderer backed by orjson, which encodes straight to bytes several times faster than the standard
+    library encoder. Falls back to DRF's `JSONRenderer` when orjson is not installed and for indented or
+    ASCII-only output.
+
+    The output is the one of `JSONRenderer`, except for the raw values serializers would have formatted:
+    `Decimal` values are rendered as strings (numbers with `COERCE_DECIMAL_TO_STRING = False`) and datetimes
+    in RFC 3339 with a `Z` suffix for UTC.
+    """
+
+    options = orjson.OPT_NON_STR_KEYS | orjson.OPT_UTC_Z if orjson else 0
+    encoder = encoders.JSONEncoder()
+
+    @classmethod
+    def default(cls, obj):
+        if isinstance(obj, decimal.Decimal):
+            return str(obj) if api_settings.COERCE_DECIMAL_TO_STRING else float(obj)
+        return cls.encoder.default(obj)
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if orjson is None or self.ensure_ascii or not self.compact or self.get_indent(
+                accepted_media_type, renderer_context or {}) is not None:
+            return super().render(data, accepted_media_type, renderer_context)
+        if data is None:
+            return b''
+
+        ret = orjson.dumps(data, default=self.default, option=self.options)
+        # Same as JSONRenderer, \u2028 and \u2029 are escaped to output a strict JavaScript subset
+        if b'\xe2\x80\xa8' in ret or b'\xe2\x80\xa9' in ret:
+            ret = ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+        return ret
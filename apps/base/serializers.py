@@ -0,0 +1,178 @@
+import decimal
+from collections import OrderedDict
+from contextlib import contextmanager
+from functools import cached_property
+from operator import attrgetter
+
+from django.core.exceptions import ObjectDoesNotExist
+from rest_framework import serializers
+from rest_framework.fields import SkipField, empty
+from rest_framework.relations import PKOnlyObject
+from rest_framework.settings import api_settings
+
+from apps.base.metrics import current_stats, timed_serialization
+
+
+class InstrumentedSerializerMixin:
+    """
+    Count the time spent in `to_representation()` as serializer time of the current request, see
+    `InstrumentationMiddleware`. Lazy queries run by the serializer are included.
+    """
+
+    def to_representation(self, instance):
+        stats = current_stats.get()
+        if stats is None or stats.serializer_depth:
+            return super().to_representation(instance)
+        with timed_serialization():
+            return super().to_representation(instance)
+
+
+def compile_decimal(field):
+    coerce_to_string = getattr(field, 'coerce_to_string', api_settings.COERCE_DECIMAL_TO_STRING)
+    if field.decimal_places is None or not coerce_to_string or field.localize:
+        return None
+
+    # The quantum and the context of DecimalField.quantize(), built once instead of for every value
+    quantum = decimal.Decimal('.1') ** field.decimal_places
+    context = decimal.getcontext().copy()
+    if field.max_digits is not None:
+        context.prec = field.max_digits
+    rounding = field.rounding
+
+    def format_decimal(value):
+        if not isinstance(value, decimal.Decimal):
+            value = decimal.Decimal(str(value).strip())
+        return '{:f}'.format(value.quantize(quantum, rounding=rounding, context=context))
+    return format_decimal
+
+
+def compile_dict(field):
+    child = compile_field(field.child)
+    if child is None:
+        return None
+    return lambda value: {str(key): child(item) if item is not None else None for key, item in value.items()}
+
+
+# Field types formatted by `compile_field()`, the subclasses go through their DRF field
+COMPILED_FIELD_TYPES = (serializers.IntegerField, serializers.CharField, serializers.ReadOnlyField,
+                        serializers.DecimalField, serializers.DictField)
+
+
+def compile_field(field):
+    """
+    Return a function giving the same representation as `field.to_representation()` for the non None values,
+    or None when the field has no compiled form.
+    """
+
+    field_type = type(field)
+    if field_type is serializers.IntegerField:
+        return int
+    if field_type is serializers.CharField:
+        return str
+    if field_type is serializers.ReadOnlyField:
+        return lambda value: value
+    if field_type is serializers.DecimalField:
+        return compile_decimal(field)
+    if field_type is serializers.DictField:
+        return compile_dict(field)
+    return None
+
+
+class CompiledSerializerMixin:
+    """
+    Faster `to_representation()` for read serializers, giving the same output as DRF.
+
+    The fields are analysed once per serializer class and set of fields: plain attributes are read with
+    `attrgetter` and the integer, string, decimal and dict values are formatted by precomputed functions, e.g.
+    the decimal quantum and context are built once instead of for every value. Relations, method fields and the
+    other field types (nested serializers included, which may be compiled as well) go through their DRF field.
+    Write serializers keep the DRF representation.
+
+    Example:
+        class ProductSerializer(CompiledSerializerMixin, serializers.ModelSerializer):
+            ...
+    """
+
+    compiled = True  # switched off by `compiled_serializers(False)` to compare with the DRF output
+
+    @staticmethod
+    def get_field_signature(field):
+        # The compiled functions depend on the options of the field (e.g. the decimal places), the other fields
+        # only on their source
+        options = repr(field) if type(field) in COMPILED_FIELD_TYPES else None
+        return field.field_name, field.source, type(field), options
+
+    @classmethod
+    def get_compiled_plan(cls, serializer):
+        """
+        Return the compiled plan of the readable fields of `serializer`, built once per class and field set.
+        The fields may vary between the instances of a class, e.g. with the context of the request.
+        """
+
+        fields = list(serializer._readable_fields)
+        key = tuple(cls.get_field_signature(field) for field in fields)
+        plans = cls.__dict__.get('_compiled_plans')
+        if plans is None:
+            plans = cls._compiled_plans = {}
+        plan = plans.get(key)
+        if plan is None:
+            plan = []
+            for field in fields:
+                plain = field.source != '*' and not isinstance(
+                    field, (serializers.RelatedField, serializers.ManyRelatedField, serializers.HiddenField))
+                getter = attrgetter('.'.join(field.source_attrs)) if plain else None
+                plan.append((field.field_name, getter, compile_field(field) if plain else None))
+            plans[key] = plan
+        return plan
+
+    @cached_property
+    def compiled_fields(self):
+        # Bound once per serializer instance, i.e. once per page for the child of a list serializer
+        fields = self.fields
+        return [(name, getter, formatter, fields[name])
+                for name, getter, formatter in self.get_compiled_plan(self)]
+
+    def to_representation(self, instance):
+        if not self.compiled:
+            return super().to_representation(instance)
+
+        ret = OrderedDict()
+        for name, getter, formatter, field in self.compiled_fields:
+            attribute = empty
+            if getter is not None:
+                try:
+                    attribute = getter(instance)
+                except (AttributeError, KeyError, ObjectDoesNotExist):
+                    pass
+            if attribute is empty or callable(attribute):
+                # Relations, callables, defaults, nullable and skipped fields are handled by DRF
+                try:
+                    attribute = field.get_attribute(instance)
+                except SkipField:
+                    continue
+                if isinstance(attribute, PKOnlyObject):
+                    ret[name] = None if attribute.pk is None else field.to_representation(attribute)
+                    continue
+
+            if attribute is None:
+                ret[name] = None
+            elif formatter is not None:
+                ret[name] = formatter(attribute)
+            else:
+                ret[name] = field.to_representation(attribute)
+        return ret
+
+
+@contextmanager
+def compiled_serializers(enabled):
+    """
+    Enable or disable the compiled representations inside the `with` block, e.g. to compare their output or
+    speed with the DRF ones.
+    """
+
+    previous = CompiledSerializerMixin.compiled
+    CompiledSerializerMixin.compiled = enabled
+    try:
+        yield
+    finally:
+        CompiledSerializerMixin.compiled = previous
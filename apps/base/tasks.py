@@ -0,0 +1,12 @@
+from celery import shared_task
+
+from apps.base.idempotency import idempotency_store
+
+
+@shared_task
+def purge_idempotency_keys():
+    """
+    Delete the expired idempotency keys, run periodically by Celery beat (see `CELERY_BEAT_SCHEDULE`).
+    """
+
+    return idempotency_store.purge()
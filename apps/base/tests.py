@@ -1,9 +1,42 @@
-from django.test import TestCase
+import asyncio
+import re
+from datetime import datetime, timezone as dt_timezone
+from decimal import Decimal
+from io import StringIO
+from collections import Counter
+from unittest.mock import patch
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db import connection
+from django.http import HttpResponse
+from django.test import AsyncClient, Client, RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.contrib.auth import get_user_model
+from rest_framework import serializers
+from rest_framework.renderers import JSONRenderer
+from apps.base.renderers import FastJSONRenderer
+from rest_framework.request import Request
 from rest_framework.test import APIClient
+from rest_framework.throttling import BaseThrottle
 from rest_framework_simplejwt.tokens import RefreshToken
-from apps.order.models import Order
+from apps.base.metrics import metrics
+from apps.base.serializers import CompiledSerializerMixin, compiled_serializers
+from apps.base.middleware import (
+    QueryBudgetExceeded,
+    RequestTrackerMiddleware,
+    acting_user,
+    get_current_request,
+    get_current_user,
+)
+from apps.order.models import Order, OrderItem
+from apps.order.serializers import OrderItemCompactSerializer, OrderItemReadSerializer
 from apps.product.models import Product, ProductReview
+from apps.product.views import ProductAsyncAPIView
+from apps.product.serializers import ProductReviewSerializer, ProductSerializer
+from apps.user.serializers import UserSerializer
+from apps.user.tokens import UserRefreshToken
 
 
 class APITestCase(TestCase):
@@ -12,6 +45,8 @@ class APITestCase(TestCase):
     """
 
     def setUp(self):
+        for cache in caches.all():
+            cache.clear()
         self.client = APIClient()
         self.user = get_user_model().objects.create_user(
             username='testuser',
@@ -49,3 +84,244 @@ class APITestCase(TestCase):
     def set_auth_header(self, request):
         request.headers['Authorization'] = f'Bearer {self.token}'
 
+
+def normalize_sql(sql):
+    # Queries differing only by their literal values are the same query run for different rows
+    sql = re.sub(r"'(?:[^']|'')*'", "?", sql)
+    sql = re.sub(r"\b\d+(?:\.\d+)?\b", "?", sql)
+    return re.sub(r"\(\?(?:, \?)*\)", "(...)", sql)
+
+
+class QueryScalingMixin:
+    """
+    Assert that an endpoint runs the same number of queries for N rows and for `scaling_factor` times N rows,
+    which catches the queries run per row (N+1 queries) by views and serializers.
+
+    The rows are added by a seed method taking the number of rows to add. On failure, the queries repeated
+    for the additional rows are reported with their SQL.
+
+    Example:
+        class OrderQueryTests(QueryScalingMixin, APITestCase):
+            def seed_orders(self, count):
+                ...
+
+            def test_order_list_queries(self):
+                self.assertQueriesDoNotScale('/api/orders/', self.seed_orders)
+    """
+
+    scaling_rows = 1
+    scaling_factor = 10  # N and 10N rows both fit in the default page size
+
+    def capture_queries(self, path, **extra):
+        # Cached responses and users would hide queries, and the query budgets are checked separately
+        for cache in caches.all():
+            cache.clear()
+        instrumentation = {**settings.INSTRUMENTATION, 'QUERY_BUDGET_MODE': 'off'}
+        with self.settings(INSTRUMENTATION=instrumentation), CaptureQueriesContext(connection) as context:
+            response = self.client.get(path, **extra)
+        self.assertEqual(response.status_code, 200, f'GET {path} returned {response.status_code}')
+        return [query['sql'] for query in context.captured_queries]
+
+    def assertQueriesDoNotScale(self, path, seed, rows=None, factor=None, **extra):
+        rows = rows or self.scaling_rows
+        factor = factor or self.scaling_factor
+        seed(rows)
+        small = self.capture_queries(path, **extra)
+        seed(rows * factor - rows)
+        large = self.capture_queries(path, **extra)
+        if len(small) == len(large):
+            return
+
+        small_counts = Counter(normalize_sql(sql) for sql in small)
+        examples = {normalize_sql(sql): sql for sql in large}
+        repeated = [
+            f'  {small_counts[query]} -> {count} times: {examples[query]}'
+            for query, count in Counter(normalize_sql(sql) for sql in large).items() if count != small_counts[query]
+        ]
+        self.fail(f'GET {path} ran {len(small)} queries with {rows} rows and {len(large)} with {rows * factor} '
+                  f'rows, queries run per row:\n' + '\n'.join(repeated))
+
+
+class RequestContextTests(APITestCase):
+
+    def test_request_is_not_kept_after_response(self):
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.token}')
+        self.client.get('/api/orders/')
+        self.assertIsNone(get_current_request())
+        self.assertIsNone(get_current_user())
+
+    def test_acting_user_stamps_audit_fields(self):
+        with acting_user(self.user):
+            product = Product.objects.create(name='Job Product', description='', price=1, stock_quantity=1)
+        self.assertEqual(product.created_by, self.user)
+        self.assertEqual(product.updated_by, self.user)
+        self.assertIsNone(get_current_user())
+
+    def test_async_middleware_scopes_request(self):
+        seen = []
+
+        async def get_response(request):
+            await asyncio.sleep(0)
+            seen.append(get_current_request())
+            return HttpResponse()
+
+        middleware = RequestTrackerMiddleware(get_response)
+        request = RequestFactory().get('/')
+        asyncio.run(middleware(request))
+        self.assertEqual(seen, [request])
+        self.assertIsNone(get_current_request())
+
+
+@override_settings(ROOT_URLCONF='ecommerce_project.asgi_urls')
+class AsyncViewTests(APITestCase):
+
+    def get_async(self, path, token):
+        headers = {'Authorization': f'Bearer {token}'} if token else {}
+        return async_to_sync(AsyncClient().get)(path, headers=headers)
+
+    def test_async_responses_match_sync_views(self):
+        OrderItem.objects.create(order=self.order, product=self.product, quantity=2)
+        paths = ['/api/products/', '/api/products/?pagination=cursor', f'/api/products/{self.product.id}/',
+                 f'/api/products/{self.product.id}/reviews/', '/api/orders/', '/api/orders/?pagination=cursor']
+        claims_token = str(UserRefreshToken.for_user(self.user).access_token)
+
+        for token in (self.token, claims_token):
+            self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+            for path in paths:
+                with self.settings(ROOT_URLCONF='ecommerce_project.urls'):
+                    expected = self.client.get(path)
+                response = self.get_async(path, token)
+                self.assertEqual(response.status_code, 200, path)
+                self.assertEqual(response.json(), expected.json(), path)
+
+    def test_async_errors_match_sync_views(self):
+        self.assertEqual(self.get_async('/api/products/', None).status_code, 403)
+        self.assertEqual(self.get_async('/api/products/0/', self.token).status_code, 404)
+
+    def test_async_views_negotiate_content(self):
+        response = async_to_sync(AsyncClient().get)(
+            '/api/products/', headers={'Authorization': f'Bearer {self.token}', 'Accept': 'application/xml'})
+        self.assertEqual(response.status_code, 406)
+
+    def test_async_views_are_throttled(self):
+        class DenyThrottle(BaseThrottle):
+            def allow_request(self, request, view):
+                return False
+
+        with patch.object(ProductAsyncAPIView, 'throttle_classes', [DenyThrottle]):
+            self.assertEqual(self.get_async('/api/products/', self.token).status_code, 429)
+
+    def test_other_methods_use_sync_views(self):
+        response = async_to_sync(AsyncClient().post)(
+            '/api/products/', {'name': 'Async Product', 'description': '', 'price': '5.00', 'stock_quantity': 3},
+            content_type='application/json', headers={'Authorization': f'Bearer {self.token}'})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.get_async('/api/products/', self.token).json()['count'], 2)
+
+
+class InstrumentationTests(APITestCase):
+
+    def setUp(self):
+        super().setUp()
+        metrics.reset()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.token}')
+
+    def test_request_metrics_are_recorded_per_view(self):
+        self.client.get('/api/products/')
+        self.assertEqual(metrics.get('http_request_duration_seconds', 'ProductAPIViewSet.list').count, 1)
+        self.assertGreater(metrics.get('db_query_count', 'ProductAPIViewSet.list').sum, 0)
+        self.assertGreater(metrics.get('serializer_duration_seconds', 'ProductAPIViewSet.list').sum, 0)
+
+        with self.settings(INSTRUMENTATION={**settings.INSTRUMENTATION, 'METRICS_TOKEN': 'scraper'}):
+            response = Client().get('/internal/metrics/', HTTP_AUTHORIZATION='Bearer scraper')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('django_db_query_count_bucket{view="ProductAPIViewSet.list",le="+Inf"} 1',
+                      response.content.decode())
+
+    def test_metrics_endpoint_needs_the_token(self):
+        client = Client()
+        # Disabled without a token, whatever the address
+        self.assertEqual(client.get('/internal/metrics/').status_code, 404)
+        with self.settings(INSTRUMENTATION={**settings.INSTRUMENTATION, 'METRICS_TOKEN': 'scraper'}):
+            self.assertEqual(client.get('/internal/metrics/').status_code, 404)
+            self.assertEqual(client.get('/internal/metrics/', HTTP_AUTHORIZATION='Bearer other').status_code, 404)
+            self.assertEqual(client.get('/internal/metrics/', HTTP_AUTHORIZATION='Bearer scraper').status_code, 200)
+
+    def test_query_budget_fails_with_sql(self):
+        budgets = {**settings.INSTRUMENTATION, 'QUERY_BUDGETS': {'ProductAPIViewSet': 0}}
+        with self.settings(INSTRUMENTATION=budgets):
+            with self.assertRaisesMessage(QueryBudgetExceeded, 'SELECT'):
+                self.client.get('/api/products/')
+        self.assertEqual(metrics.get('query_budget_exceeded_total', 'ProductAPIViewSet.list'), 1)
+
+        with self.settings(INSTRUMENTATION={**budgets, 'QUERY_BUDGET_MODE': 'warn'}):
+            with self.assertLogs('apps.base.middleware', 'WARNING'):
+                self.assertEqual(self.client.get('/api/products/?page=1').status_code, 200)
+
+
+class CompiledSerializerTests(APITestCase):
+
+    def render(self, serializer_class, instances, compiled):
+        request = Request(RequestFactory().get('/api/products/'))
+        with compiled_serializers(compiled):
+            return JSONRenderer().render(serializer_class(instances, many=True, context={'request': request}).data)
+
+    def test_compiled_json_is_identical(self):
+        self.user.profile_photo = 'user/profile/photo.jpg'
+        self.user.save()
+        Product.objects.create(name='No Creator', description='', price='0.50', stock_quantity=0)
+        ProductReview.objects.create(user=self.user, product=self.product, text='', rating=1)
+        OrderItem.objects.create(order=self.order, product=self.product, quantity=3)
+
+        for serializer_class, queryset in (
+            (ProductSerializer, Product.objects.select_related('created_by')),
+            (ProductReviewSerializer, ProductReview.objects.select_related('product__created_by', 'user')),
+            (OrderItemReadSerializer, OrderItem.objects.select_related('product__created_by')),
+            (OrderItemCompactSerializer, OrderItem.objects.select_related('product')),
+        ):
+            instances = list(queryset)
+            self.assertEqual(self.render(serializer_class, instances, compiled=True),
+                             self.render(serializer_class, instances, compiled=False), serializer_class.__name__)
+
+    def test_compiled_plan_follows_the_fields(self):
+        class PriceSerializer(CompiledSerializerMixin, serializers.Serializer):
+            price = serializers.DecimalField(max_digits=10, decimal_places=2)
+
+            def get_fields(self):
+                # The precision of the price depends on the request
+                fields = super().get_fields()
+                if self.context.get('precise'):
+                    fields['price'] = serializers.DecimalField(max_digits=10, decimal_places=4)
+                    fields['name'] = serializers.CharField()
+                return fields
+
+        self.assertEqual(PriceSerializer(self.product).data, {'price': '29.99'})
+        self.assertEqual(PriceSerializer(self.product, context={'precise': True}).data,
+                         {'price': '29.9900', 'name': 'Test Product'})
+        self.assertEqual(PriceSerializer(self.product).data, {'price': '29.99'})
+
+    def test_write_serializers_are_not_compiled(self):
+        self.assertNotIsInstance(UserSerializer(), CompiledSerializerMixin)
+        response = self.client.post('/api/user/register/', {'username': 'new@example.com', 'password': 'pass1234'})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(set(response.data), {'id', 'profile_photo', 'name', 'username'})
+
+    def test_bench_serializers_command(self):
+        out = StringIO()
+        call_command('bench_serializers', rows=5, repeat=2, stdout=out)
+        self.assertIn('OrderItemReadSerializer', out.getvalue())
+
+
+class FastJSONRendererTests(TestCase):
+
+    def test_output_matches_json_renderer(self):
+        data = {'id': 1, 'name': 'Caf\u00e9 \u2028 \u2029 "quoted"', 'price': '19.99', 'ratio': 0.5,
+                'items': [{'ok': True, 'none': None}], 'histogram': {'1': 0, '5': 2}}
+        self.assertEqual(FastJSONRenderer().render(data), JSONRenderer().render(data))
+        self.assertEqual(FastJSONRenderer().render(data, 'application/json; indent=4'),
+                         JSONRenderer().render(data, 'application/json; indent=4'))
+
+    def test_decimals_and_datetimes(self):
+        created_at = datetime(2024, 5, 1, 12, 30, tzinfo=dt_timezone.utc)
+        self.assertEqual(FastJSONRenderer().render({'price': Decimal('19.90'), 'created_at': created_at}),
+                         b'{"price":"19.90","created_at":"2024-05-01T12:30:00Z"}')
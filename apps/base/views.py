@@ -1,3 +1,117 @@
-from django.shortcuts import render
+import asyncio
 
-# Create your views here.
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import Http404, HttpResponse
+from django.utils.crypto import constant_time_compare
+from rest_framework import generics
+from rest_framework.response import Response
+
+from apps.base.cache import catalog_cache
+from apps.base.metrics import metrics
+
+
+class AsyncAPIView(generics.GenericAPIView):
+    """
+    Base of the async views of the ASGI deployment.
+
+    The methods with an async handler go through the `APIView` machinery, so authentication, permissions,
+    throttles, content negotiation and exception handling are the ones of the DRF views and the responses are
+    the same. `initial()` runs in a worker thread as it may read the cache or the database, the handler in the
+    event loop. The other methods are handed to `sync_view`, the DRF view of the same URL, in a worker thread.
+
+    Attributes:
+        sync_view (callable): The DRF view handling the methods without an async handler.
+    """
+
+    sync_view = None
+
+    async def dispatch(self, request, *args, **kwargs):
+        handler = None
+        if request.method.lower() in self.http_method_names:
+            handler = getattr(self, request.method.lower(), None)
+        if not asyncio.iscoroutinefunction(handler):
+            handler = None
+            if self.sync_view is not None:
+                return await sync_to_async(self.sync_view)(request, *args, **kwargs)
+
+        # Same as APIView.dispatch(), with the handler awaited
+        self.args = args
+        self.kwargs = kwargs
+        request = self.initialize_request(request, *args, **kwargs)
+        self.request = request
+        self.headers = self.default_response_headers
+        try:
+            await sync_to_async(self.initial)(request, *args, **kwargs)
+            if handler is None:
+                response = self.http_method_not_allowed(request, *args, **kwargs)
+            else:
+                response = await handler(request, *args, **kwargs)
+        except Exception as exc:
+            response = self.handle_exception(exc)
+
+        self.response = self.finalize_response(request, response, *args, **kwargs)
+        return self.response
+
+
+class AsyncReadAPIView(AsyncAPIView):
+    """
+    Async view serving the GET requests of a DRF endpoint, used by the ASGI deployment.
+
+    Filters, pagination and serializers are the ones of the DRF views, so the responses are the same. Filtering
+    and pagination run in a worker thread, objects are fetched with the async ORM and the catalog cache is read
+    with the async methods of its backend. The querysets must load every relation the serializer reads.
+
+    Attributes:
+        sync_view (callable): The DRF view handling the methods other than GET.
+        cache_models (tuple): Models the serialized data is built from. When set, the data is served from the
+            catalog cache like `CatalogCacheMixin` does.
+
+    Example:
+        path('products/', ProductAsyncAPIView.as_view(sync_view=ProductAPIViewSet.as_view({'post': 'create'})))
+    """
+
+    cache_models = ()
+
+    async def get(self, request, *args, **kwargs):
+        handler = self.retrieve if (self.lookup_url_kwarg or self.lookup_field) in kwargs else self.list
+        if not self.cache_models:
+            return Response(await handler(request, *args, **kwargs))
+
+        parts = self.__class__.__name__, handler.__name__, request.user.pk, request.get_full_path()
+        data, hit = await catalog_cache.aget_or_set(parts, lambda: handler(request, *args, **kwargs),
+                                                    self.get_cache_models(request))
+        return Response(data, headers={'X-Cache': 'HIT' if hit else 'MISS'})
+
+    def get_cache_models(self, request):
+        return self.cache_models
+
+    def get_page(self):
+        return self.paginate_queryset(self.filter_queryset(self.get_queryset()))
+
+    async def list(self, request, *args, **kwargs):
+        page = await sync_to_async(self.get_page)()
+        return self.get_paginated_response(self.get_serializer(page, many=True).data).data
+
+    async def retrieve(self, request, *args, **kwargs):
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        queryset = self.get_queryset()
+        try:
+            instance = await queryset.aget(**{self.lookup_field: kwargs[lookup_url_kwarg]})
+        except queryset.model.DoesNotExist:
+            raise Http404
+        self.check_object_permissions(request, instance)
+        return self.get_serializer(instance).data
+
+
+def metrics_view(request):
+    """
+    Serve the request metrics in the Prometheus text format, to the requests carrying the bearer token of
+    `settings.INSTRUMENTATION['METRICS_TOKEN']` only. Without a token configured the endpoint is disabled.
+    """
+
+    token = settings.INSTRUMENTATION['METRICS_TOKEN']
+    authorization = request.META.get('HTTP_AUTHORIZATION', '')
+    if not token or not constant_time_compare(authorization, f'Bearer {token}'):
+        raise Http404
+    return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -1,6 +1,6 @@
 # from django.apps import apps
 from django.contrib import admin
-from .models import Order, OrderItem
+from .models import Order, OrderEvent, OrderItem, StockReservation, UserOrderSummary
 
 # app_models = apps.get_app_config('order').get_models()
 # admin.site.register(list(app_models))
@@ -16,3 +16,19 @@ class OrderAdmin(admin.ModelAdmin):
 
 
 admin.site.register(OrderItem)
+
+
+@admin.register(StockReservation)
+class StockReservationAdmin(admin.ModelAdmin):
+    list_display = ["order", "product", "quantity", "expires_at"]
+
+
+@admin.register(OrderEvent)
+class OrderEventAdmin(admin.ModelAdmin):
+    list_display = ["order_id", "kind", "user", "total_price", "item_count", "occurred_at", "processed_at"]
+    list_filter = ["kind"]
+
+
+@admin.register(UserOrderSummary)
+class UserOrderSummaryAdmin(admin.ModelAdmin):
+    list_display = ["user", "order_count", "lifetime_total", "last_order_at"]
@@ -4,3 +4,15 @@ PENDING = 'pending'
 SHIPPED = 'shipped'
 DELIVERED = 'delivered'
 CANCELED = 'canceled'
+
+# The statuses an order may move to from each status, see apps.order.transitions
+ORDER_TRANSITIONS = {
+    PENDING: (SHIPPED, CANCELED),
+    SHIPPED: (DELIVERED,),
+    DELIVERED: (),
+    CANCELED: (),
+}
+
+# for order events
+ORDER_CREATED = 'created'
+ORDER_UPDATED = 'updated'
@@ -0,0 +1,37 @@
+import uuid
+
+from django.db import transaction
+from django.utils import timezone
+
+
+def publish_order_event(kind, order, quantities, product_ids=None):
+    """
+    Send an order change to the order event pipeline once the current transaction commits, see
+    `apps.order.tasks.process_order_event`. Nothing is sent when the transaction is rolled back, and a broker
+    failure is logged without failing the committed change.
+
+    Args:
+        kind (str): The change, `ORDER_CREATED` or `ORDER_UPDATED`.
+        order (Order): The changed order.
+        quantities (dict): Mapping of product id to the ordered quantity, for the whole order.
+        product_ids (iterable, optional): Products whose stock changed, all the ordered ones by default.
+
+    Returns:
+        dict: The event, as sent to the task.
+    """
+
+    from apps.order.tasks import process_order_event
+
+    event = {
+        "id": str(uuid.uuid4()),
+        "kind": kind,
+        "order_id": order.pk,
+        "user_id": order.user_id,
+        "total_price": str(order.total_price),
+        "item_count": sum(quantities.values()),
+        "product_count": len(quantities),
+        "product_ids": sorted(quantities if product_ids is None else product_ids),
+        "occurred_at": timezone.now().isoformat(),
+    }
+    transaction.on_commit(lambda: process_order_event.delay(event), robust=True)
+    return event
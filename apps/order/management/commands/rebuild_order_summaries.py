@@ -0,0 +1,62 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import OuterRef, Subquery
+
+from apps.order.models import OrderItem, UserOrderSummary
+from apps.product.models import Product
+
+
+class Command(BaseCommand):
+    """
+    Rebuild the order summaries (order count per status, lifetime total and latest order date) of all users
+    from their orders.
+
+    Users are processed in batches of primary keys, each batch costs one grouped query over the orders and
+    one bulk upsert, in its own transaction. With `--snapshots`, the order items ordered before the product
+    snapshots existed first get the current name and price of their product.
+
+    Example:
+        python manage.py rebuild_order_summaries --batch-size 1000 --snapshots
+    """
+
+    help = "Rebuild the order summaries of all users in batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000, help="Number of users or items per batch.")
+        parser.add_argument("--snapshots", action="store_true",
+                            help="Fill the product snapshot of the order items that have none.")
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        if options["snapshots"]:
+            self.fill_snapshots(batch_size)
+
+        last_id = 0
+        rebuilt = 0
+        while True:
+            user_ids = list(get_user_model().objects.filter(pk__gt=last_id).order_by("pk").values_list(
+                "pk", flat=True)[:batch_size])
+            if not user_ids:
+                break
+
+            with transaction.atomic():
+                rebuilt += UserOrderSummary.rebuild_order_summaries(user_ids)
+
+            last_id = user_ids[-1]
+            self.stdout.write(f"Rebuilt {rebuilt} summaries")
+
+        self.stdout.write(self.style.SUCCESS(f"Order summaries rebuilt for {rebuilt} users"))
+
+    def fill_snapshots(self, batch_size):
+        product = Product.objects.filter(pk=OuterRef("product_id"))
+        filled = 0
+        while True:
+            item_ids = list(OrderItem.objects.filter(unit_price__isnull=True).order_by("pk").values_list(
+                "pk", flat=True)[:batch_size])
+            if not item_ids:
+                break
+
+            filled += OrderItem.objects.filter(pk__in=item_ids).update(
+                product_name=Subquery(product.values("name")[:1]), unit_price=Subquery(product.values("price")[:1]))
+            self.stdout.write(f"Filled {filled} order item snapshots")
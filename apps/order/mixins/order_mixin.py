@@ -1,6 +1,8 @@
-from apps.base.mixins.exception import StockInsufficient
-from apps.order.constant import SHIPPED, DELIVERED
-from apps.order.serializers import OrderItemSerializer
+from apps.order.constant import SHIPPED, DELIVERED, CANCELED, PENDING, ORDER_CREATED, ORDER_UPDATED
+from apps.order.events import publish_order_event
+from apps.order.models import OrderItem
+from apps.order.utils.stock import (adjust_stock, aggregate_quantities, end_reservations, hold_stock,
+                                    ordered_quantities, release_stock, reserve_stock)
 
 
 class OrderManagerMixin(object):
@@ -20,21 +22,11 @@ class OrderManagerMixin(object):
         # Check if the order is in a modifiable status
         if order.order_status not in [SHIPPED, DELIVERED]:
 
-            # Retrieve all order items associated with the order
-            order_items = order.order_items.all().select_related("product")
-
-            # Iterate through each order item to restore stock quantities
-            for order_item in order_items:
-
-                # Retrieve the product from the order item
-                product = order_item.product
-
-                # Increase the stock quantity by the ordered quantity
-                product.stock_quantity += order_item.quantity
-                product.save()
+            # Give the ordered quantities back to the products with a single grouped update
+            release_stock(ordered_quantities(order))
 
             # Delete all order items associated with the order
-            order_items.delete()
+            order.order_items.all().delete()
 
     def _process_order(self, serializer):
         """
@@ -59,26 +51,59 @@ class OrderManagerMixin(object):
             # Save the order with the user and total price
             order = serializer.save(user=self.request.user, total_price=total_price)
 
-            # Update stock quantities and save each order item
-            for item in order_items:
-                # Retrieve the product from the order item
-                product = item["product"]
-
-                # Check if there is sufficient stock for the order item
-                if product.stock_quantity >= item["quantity"]:
-                    # Reduce the stock quantity by the ordered quantity
-                    product.stock_quantity -= item["quantity"]
-                    product.save()
-                else:
-                    # If stock quantity is insufficient, raise an exception
-                    raise StockInsufficient(f"Insufficient stock for #{product.id}-{product.name}")
-
-                # Update the order item with the product ID and save it
-                item["product"] = product.id
-
-            # Create a serializer for the order items and save them with the associated order
-            item_serializer = OrderItemSerializer(data=order_items, many=True)
-            item_serializer.is_valid(raise_exception=True)
-            item_serializer.save(order=order)
+            # Decrement the stock of all products with conditional updates, raises StockInsufficient
+            quantities = reserve_stock(order_items, invalidate=False)
+
+            # Create all order items of the order with a single query
+            OrderItem.objects.bulk_create([
+                OrderItem(order=order, product=item["product"], quantity=item["quantity"]) for item in order_items
+            ])
+
+            # New orders are pending, they hold their stock until their reservations expire
+            hold_stock(order, quantities)
+
+            # Invalidate the caches and send the notifications after the commit, out of the request
+            publish_order_event(ORDER_CREATED, order, quantities)
         else:
             serializer.save(user=self.request.user, total_price=0.0)
+
+    def _update_order(self, serializer):
+        """
+        Perform custom actions during the modification of an existing order.
+
+        Only the stock of the products whose ordered quantity changed is adjusted, instead of restoring
+        the whole order and reserving it again. The order items are then replaced by the new ones.
+
+        Args:
+            serializer (OrderSerializer): The serializer instance for the order being updated.
+
+        Returns:
+            None
+        """
+
+        # Extract the 'order_items' data from the validated serializer data
+        order_items = serializer.validated_data.pop("order_items")
+
+        # Calculate the total price based on the order items
+        total_price = sum(item['product'].price * item['quantity'] for item in order_items)
+
+        # Adjust the stock for the changed quantities only, raises StockInsufficient
+        changed_product_ids = adjust_stock(serializer.instance, order_items, invalidate=False)
+
+        # Save the order with the user and total price
+        order = serializer.save(user=self.request.user, total_price=total_price)
+
+        # Replace the order items of the order
+        order.order_items.all().delete()
+        OrderItem.objects.bulk_create([
+            OrderItem(order=order, product=item["product"], quantity=item["quantity"]) for item in order_items
+        ])
+
+        # Pending orders hold their new stock, canceled ones give it back and shipped ones keep it
+        quantities = aggregate_quantities(order_items)
+        if order.order_status in (PENDING, CANCELED):
+            hold_stock(order, quantities)
+        if order.order_status != PENDING:
+            end_reservations([order.pk], release=order.order_status == CANCELED)
+
+        publish_order_event(ORDER_UPDATED, order, quantities, changed_product_ids)
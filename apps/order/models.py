@@ -1,8 +1,13 @@
-from apps.order.constant import PENDING, SHIPPED, CANCELED, DELIVERED
+from collections import defaultdict
+from decimal import Decimal
+
+from apps.order.constant import PENDING, SHIPPED, CANCELED, DELIVERED, ORDER_CREATED, ORDER_UPDATED
 from apps.product.models import Product
-from apps.base.models import BaseModel
+from apps.base.models import BaseModel, UserHistoryAuditQuerySet
 from django.conf import settings
 from django.db import models
+from django.db.models import Case, Count, F, Max, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce, Greatest
 from django.utils.translation import gettext_lazy as _
 
 
@@ -13,6 +18,11 @@ ORDER_STATUS_CHOICES = [
     ('canceled', _(CANCELED)),
 ]
 
+ORDER_EVENT_CHOICES = [
+    (ORDER_CREATED, _('Created')),
+    (ORDER_UPDATED, _('Updated')),
+]
+
 
 class Order(BaseModel):
     """
@@ -57,9 +67,44 @@ class Order(BaseModel):
     total_price = models.DecimalField(max_digits=10, decimal_places=2)
     order_status = models.CharField(max_length=20, choices=ORDER_STATUS_CHOICES)
 
+    class Meta:
+        indexes = [
+            # Order history of a user, newest first (keyset pagination)
+            models.Index(fields=["user", "-created_at", "-id"], name="order_user_created_idx"),
+            # Order history of a user filtered by status, e.g. ?order_status=shipped
+            models.Index(fields=["user", "order_status", "-id"], name="order_user_status_idx"),
+        ]
+
     def __str__(self):
         return f"Order #{self.id} - {self.user.username}"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the stored values the summary of the user is computed from, it is updated from the difference
+        loaded_values = dict(zip(field_names, values))
+        summary_values = tuple(loaded_values.get(field, models.DEFERRED) for field in UserOrderSummary.ORDER_FIELDS)
+        if models.DEFERRED not in summary_values:
+            instance._loaded_summary_values = summary_values
+        return instance
+
+    @property
+    def summary_values(self):
+        return tuple(getattr(self, field) for field in UserOrderSummary.ORDER_FIELDS)
+
+
+class OrderItemQuerySet(UserHistoryAuditQuerySet):
+    """
+    QuerySet of the order items, its `bulk_create()` takes the product snapshot of the items the same way
+    `save()` does.
+    """
+
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = list(objs)
+        for obj in objs:
+            obj.populate_product_snapshot()
+        return super().bulk_create(objs, *args, **kwargs)
+
 
 class OrderItem(BaseModel):
     """
@@ -69,6 +114,12 @@ class OrderItem(BaseModel):
         order (Order): The order to which the item belongs.
         product (Product): The product included in the item.
         quantity (int): The quantity of the product in the order item.
+        product_name (str): The name of the product when it was ordered.
+        unit_price (Decimal): The price of the product when it was ordered, None for the items ordered before
+            the snapshots existed (see `rebuild_order_summaries --snapshots`).
+
+    The name and price are copied from the product when the item is created, so the order history shows what
+    was bought and at which price without reading the live products.
 
     Methods:
         __str__(): Returns a string representation of the order item, including the quantity, product name, and order ID.
@@ -77,10 +128,243 @@ class OrderItem(BaseModel):
     order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name="order_items")
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
     quantity = models.PositiveIntegerField()
+    product_name = models.CharField(max_length=255, blank=True, default="")
+    unit_price = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
+
+    objects = OrderItemQuerySet.as_manager()
 
     @property
     def total_price(self):
-        return self.quantity * self.product.price
+        unit_price = self.product.price if self.unit_price is None else self.unit_price
+        return self.quantity * unit_price
+
+    def __str__(self):
+        return f"{self.quantity} x {self.product_name or self.product.name} in Order #{self.order_id}"
+
+    def populate_product_snapshot(self):
+        if self.unit_price is None:
+            self.product_name, self.unit_price = self.product.name, self.product.price
+
+    def save(self, *args, **kwargs):
+        self.populate_product_snapshot()
+        super().save(*args, **kwargs)
+
+
+class UserOrderSummary(models.Model):
+    """
+    Order history totals of a user, kept up to date in the transaction of every order write so that they are
+    read from one row instead of being aggregated over all the orders of the user.
+
+    Orders saved or deleted one at a time are applied by the signals of `apps.order.signals`, the functions
+    updating the status of many orders at once (`transition_orders()`, the reservation sweeper) call
+    `apply_order_changes()` themselves. The `rebuild_order_summaries` command recomputes them from the orders.
+
+    Attributes:
+        user (User): The user, primary key. Users without orders have no summary.
+        order_count (int): The number of orders, every status included.
+        pending_count, shipped_count, delivered_count, canceled_count (int): The number of orders per status.
+        lifetime_total (Decimal): The total price of the orders that were not canceled.
+        last_order_at (datetime): When the latest order was placed.
+    """
+
+    # Values of an order the summary is computed from, in the order of the tuples given to apply_order_changes()
+    ORDER_FIELDS = ("user_id", "order_status", "total_price", "created_at")
+    STATUS_COUNT_FIELDS = {status: f"{status}_count" for status, _ in ORDER_STATUS_CHOICES}
+
+    user = models.OneToOneField(settings.AUTH_USER_MODEL, primary_key=True, on_delete=models.CASCADE,
+                                related_name="order_summary")
+    order_count = models.PositiveIntegerField(default=0)
+    pending_count = models.PositiveIntegerField(default=0)
+    shipped_count = models.PositiveIntegerField(default=0)
+    delivered_count = models.PositiveIntegerField(default=0)
+    canceled_count = models.PositiveIntegerField(default=0)
+    lifetime_total = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal(0))
+    last_order_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"Order summary of {self.user_id}"
+
+    @property
+    def status_counts(self):
+        return {status: getattr(self, field) for status, field in self.STATUS_COUNT_FIELDS.items()}
+
+    @classmethod
+    def apply_order_changes(cls, added=(), removed=()):
+        """
+        Update the summaries of the users whose orders changed with a single `UPDATE` statement, whatever the
+        number of orders and users. A changed order is removed with its stored values and added with its new
+        ones. Users without a summary yet get one rebuilt from their orders.
+
+        Must be called after the orders are written, in their transaction.
+
+        Args:
+            added (iterable): Orders added to the summaries, as tuples of the `ORDER_FIELDS` values.
+            removed (iterable): Orders removed from the summaries, as tuples of the `ORDER_FIELDS` values.
+
+        Returns:
+            int: The number of summaries updated or rebuilt.
+        """
+
+        counters = ("order_count", "lifetime_total", *cls.STATUS_COUNT_FIELDS.values())
+        deltas = defaultdict(lambda: dict.fromkeys(counters, 0))
+        latest = {}
+        for sign, orders in ((1, added), (-1, removed)):
+            for user_id, order_status, total_price, created_at in orders:
+                delta = deltas[user_id]
+                delta["order_count"] += sign
+                delta[cls.STATUS_COUNT_FIELDS[order_status]] += sign
+                if order_status != CANCELED:
+                    delta["lifetime_total"] += sign * Decimal(str(total_price))
+                if sign > 0:
+                    latest[user_id] = max(latest.get(user_id, created_at), created_at)
+
+        updates = {}
+        for field in counters:
+            changed = {user_id: delta[field] for user_id, delta in deltas.items() if delta[field]}
+            if changed:
+                updates[field] = F(field) + _user_case(changed, cls._meta.get_field(field))
+
+        # Removing orders may remove the latest one, its date is read again from the remaining orders
+        latest_order = Order.objects.filter(user_id=OuterRef("user_id")).order_by("-created_at").values("created_at")
+        last_order_at = [When(user_id=user_id, then=Subquery(latest_order[:1]))
+                         for user_id, delta in deltas.items() if delta["order_count"] < 0]
+        last_order_at += [When(user_id=user_id, then=Greatest(Coalesce("last_order_at", Value(created_at)),
+                                                              Value(created_at)))
+                          for user_id, created_at in latest.items() if deltas[user_id]["order_count"] > 0]
+        if last_order_at:
+            updates["last_order_at"] = Case(*last_order_at, default=F("last_order_at"),
+                                            output_field=models.DateTimeField())
+
+        if not updates:
+            return 0
+        updated = cls.objects.filter(user_id__in=deltas.keys()).update(**updates)
+        if updated < len(deltas):
+            missing = set(deltas) - set(cls.objects.filter(user_id__in=deltas.keys()).values_list("user_id", flat=True))
+            updated += cls.rebuild_order_summaries(missing)
+        return updated
+
+    @classmethod
+    def rebuild_order_summaries(cls, user_ids):
+        """
+        Recompute the summaries of the given users from their orders, with one grouped query over the orders
+        and one bulk upsert. The summaries of the users without orders are deleted.
+
+        Args:
+            user_ids (iterable): The users to rebuild.
+
+        Returns:
+            int: The number of summaries written.
+        """
+
+        user_ids = list(user_ids)
+        summaries = {}
+        rows = Order.objects.filter(user_id__in=user_ids).values("user_id", "order_status").annotate(
+            count=Count("pk"), total=Sum("total_price"), last_order_at=Max("created_at")).order_by()
+        for row in rows:
+            summary = summaries.setdefault(row["user_id"], cls(user_id=row["user_id"]))
+            setattr(summary, cls.STATUS_COUNT_FIELDS[row["order_status"]], row["count"])
+            summary.order_count += row["count"]
+            if row["order_status"] != CANCELED:
+                summary.lifetime_total += row["total"]
+            summary.last_order_at = max(filter(None, (summary.last_order_at, row["last_order_at"])))
+
+        cls.objects.filter(user_id__in=user_ids).exclude(user_id__in=summaries.keys()).delete()
+        fields = ["order_count", "lifetime_total", "last_order_at", *cls.STATUS_COUNT_FIELDS.values()]
+        cls.objects.bulk_create(summaries.values(), update_conflicts=True, unique_fields=["user"],
+                                update_fields=fields)
+        return len(summaries)
+
+
+def _user_case(values, output_field):
+    return Case(*[When(user_id=user_id, then=Value(value)) for user_id, value in values.items()],
+                default=Value(0), output_field=output_field)
+
+
+class StockReservation(models.Model):
+    """
+    Stock of a product held by a pending order until the reservation expires.
+
+    The stock of an order is taken when it is created. While the order is pending, its reservations keep
+    `Product.reserved_quantity` up to date, and the ones that expired are released by the
+    `sweep_expired_reservations` task: their order is canceled and the stock given back. Shipping or
+    canceling the order ends its reservations (see `apps.order.utils.stock`).
+
+    Attributes:
+        order (Order): The pending order.
+        product (Product): The reserved product.
+        quantity (int): The reserved quantity.
+        expires_at (datetime): When the stock is given back if the order is still pending.
+    """
+
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name="reservations")
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name="+")
+    quantity = models.PositiveIntegerField()
+    expires_at = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["order", "product"], name="stock_reservation_order_product"),
+        ]
+        indexes = [
+            # The sweeper reads the expired reservations, oldest first
+            models.Index(fields=["expires_at"], name="stock_reservation_expiry_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.quantity} x {self.product_id} for Order #{self.order_id}"
+
+
+class OrderEvent(models.Model):
+    """
+    Analytics row of an order change, written by the order event pipeline (see `apps.order.tasks`) once the
+    change is committed.
+
+    Attributes:
+        event_id (UUID): Id of the event, a task delivered again finds its row and does not process it twice.
+        kind (str, choices): The change, `created` or `updated`.
+        order_id (int): The changed order. Not a foreign key, the rows outlive the deleted orders.
+        user (User): The user who placed the order.
+        total_price (Decimal): The total price of the order after the change.
+        item_count (int): The number of ordered units.
+        product_count (int): The number of distinct ordered products.
+        occurred_at (datetime): When the change was made.
+        processed_at (datetime): When the follow-up tasks of the event were sent, None until then.
+    """
+
+    event_id = models.UUIDField(unique=True)
+    kind = models.CharField(max_length=20, choices=ORDER_EVENT_CHOICES)
+    order_id = models.PositiveBigIntegerField(db_index=True)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, null=True, on_delete=models.SET_NULL, related_name="+")
+    total_price = models.DecimalField(max_digits=10, decimal_places=2)
+    item_count = models.PositiveIntegerField()
+    product_count = models.PositiveIntegerField()
+    occurred_at = models.DateTimeField(db_index=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"Order #{self.order_id} {self.kind}"
+
+
+class OrderEventNotification(models.Model):
+    """
+    Notification email sent for an order event, a notification task delivered again finds its row and does
+    not send the email twice.
+
+    Attributes:
+        event (OrderEvent): The notified event, keyed by its event id.
+        user (User): The notified user, the customer or the owner of ordered products.
+        sent_at (datetime): When the email was sent.
+    """
+
+    event = models.ForeignKey(OrderEvent, to_field="event_id", on_delete=models.CASCADE,
+                              related_name="notifications")
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="+")
+    sent_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["event", "user"], name="order_event_notification_event_user"),
+        ]
 
     def __str__(self):
-        return f"{self.quantity} x {self.product.name} in Order #{self.order.id}"
+        return f"{self.event_id} sent to {self.user_id}"
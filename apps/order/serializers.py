@@ -1,10 +1,17 @@
+from functools import cached_property
+
+from django.db import models
+from django.db.models import Prefetch
 from rest_framework import serializers
-from .models import Order, OrderItem
+from .constant import PENDING
+from .models import ORDER_STATUS_CHOICES, Order, OrderItem, UserOrderSummary
+from apps.product.models import Product
+from apps.base.serializers import CompiledSerializerMixin, InstrumentedSerializerMixin
 from apps.product.serializers import ProductSerializer
-from apps.user.serializers import UserSerializer
+from apps.user.serializers import UserReadSerializer
 
 
-class OrderItemReadSerializer(serializers.ModelSerializer):
+class OrderItemReadSerializer(CompiledSerializerMixin, serializers.ModelSerializer):
     product = ProductSerializer()
     total_price = serializers.DecimalField(required=True, max_digits=10, decimal_places=2)
 
@@ -13,16 +20,100 @@ class OrderItemReadSerializer(serializers.ModelSerializer):
         fields = ["id", "product", "quantity", "total_price"]
 
 
+class OrderItemProductSnapshotSerializer(CompiledSerializerMixin, serializers.Serializer):
+    """
+    Product of an order item as it was ordered, read from the snapshot of the item without the live product.
+    Same fields as `ProductCompactSerializer`.
+    """
+
+    id = serializers.IntegerField(source="product_id", read_only=True)
+    name = serializers.CharField(source="product_name", read_only=True)
+    price = serializers.DecimalField(source="unit_price", max_digits=10, decimal_places=2, read_only=True)
+
+
+class OrderItemCompactSerializer(OrderItemReadSerializer):
+    product = OrderItemProductSnapshotSerializer(source="*")
+
+
+def is_compact(request):
+    """
+    Return True when the request asks for the compact order representation with `?compact=true`.
+    """
+
+    return request is not None and request.query_params.get("compact", "").lower() in ("1", "true", "yes")
+
+
+class ProductPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    """
+    Product primary key field that resolves the product from the products fetched in bulk by the parent
+    `OrderItemListSerializer`, falling back to one query per item for anything not found there.
+    """
+
+    def to_internal_value(self, data):
+        list_serializer = getattr(self.parent, "parent", None)
+        products = getattr(list_serializer, "products", None)
+        if products and isinstance(data, (int, str)) and str(data).isdigit() and int(data) in products:
+            return products[int(data)]
+        return super().to_internal_value(data)
+
+
+class OrderItemListSerializer(serializers.ListSerializer):
+    """
+    Validate all order items with a single query for their products instead of one query per item, and read
+    them with a single query when they have not been prefetched (e.g. in the responses to writes).
+    """
+
+    products = None
+
+    def to_representation(self, data):
+        if isinstance(data, models.Manager):
+            data = data.all()
+            related = self.child.get_read_related(self.child.compact)
+            if data._result_cache is None and related:
+                data = data.select_related(*related)
+        return super().to_representation(data)
+
+    def to_internal_value(self, data):
+        if isinstance(data, list):
+            product_ids = {
+                int(item["product"]) for item in data if isinstance(item, dict)
+                and isinstance(item.get("product"), (int, str)) and str(item["product"]).isdigit()
+            }
+            self.products = Product.objects.in_bulk(product_ids)
+        return super().to_internal_value(data)
+
+
 class OrderItemSerializer(serializers.ModelSerializer):
+    product = ProductPrimaryKeyRelatedField(queryset=Product.objects.all())
 
     class Meta:
         model = OrderItem
         fields = ["product", "quantity"]
+        list_serializer_class = OrderItemListSerializer
 
+    @cached_property
+    def compact(self):
+        return is_compact(self.context.get("request"))
 
-class OrderSerializer(serializers.ModelSerializer):
+    @staticmethod
+    def get_read_related(compact):
+        # Relations read by the representation of the items, the compact one reads the product snapshot
+        return () if compact else ("product__created_by",)
+
+    @cached_property
+    def read_serializer(self):
+        # Built once per list of items, its fields are bound once instead of once per item
+        serializer_class = OrderItemCompactSerializer if self.compact else OrderItemReadSerializer
+        return serializer_class(context=self.context)
+
+    def to_representation(self, instance):
+        # Items are written as product ids and read with their product
+        return self.read_serializer.to_representation(instance)
+
+
+class OrderSerializer(InstrumentedSerializerMixin, serializers.ModelSerializer):
     order_items = OrderItemSerializer(many=True)
-    user = UserSerializer(read_only=True)
+    user = UserReadSerializer(read_only=True)
 
     class Meta:
         model = Order
@@ -31,11 +122,47 @@ class OrderSerializer(serializers.ModelSerializer):
             "total_price": {"read_only": True}
         }
 
-    def to_representation(self, instance):
-        data = super().to_representation(instance)
-        order_items_queryset = instance.order_items.all()
-        if self.context["request"].method in ["PUT", "PATCH"]:
-            order_items_queryset = order_items_queryset.select_related("product")
-        data["order_items"] = OrderItemReadSerializer(instance=order_items_queryset, many=True).data
-        return data
+    def validate_order_status(self, value):
+        # New orders are pending, the other statuses are reached through the transitions
+        if self.instance is None and value != PENDING:
+            raise serializers.ValidationError(f"New orders must be {PENDING}.")
+        return value
+
+    @staticmethod
+    def get_order_items_prefetch(compact=False):
+        """
+        Return the prefetch of the order items with everything their representation reads, in one query.
+
+        Args:
+            compact (bool): Prefetch for the compact representation, which reads the product snapshot of the
+                items instead of their product.
+        """
+
+        related = OrderItemSerializer.get_read_related(compact)
+        queryset = OrderItem.objects.select_related(*related) if related else OrderItem.objects.all()
+        return Prefetch("order_items", queryset=queryset)
 
+
+class OrderTransitionSerializer(serializers.Serializer):
+    """
+    Orders to move to a new status at once, see `OrderTransitionAPIView`.
+    """
+
+    MAX_ORDERS = 5000
+
+    ids = serializers.ListField(child=serializers.IntegerField(min_value=1), allow_empty=False,
+                                max_length=MAX_ORDERS)
+    order_status = serializers.ChoiceField(choices=ORDER_STATUS_CHOICES)
+
+
+class UserOrderSummarySerializer(serializers.ModelSerializer):
+    """
+    Order history totals of a user, see `OrderSummaryAPIView`.
+    """
+
+    status_counts = serializers.DictField(child=serializers.IntegerField(), read_only=True)
+
+    class Meta:
+        model = UserOrderSummary
+        fields = ["order_count", "status_counts", "lifetime_total", "last_order_at"]
+        read_only_fields = fields
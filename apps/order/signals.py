@@ -0,0 +1,35 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from apps.order.models import Order, UserOrderSummary
+
+
+@receiver(post_save, sender=Order, dispatch_uid="order-user-summary-save")
+def update_user_summary_on_save(sender, instance, created, raw=False, **kwargs):
+    """
+    Apply a created or modified order to the order summary of its user, in the transaction of the write.
+    """
+
+    if raw:
+        return
+    loaded = getattr(instance, "_loaded_summary_values", None)
+    current = instance.summary_values
+    if created:
+        UserOrderSummary.apply_order_changes(added=[current])
+    elif loaded is None:
+        # The stored values are unknown (e.g. deferred fields), recompute the user from their orders
+        UserOrderSummary.rebuild_order_summaries([instance.user_id])
+    elif loaded != current:
+        UserOrderSummary.apply_order_changes(added=[current], removed=[loaded])
+
+    instance._loaded_summary_values = current
+
+
+@receiver(post_delete, sender=Order, dispatch_uid="order-user-summary-delete")
+def update_user_summary_on_delete(sender, instance, **kwargs):
+    """
+    Remove a deleted order from the order summary of its user.
+    """
+
+    loaded = getattr(instance, "_loaded_summary_values", None) or instance.summary_values
+    UserOrderSummary.apply_order_changes(removed=[loaded])
@@ -0,0 +1,121 @@
+from celery import shared_task
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.mail import send_mail
+from django.db import DatabaseError
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from apps.base.cache import catalog_cache
+from apps.order.constant import ORDER_CREATED
+from apps.order.models import OrderEvent, OrderEventNotification
+from apps.order.utils.stock import release_expired_reservations
+from apps.product.models import Product
+
+# Database and mail server failures are retried with an exponential backoff, 1s, 2s, 4s... up to 10 minutes
+RETRY_OPTIONS = {
+    "autoretry_for": (DatabaseError, OSError),
+    "retry_backoff": True,
+    "retry_backoff_max": 60 * 10,
+    "retry_jitter": True,
+    "max_retries": 5,
+}
+
+
+@shared_task(**RETRY_OPTIONS)
+def process_order_event(event):
+    """
+    Record the analytics row of an order event, then send its follow-up tasks: the invalidation of the cached
+    products whose stock changed and one notification per recipient.
+
+    The row is keyed by the event id, an event delivered again once its follow-up tasks were sent is ignored.
+    One delivered again before that sends them again, they are idempotent.
+
+    Args:
+        event (dict): The event built by `apps.order.events.publish_order_event()`.
+
+    Returns:
+        bool: False when the event had already been processed.
+    """
+
+    order_event, _ = OrderEvent.objects.get_or_create(event_id=event["id"], defaults={
+        "kind": event["kind"],
+        "order_id": event["order_id"],
+        "user_id": event["user_id"],
+        "total_price": event["total_price"],
+        "item_count": event["item_count"],
+        "product_count": event["product_count"],
+        "occurred_at": parse_datetime(event["occurred_at"]),
+    })
+    if order_event.processed_at is not None:
+        return False
+
+    invalidate_product_caches.delay(event["product_ids"])
+    if settings.ORDER_EVENTS["NOTIFY"]:
+        for user_id in get_recipients(event):
+            notify_order_recipient.delay(event, user_id)
+
+    OrderEvent.objects.filter(pk=order_event.pk).update(processed_at=timezone.now())
+    return True
+
+
+def get_recipients(event):
+    """
+    Return the ids of the users notified of an order event, the customer and the owners of the products.
+    """
+
+    owners = Product.objects.nocache().filter(pk__in=event["product_ids"], created_by__isnull=False).values_list(
+        "created_by", flat=True).distinct()
+    return [event["user_id"]] + sorted(set(owners) - {event["user_id"]})
+
+
+@shared_task(**RETRY_OPTIONS)
+def invalidate_product_caches(product_ids):
+    """
+    Invalidate the cached catalog responses and querysets of the products whose stock changed.
+    """
+
+    catalog_cache.invalidate_rows(Product, product_ids)
+
+
+@shared_task(**RETRY_OPTIONS)
+def notify_order_recipient(event, user_id):
+    """
+    Email an order event to a user, the customer or the owner of ordered products. Users without an email
+    address are skipped, and a notification sent is not sent again for the same event: it is recorded as an
+    `OrderEventNotification` row, seen by the workers of every host.
+
+    Returns:
+        bool: True when the email was sent.
+    """
+
+    if OrderEventNotification.objects.filter(event_id=event["id"], user_id=user_id).exists():
+        return False
+    user = get_user_model().objects.filter(pk=user_id).only("email").first()
+    if user is None or not user.email:
+        return False
+
+    action = "placed" if event["kind"] == ORDER_CREATED else "updated"
+    if user_id == event["user_id"]:
+        subject = f"Your order #{event['order_id']} was {action}"
+        message = (f"Your order #{event['order_id']} of {event['item_count']} items was {action}, "
+                   f"its total is {event['total_price']}.")
+    else:
+        subject = f"Order #{event['order_id']} of your products was {action}"
+        message = f"An order of your products was {action}, see order #{event['order_id']}."
+    send_mail(subject, message, None, [user.email])
+    OrderEventNotification.objects.get_or_create(event_id=event["id"], user_id=user_id)
+    return True
+
+
+@shared_task(**RETRY_OPTIONS)
+def sweep_expired_reservations():
+    """
+    Cancel the pending orders whose stock reservations expired and give their stock back, run periodically
+    by Celery beat (see `CELERY_BEAT_SCHEDULE`).
+
+    Returns:
+        int: The number of orders canceled.
+    """
+
+    return release_expired_reservations()
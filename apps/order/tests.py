@@ -1,6 +1,34 @@
-from apps.base.tests import APITestCase
-from apps.order.models import Order
+from apps.base.idempotency import idempotency_store
+from apps.base.models import IdempotencyKey
+from apps.base.tests import APITestCase, QueryScalingMixin
+from apps.order.mixins.order_mixin import OrderManagerMixin
+from apps.order.events import publish_order_event
+from apps.order.models import Order, OrderEvent, OrderEventNotification, OrderItem, StockReservation, UserOrderSummary
+from apps.base.tasks import purge_idempotency_keys
+from apps.order.tasks import notify_order_recipient, process_order_event, sweep_expired_reservations
+from apps.order.utils.stock import release_expired_reservations
+from apps.order.views import OrderExportAPIView, OrderListCreateView, OrderRUDAPIView
+from apps.product.models import Product
+from celery.exceptions import Retry
+from django.contrib.auth import get_user_model
+from django.core import mail
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import Sum
+from django.test.utils import CaptureQueriesContext
+from django.test import TransactionTestCase
+from django.utils import timezone
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from rest_framework.test import APIClient, APIRequestFactory
+from rest_framework_simplejwt.tokens import RefreshToken
 import json
+from collections import Counter
+import smtplib
+import threading
+from unittest import mock
 from rest_framework import status
 
 
@@ -32,3 +60,759 @@ class OrderAPITests(APITestCase):
         self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.token}')
         response = self.client.get(f'/api/orders/{self.order.id}/')
         self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_create_order_insufficient_stock(self):
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.token}')
+        other = Product.objects.create(name='Other Product', description='Product description', price=10,
+                                       stock_quantity=5, created_by=self.user, updated_by=self.user)
+        data = {
+            "order_items": [
+                {"product": self.product.id, "quantity": 2},
+                {"product": other.id, "quantity": 6}
+            ],
+            "order_status": "pending"
+        }
+        response = self.client.post('/api/orders/', data=json.dumps(data), content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data["failed_items"], [other.id])
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock_quantity, 100)
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_create_order_bulk_items_audit_fields(self):
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.token}')
+        products = Product.objects.bulk_create([
+            Product(name=f'Product {i}', description='Product description', price=10, stock_quantity=10)
+            for i in range(20)
+        ])
+        data = {
+            "order_items": [{"product": product.id, "quantity": 1} for product in products],
+            "order_status": "pending"
+        }
+        response = self.client.post('/api/orders/', data=json.dumps(data), content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        order_items = OrderItem.objects.filter(order_id=response.data["id"])
+        self.assertEqual(order_items.count(), 20)
+        for order_item in order_items:
+            self.assertEqual(order_item.created_by_id, self.user.id)
+            self.assertEqual(order_item.updated_by_id, self.user.id)
+            self.assertIsNotNone(order_item.created_at)
+            self.assertIsNotNone(order_item.updated_at)
+        self.assertFalse(Product.objects.filter(pk__in=[p.id for p in products]).exclude(stock_quantity=9).exists())
+
+    def test_update_order_adjusts_changed_stock_only(self):
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.token}')
+        other = Product.objects.create(name='Other Product', description='Product description', price=10,
+                                       stock_quantity=5, created_by=self.user, updated_by=self.user)
+        data = {"order_items": [{"product": self.product.id, "quantity": 2}, {"product": other.id, "quantity": 5}],
+                "order_status": "pending"}
+        response = self.client.post('/api/orders/', data=json.dumps(data), content_type='application/json')
+        order_id = response.data["id"]
+
+        data = {"order_items": [{"product": self.product.id, "quantity": 10}, {"product": other.id, "quantity": 1}]}
+        response = self.client.patch(f'/api/orders/{order_id}/', data=json.dumps(data), content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.product.refresh_from_db()
+        other.refresh_from_db()
+        self.assertEqual(self.product.stock_quantity, 90)
+        self.assertEqual(other.stock_quantity, 4)
+        self.assertEqual(sorted(OrderItem.objects.filter(order_id=order_id).values_list("quantity", flat=True)), [1, 10])
+
+        # Asking for more than the remaining stock leaves the order untouched
+        data = {"order_items": [{"product": other.id, "quantity": 6}]}
+        response = self.client.patch(f'/api/orders/{order_id}/', data=json.dumps(data), content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data["failed_items"], [other.id])
+        other.refresh_from_db()
+        self.assertEqual(other.stock_quantity, 4)
+
+    def test_restore_order_items(self):
+        OrderItem.objects.create(order=self.order, product=self.product, quantity=3)
+        OrderItem.objects.create(order=self.order, product=self.product, quantity=4)
+        OrderManagerMixin.restore_order_items(self.order)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock_quantity, 107)
+        self.assertFalse(self.order.order_items.exists())
+
+    def test_order_list_keyset_pagination(self):
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.token}')
+        Order.objects.bulk_create([Order(user=self.user, total_price=10, order_status='pending') for _ in range(14)])
+        expected = list(Order.objects.order_by("-created_at", "-id").values_list("id", flat=True))
+        ids = []
+        url = '/api/orders/?pagination=cursor&size=4'
+        while url:
+            response = self.client.get(url)
+            ids += [order["id"] for order in response.data["results"]]
+            url = response.data["next"]
+        self.assertEqual(ids, expected)
+
+
+class OrderExportTests(APITestCase):
+
+    def test_export_streams_all_orders(self):
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.token}')
+        for _ in range(11):
+            order = Order.objects.create(user=self.user, total_price=10, order_status='pending')
+            OrderItem.objects.create(order=order, product=self.product, quantity=1)
+
+        with mock.patch.object(OrderExportAPIView, 'export_chunk_size', 4):
+            response = self.client.get('/api/orders/export/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.streaming)
+        orders = json.loads(b''.join(response.streaming_content))
+        self.assertEqual([order['id'] for order in orders],
+                         list(Order.objects.order_by('-id').values_list('id', flat=True)))
+        self.assertEqual(orders[0]['order_items'][0]['product']['id'], self.product.id)
+
+    def test_export_without_orders(self):
+        Order.objects.all().delete()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.token}')
+        response = self.client.get('/api/orders/export/')
+        self.assertEqual(json.loads(b''.join(response.streaming_content)), [])
+
+
+class OrderQueryTests(QueryScalingMixin, APITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.token}')
+
+    def create_product(self):
+        owner = get_user_model().objects.create_user(username=f'owner{Product.objects.count()}', password='x')
+        return Product.objects.create(name='Product', description='', price=10, stock_quantity=100,
+                                      created_by=owner, updated_by=owner)
+
+    def seed_orders(self, count):
+        for _ in range(count):
+            order = Order.objects.create(user=self.user, total_price=20, order_status='pending')
+            for _ in range(2):
+                OrderItem.objects.create(order=order, product=self.create_product(), quantity=1)
+
+    def seed_order_items(self, count):
+        for _ in range(count):
+            OrderItem.objects.create(order=self.order, product=self.create_product(), quantity=1)
+
+    def test_order_list_queries(self):
+        self.assertQueriesDoNotScale('/api/orders/', self.seed_orders)
+
+    def test_order_keyset_list_queries(self):
+        self.assertQueriesDoNotScale('/api/orders/?pagination=cursor', self.seed_orders)
+
+    def test_order_detail_queries(self):
+        self.assertQueriesDoNotScale(f'/api/orders/{self.order.id}/', self.seed_order_items)
+
+    def test_order_compact_list_queries(self):
+        self.assertQueriesDoNotScale('/api/orders/?compact=true', self.seed_orders)
+        response = self.client.get('/api/orders/?compact=true')
+        items = response.data['results'][0]['order_items']
+        self.assertEqual(len(items), 2)
+        self.assertEqual(set(items[0]['product']), {'id', 'name', 'price'})
+        self.assertIn('created_by', self.client.get('/api/orders/').data['results'][0]['order_items'][0]['product'])
+
+    def test_order_write_responses_read_items_once(self):
+        products = [self.create_product() for _ in range(5)]
+        data = {"order_items": [{"product": product.id, "quantity": 1} for product in products],
+                "order_status": "pending"}
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.post('/api/orders/', data=json.dumps(data), content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual([item['product']['id'] for item in response.data['order_items']],
+                         [product.id for product in products])
+        # The row locks of the stock updates read the product ids only
+        product_queries = [query for query in context.captured_queries
+                           if query['sql'].startswith('SELECT') and '"product_product"."name"' in query['sql']]
+        self.assertLessEqual(len(product_queries), 2)  # validation and representation
+
+
+class OrderStockConcurrencyTests(TransactionTestCase):
+    """
+     Many clients ordering the same product at once must never oversell it.
+    """
+
+    threads = 12
+    orders_per_thread = 5
+    quantity = 3
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username='testuser', password='testpassword')
+        self.product = Product.objects.create(name='Test Product', description='Product description', price=10,
+                                              stock_quantity=100, created_by=self.user, updated_by=self.user)
+        self.token = str(RefreshToken.for_user(self.user).access_token)
+
+    def place_orders(self, barrier, statuses):
+        client = APIClient()
+        client.raise_request_exception = False
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.token}')
+        data = json.dumps({"order_items": [{"product": self.product.id, "quantity": self.quantity}],
+                           "order_status": "pending"})
+        barrier.wait()
+        try:
+            for _ in range(self.orders_per_thread):
+                response = client.post('/api/orders/', data=data, content_type='application/json')
+                statuses.append(response.status_code)
+        finally:
+            connection.close()
+
+    def test_concurrent_orders_never_oversell(self):
+        statuses = []
+        barrier = threading.Barrier(self.threads)
+        workers = [threading.Thread(target=self.place_orders, args=(barrier, statuses)) for _ in range(self.threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        self.product.refresh_from_db()
+        ordered = OrderItem.objects.aggregate(total=Sum("quantity"))["total"] or 0
+        # The stock takes 33 orders of 3, the other requests must be refused for the missing stock
+        created = 100 // self.quantity
+        self.assertEqual(len(statuses), self.threads * self.orders_per_thread)
+        self.assertEqual(statuses.count(status.HTTP_201_CREATED), created)
+        self.assertEqual(statuses.count(status.HTTP_400_BAD_REQUEST), len(statuses) - created, sorted(statuses))
+        self.assertEqual(Order.objects.count(), created)
+        # Every committed order item must be backed by exactly the stock it took (no lost updates)
+        self.assertEqual(ordered, created * self.quantity)
+        self.assertEqual(self.product.stock_quantity, 100 - ordered)
+
+
+class OrderEventPipelineTests(APITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.user.email = 'buyer@example.com'
+        self.user.save()
+        self.seller = get_user_model().objects.create_user(username='seller', email='seller@example.com')
+        self.seller_product = Product.objects.create(name='Seller Product', description='Product description',
+                                                     price=10, stock_quantity=10, created_by=self.seller)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.token}')
+
+    def create_order(self, *items):
+        data = {"order_items": [{"product": product.id, "quantity": quantity} for product, quantity in items],
+                "order_status": "pending"}
+        return self.client.post('/api/orders/', data=json.dumps(data), content_type='application/json')
+
+    def test_checkout_runs_the_pipeline_after_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.create_order((self.product, 2), (self.seller_product, 1))
+            # Nothing runs inside the checkout transaction
+            self.assertFalse(OrderEvent.objects.exists())
+            self.assertEqual(len(mail.outbox), 0)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        event = OrderEvent.objects.get()
+        self.assertEqual((event.kind, event.order_id, event.user_id), ('created', response.data["id"], self.user.pk))
+        self.assertEqual((event.item_count, event.product_count), (3, 2))
+        self.assertIsNotNone(event.processed_at)
+        self.assertEqual(sorted(message.to[0] for message in mail.outbox), ['buyer@example.com', 'seller@example.com'])
+
+    def test_checkout_invalidates_the_cached_products_after_commit(self):
+        self.client.get('/api/products/')
+        self.assertEqual(self.client.get('/api/products/')['X-Cache'], 'HIT')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.create_order((self.product, 2))
+        response = self.client.get('/api/products/')
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.data["results"][0]["stock_quantity"], 98)
+
+    def test_failed_checkout_publishes_nothing(self):
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            response = self.create_order((self.seller_product, 11))
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(callbacks, [])
+        self.assertFalse(OrderEvent.objects.exists())
+
+    def test_update_event(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch(
+                f'/api/orders/{self.order.id}/', content_type='application/json',
+                data=json.dumps({"order_items": [{"product": self.seller_product.id, "quantity": 4}]}))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        event = OrderEvent.objects.get()
+        self.assertEqual((event.kind, event.item_count, event.total_price), ('updated', 4, 40))
+        self.assertEqual(len(mail.outbox), 2)
+
+    def test_redelivered_event_is_processed_once(self):
+        with self.captureOnCommitCallbacks():
+            event = publish_order_event('created', self.order, {self.product.pk: 1})
+        self.assertTrue(process_order_event.delay(event).get())
+        self.assertFalse(process_order_event.delay(event).get())
+        self.assertEqual(OrderEvent.objects.count(), 1)
+        self.assertEqual(len(mail.outbox), 1)
+
+    def test_sent_notifications_are_recorded_in_the_database(self):
+        with self.captureOnCommitCallbacks():
+            event = publish_order_event('created', self.order, {self.product.pk: 1})
+        process_order_event.delay(event)
+        # Another worker, with its own cache, does not send it again
+        caches['default'].clear()
+        self.assertFalse(notify_order_recipient.delay(event, self.user.pk).get())
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(list(OrderEventNotification.objects.values_list('user', flat=True)), [self.user.pk])
+
+    def test_failed_notification_is_retried_and_sent_once(self):
+        with self.captureOnCommitCallbacks():
+            event = publish_order_event('created', self.order, {self.product.pk: 1})
+        with mock.patch('apps.order.tasks.send_mail', side_effect=[smtplib.SMTPException('down'), 1]) as send:
+            # Eager tasks raise their retries, a worker would run them again after a backoff
+            with self.assertRaises(Retry):
+                process_order_event.delay(event)
+            self.assertIsNone(OrderEvent.objects.get().processed_at)
+            process_order_event.delay(event)
+        self.assertEqual(send.call_count, 2)
+        self.assertIsNotNone(OrderEvent.objects.get().processed_at)
+
+
+class StockReservationTests(APITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.token}')
+
+    def create_order(self, quantity):
+        data = {"order_items": [{"product": self.product.id, "quantity": quantity}], "order_status": "pending"}
+        response = self.client.post('/api/orders/', data=json.dumps(data), content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        return Order.objects.get(pk=response.data["id"])
+
+    def update_order(self, order, quantity, order_status="pending"):
+        data = {"order_items": [{"product": self.product.id, "quantity": quantity}], "order_status": order_status}
+        return self.client.put(f'/api/orders/{order.id}/', data=json.dumps(data), content_type='application/json')
+
+    def assertStock(self, stock_quantity, reserved_quantity):
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.stock_quantity, self.product.reserved_quantity),
+                         (stock_quantity, reserved_quantity))
+
+    def expire(self, order):
+        StockReservation.objects.filter(order=order).update(expires_at=timezone.now() - timedelta(seconds=1))
+
+    def test_pending_order_holds_its_stock(self):
+        before = timezone.now()
+        order = self.create_order(2)
+        reservation = StockReservation.objects.get(order=order)
+        self.assertEqual(reservation.quantity, 2)
+        self.assertGreater(reservation.expires_at, before + timedelta(minutes=29))
+        self.assertStock(98, 2)
+
+    def test_new_orders_must_be_pending(self):
+        for order_status in ("shipped", "delivered", "canceled"):
+            data = {"order_items": [{"product": self.product.id, "quantity": 5}], "order_status": order_status}
+            response = self.client.post('/api/orders/', data=json.dumps(data), content_type='application/json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertEqual(response.data["order_status"], ["New orders must be pending."])
+        self.assertEqual(Order.objects.count(), 1)
+        self.assertStock(100, 0)
+
+    def test_expired_reservations_are_released(self):
+        expired, other_expired, active = self.create_order(2), self.create_order(3), self.create_order(4)
+        self.expire(expired)
+        self.expire(other_expired)
+        self.assertStock(91, 9)
+
+        # 12 queries per batch whatever its number of orders, savepoints and the owners of the products for the
+        # catalog cache included, and 3 to find no more
+        with self.assertNumQueries(2 * 12 + 3):
+            self.assertEqual(release_expired_reservations(batch_size=1), 2)
+        self.assertStock(96, 4)
+        self.assertEqual(Order.objects.get(pk=expired.pk).order_status, "canceled")
+        self.assertEqual(Order.objects.get(pk=active.pk).order_status, "pending")
+        self.assertEqual(list(StockReservation.objects.values_list("order_id", flat=True)), [active.pk])
+        self.assertEqual(sweep_expired_reservations.delay().get(), 0)
+
+    def test_update_moves_the_reservation_without_extending_it(self):
+        order = self.create_order(2)
+        expires_at = StockReservation.objects.get(order=order).expires_at
+        self.assertEqual(self.update_order(order, 5).status_code, status.HTTP_200_OK)
+        reservation = StockReservation.objects.get(order=order)
+        self.assertEqual((reservation.quantity, reservation.expires_at), (5, expires_at))
+        self.assertStock(95, 5)
+
+    def test_cancel_gives_the_stock_back(self):
+        order = self.create_order(2)
+        self.assertEqual(self.update_order(order, 2, "canceled").status_code, status.HTTP_200_OK)
+        self.assertStock(100, 0)
+        self.assertFalse(StockReservation.objects.exists())
+        # Canceled orders do not hold stock anymore, they cannot be changed
+        self.assertEqual(self.update_order(order, 1).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertStock(100, 0)
+
+    def test_ship_keeps_the_stock(self):
+        order = self.create_order(2)
+        self.assertEqual(self.update_order(order, 3, "shipped").status_code, status.HTTP_200_OK)
+        self.assertStock(97, 0)
+        self.assertFalse(StockReservation.objects.exists())
+
+    def test_status_only_updates_end_the_reservations(self):
+        shipped, canceled = self.create_order(2), self.create_order(3)
+        for order, order_status in ((shipped, "shipped"), (canceled, "canceled")):
+            response = self.client.patch(f'/api/orders/{order.id}/', content_type='application/json',
+                                         data=json.dumps({"order_status": order_status}))
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse(StockReservation.objects.exists())
+        self.assertStock(98, 0)
+        # Nothing is left for the sweeper
+        self.assertEqual(release_expired_reservations(now=timezone.now() + timedelta(days=1)), 0)
+        self.assertStock(98, 0)
+
+    def test_writes_lock_the_order(self):
+        order = self.create_order(2)
+        for method, locked in (("get", False), ("put", True), ("patch", True), ("delete", True)):
+            view = OrderRUDAPIView(kwargs={"pk": order.pk})
+            view.request = view.initialize_request(getattr(APIRequestFactory(), method)('/'))
+            view.request.user = self.user
+            self.assertEqual(view.get_queryset().query.select_for_update, locked, method)
+
+    def test_order_canceled_by_the_sweeper_cannot_be_edited(self):
+        order = self.create_order(2)
+        self.expire(order)
+        release_expired_reservations()
+        response = self.update_order(order, 3)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(Order.objects.get(pk=order.pk).order_status, "canceled")
+        self.assertStock(100, 0)
+
+    def test_delete_gives_the_stock_back(self):
+        order = self.create_order(2)
+        self.assertEqual(self.client.delete(f'/api/orders/{order.id}/').status_code, status.HTTP_204_NO_CONTENT)
+        self.assertStock(100, 0)
+
+
+class OrderTransitionTests(APITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.token}')
+
+    def create_orders(self, count, quantity=1):
+        ids = []
+        for _ in range(count):
+            data = {"order_items": [{"product": self.product.id, "quantity": quantity}], "order_status": "pending"}
+            response = self.client.post('/api/orders/', data=json.dumps(data), content_type='application/json')
+            ids.append(response.data["id"])
+        return ids
+
+    def transition(self, ids, order_status):
+        return self.client.post('/api/orders/transitions/', content_type='application/json',
+                                data=json.dumps({"ids": ids, "order_status": order_status}))
+
+    def test_bulk_ship_returns_a_result_per_order(self):
+        pending = self.create_orders(2)
+        delivered = Order.objects.create(user=self.user, total_price=10, order_status='delivered')
+        other_user = get_user_model().objects.create_user(username='other')
+        other = Order.objects.create(user=other_user, total_price=10, order_status='pending')
+
+        response = self.transition(pending + [delivered.pk, other.pk, 999999, pending[0]], "shipped")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["succeeded"], 2)
+        self.assertEqual(response.data["results"], [
+            {"id": pending[0], "ok": True},
+            {"id": pending[1], "ok": True},
+            {"id": delivered.pk, "ok": False, "detail": "Order status cannot change from delivered to shipped."},
+            {"id": other.pk, "ok": False, "detail": "Order not found."},
+            {"id": 999999, "ok": False, "detail": "Order not found."},
+        ])
+        self.assertEqual(set(Order.objects.filter(order_status='shipped').values_list('pk', flat=True)), set(pending))
+        # Shipped orders keep their stock, their reservations end
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.stock_quantity, self.product.reserved_quantity), (98, 0))
+        self.assertFalse(StockReservation.objects.exists())
+
+        # Retrying is harmless, and shipped orders can be delivered
+        self.assertEqual(self.transition(pending, "shipped").data["succeeded"], 2)
+        self.assertEqual(self.transition(pending, "delivered").data["succeeded"], 2)
+
+    def test_bulk_transition_queries_do_not_scale(self):
+        def count_queries(ids):
+            with CaptureQueriesContext(connection) as context:
+                response = self.transition(ids, "canceled")
+            self.assertEqual(response.data["succeeded"], len(ids))
+            return len(context.captured_queries)
+
+        self.assertEqual(count_queries(self.create_orders(2)), count_queries(self.create_orders(20)))
+
+    def test_bulk_cancel_gives_the_stock_back(self):
+        ids = self.create_orders(3, quantity=2)
+        # An order placed before the reservations existed
+        legacy = Order.objects.create(user=self.user, total_price=10, order_status='pending')
+        OrderItem.objects.create(order=legacy, product=self.product, quantity=5)
+
+        self.assertEqual(self.transition(ids + [legacy.pk], "canceled").data["succeeded"], 4)
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.stock_quantity, self.product.reserved_quantity), (105, 0))
+        self.assertEqual(self.transition(ids, "pending").data["results"][0]["detail"],
+                         "Order status cannot change from canceled to pending.")
+
+    def test_staff_moves_the_orders_of_every_user(self):
+        other_user = get_user_model().objects.create_user(username='other')
+        other = Order.objects.create(user=other_user, total_price=10, order_status='pending')
+        self.user.is_staff = True
+        self.user.save()
+        self.client.force_authenticate(self.user)
+        self.assertEqual(self.transition([other.pk], "shipped").data["succeeded"], 1)
+
+    def test_invalid_payload(self):
+        self.assertEqual(self.transition([], "shipped").status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.transition([self.order.pk], "lost").status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_status_update_follows_the_transitions(self):
+        url = f'/api/orders/{self.order.id}/'
+        response = self.client.patch(url, data=json.dumps({"order_status": "shipped"}), content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["order_status"], "shipped")
+        response = self.client.patch(url, data=json.dumps({"order_status": "pending"}), content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data["detail"], "Order status cannot change from shipped to pending")
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.order_status, "shipped")
+
+    def test_list_filtered_by_status(self):
+        shipped = Order.objects.create(user=self.user, total_price=10, order_status='shipped')
+        response = self.client.get('/api/orders/?order_status=shipped')
+        self.assertEqual([order["id"] for order in response.data["results"]], [shipped.pk])
+
+
+class UserOrderSummaryTests(APITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.token}')
+
+    def create_order(self, quantity):
+        data = {"order_items": [{"product": self.product.id, "quantity": quantity}], "order_status": "pending"}
+        response = self.client.post('/api/orders/', data=json.dumps(data), content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        return Order.objects.get(pk=response.data["id"])
+
+    def assertSummary(self, user=None, **expected):
+        summary = UserOrderSummary.objects.get(user=user or self.user)
+        rebuilt = {"order_count": summary.order_count, "lifetime_total": summary.lifetime_total,
+                   "last_order_at": summary.last_order_at, **summary.status_counts}
+        self.assertEqual({field: rebuilt[field] for field in expected}, expected)
+
+        # The maintained summary is the one rebuilt from the orders
+        UserOrderSummary.rebuild_order_summaries([summary.user_id])
+        summary.refresh_from_db()
+        self.assertEqual(rebuilt, {"order_count": summary.order_count, "lifetime_total": summary.lifetime_total,
+                                   "last_order_at": summary.last_order_at, **summary.status_counts})
+
+    def test_summary_follows_the_order_writes(self):
+        self.assertSummary(order_count=1, pending=1, lifetime_total=Decimal("29.99"))
+        first = self.create_order(2)
+        second = self.create_order(1)
+        self.client.patch(f'/api/orders/{second.id}/', content_type='application/json',
+                          data=json.dumps({"order_status": "shipped"}))
+        self.assertSummary(order_count=3, pending=2, shipped=1, lifetime_total=Decimal("119.96"),
+                           last_order_at=second.created_at)
+
+        response = self.client.put(f'/api/orders/{first.id}/', content_type='application/json', data=json.dumps(
+            {"order_items": [{"product": self.product.id, "quantity": 3}], "order_status": "pending"}))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertSummary(order_count=3, pending=2, shipped=1, lifetime_total=Decimal("149.95"))
+
+        self.client.patch(f'/api/orders/{first.id}/', content_type='application/json',
+                          data=json.dumps({"order_status": "canceled"}))
+        self.assertSummary(order_count=3, pending=1, canceled=1, lifetime_total=Decimal("59.98"))
+
+        self.client.delete(f'/api/orders/{second.id}/')
+        self.assertSummary(order_count=2, shipped=0, lifetime_total=Decimal("29.99"),
+                           last_order_at=Order.objects.get(pk=first.pk).created_at)
+
+    def test_bulk_transitions_and_sweeper_update_the_summaries(self):
+        orders = [self.create_order(1) for _ in range(3)]
+        other_user = get_user_model().objects.create_user(username='other')
+        other = Order.objects.create(user=other_user, total_price=10, order_status='pending')
+        self.user.is_staff = True
+        self.user.save()
+        self.client.force_authenticate(self.user)
+
+        response = self.client.post('/api/orders/transitions/', content_type='application/json', data=json.dumps(
+            {"ids": [orders[0].pk, other.pk], "order_status": "shipped"}))
+        self.assertEqual(response.data["succeeded"], 2)
+        self.assertSummary(order_count=4, pending=3, shipped=1, lifetime_total=Decimal("119.96"))
+        self.assertSummary(other_user, order_count=1, pending=0, shipped=1, lifetime_total=Decimal("10.00"))
+
+        StockReservation.objects.filter(order=orders[1]).update(expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(release_expired_reservations(), 1)
+        self.assertSummary(order_count=4, pending=2, canceled=1, lifetime_total=Decimal("89.97"))
+
+    def test_summary_endpoint(self):
+        other_user = get_user_model().objects.create_user(username='other')
+        other_token = RefreshToken.for_user(other_user).access_token
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {other_token}')
+        with self.assertNumQueries(2):  # the user and the summary
+            response = self.client.get('/api/orders/summary/')
+        self.assertEqual(response.data, {"order_count": 0, "status_counts": {
+            "pending": 0, "shipped": 0, "delivered": 0, "canceled": 0}, "lifetime_total": "0.00", "last_order_at": None})
+
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.token}')
+        self.create_order(2)
+        response = self.client.get('/api/orders/summary/')
+        self.assertEqual(response.data["order_count"], 2)
+        self.assertEqual(response.data["status_counts"]["pending"], 2)
+        self.assertEqual(response.data["lifetime_total"], "89.97")
+
+    def test_order_items_keep_the_product_as_ordered(self):
+        order = self.create_order(2)
+        Product.objects.filter(pk=self.product.pk).update(name="Renamed", price=99)
+
+        with self.assertNumQueries(4):  # the user, the count, the orders and their items, not the products
+            response = self.client.get('/api/orders/?compact=true')
+        item = next(order_data for order_data in response.data["results"] if order_data["id"] == order.id)[
+            "order_items"][0]
+        self.assertEqual(item["product"], {"id": self.product.id, "name": self.product.name, "price": "29.99"})
+        self.assertEqual(item["total_price"], "59.98")
+        response = self.client.get(f'/api/orders/{order.id}/')
+        self.assertEqual(response.data["order_items"][0]["total_price"], "59.98")
+        self.assertEqual(response.data["order_items"][0]["product"]["name"], "Renamed")
+        with self.assertNumQueries(3):  # the user, the order and its items
+            response = self.client.get(f'/api/orders/{order.id}/?compact=true')
+        self.assertEqual(response.data["order_items"][0]["product"]["name"], self.product.name)
+
+    def test_rebuild_command(self):
+        self.create_order(1)
+        legacy = OrderItem.objects.create(order=self.order, product=self.product, quantity=1)
+        OrderItem.objects.filter(pk=legacy.pk).update(product_name="", unit_price=None)
+        UserOrderSummary.objects.update(order_count=0, pending_count=0, lifetime_total=0)
+
+        out = StringIO()
+        call_command('rebuild_order_summaries', snapshots=True, stdout=out)
+        self.assertIn('Order summaries rebuilt for 1 users', out.getvalue())
+        self.assertSummary(order_count=2, pending=2, lifetime_total=Decimal("59.98"))
+        legacy.refresh_from_db()
+        self.assertEqual((legacy.product_name, legacy.unit_price), (self.product.name, Decimal("29.99")))
+
+
+class OrderIdempotencyTests(APITestCase):
+
+    def setUp(self):
+        super().setUp()
+        idempotency_store.completed.clear()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.token}')
+
+    def create_order(self, key, quantity=2):
+        data = {"order_items": [{"product": self.product.id, "quantity": quantity}], "order_status": "pending"}
+        return self.client.post('/api/orders/', data=json.dumps(data), content_type='application/json',
+                                HTTP_IDEMPOTENCY_KEY=key)
+
+    def test_retry_returns_the_original_response(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            first = self.create_order('key-1')
+        self.assertEqual(first.status_code, status.HTTP_201_CREATED)
+        self.assertNotIn('Idempotent-Replayed', first)
+
+        # Served from the memory of the process, then from the table once it is forgotten (the user is loaded
+        # by the authentication without a shared user cache)
+        with self.assertNumQueries(1):
+            retry = self.create_order('key-1')
+        idempotency_store.completed.clear()
+        with self.assertNumQueries(2):
+            later_retry = self.create_order('key-1')
+        for response in (retry, later_retry):
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+            self.assertEqual(response['Idempotent-Replayed'], 'true')
+            self.assertEqual(response.json(), first.json())
+
+        self.assertEqual(Order.objects.filter(user=self.user).count(), 2)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock_quantity, 98)
+
+    def test_keys_are_per_user_and_request(self):
+        self.create_order('key-1')
+        self.assertEqual(self.create_order('key-2').status_code, status.HTTP_201_CREATED)
+        self.assertEqual(self.create_order('key-1', quantity=3).status_code, status.HTTP_422_UNPROCESSABLE_ENTITY)
+
+        other = get_user_model().objects.create_user(username='other')
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(other).access_token}')
+        self.assertNotIn('Idempotent-Replayed', self.create_order('key-1'))
+        self.assertEqual(Order.objects.count(), 4)
+
+    def test_request_in_progress_conflicts(self):
+        now = timezone.now()
+        IdempotencyKey.objects.create(user=self.user, scope='OrderListCreateView', key='key-1', fingerprint='',
+                                      created_at=now, expires_at=now + timedelta(days=1))
+        response = self.create_order('key-1')
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(response['Retry-After'], '1')
+        self.assertEqual(Order.objects.count(), 1)
+
+        # A request that never completed does not hold its key forever
+        IdempotencyKey.objects.update(created_at=now - timedelta(minutes=15))
+        self.assertEqual(self.create_order('key-1').status_code, status.HTTP_201_CREATED)
+        self.assertEqual(self.create_order('key-1')['Idempotent-Replayed'], 'true')
+
+    def test_request_outliving_its_claim_is_rolled_back(self):
+        perform_create = OrderListCreateView.perform_create
+
+        def slow_perform_create(view, serializer):
+            perform_create(view, serializer)
+            # A retry took the key over while the request was still running
+            IdempotencyKey.objects.update(created_at=timezone.now() + timedelta(seconds=1))
+
+        with mock.patch.object(OrderListCreateView, 'perform_create', slow_perform_create):
+            response = self.create_order('key-1')
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(Order.objects.count(), 1)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock_quantity, 100)
+        # The claim of the retry is left alone
+        self.assertIsNone(IdempotencyKey.objects.get().response_status)
+
+    def test_failed_request_can_be_retried(self):
+        response = self.create_order('key-1', quantity=101)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(IdempotencyKey.objects.exists())
+        self.product.stock_quantity = 200
+        self.product.save()
+        self.assertEqual(self.create_order('key-1', quantity=101).status_code, status.HTTP_201_CREATED)
+
+    def test_expired_keys_are_forgotten(self):
+        self.create_order('key-1')
+        IdempotencyKey.objects.update(expires_at=timezone.now())
+        idempotency_store.completed.clear()
+        self.assertNotIn('Idempotent-Replayed', self.create_order('key-1'))
+        IdempotencyKey.objects.update(expires_at=timezone.now())
+        self.assertEqual(purge_idempotency_keys.delay().get(), 1)
+
+
+class OrderIdempotencyConcurrencyTests(TransactionTestCase):
+    """
+    Clients sending the same order with the same key at once must create it once.
+    """
+
+    threads = 8
+
+    def setUp(self):
+        idempotency_store.completed.clear()
+        self.user = get_user_model().objects.create_user(username='testuser', password='testpassword')
+        self.product = Product.objects.create(name='Test Product', description='Product description', price=10,
+                                              stock_quantity=100, created_by=self.user, updated_by=self.user)
+        self.token = str(RefreshToken.for_user(self.user).access_token)
+
+    def place_order(self, barrier, responses):
+        client = APIClient()
+        client.raise_request_exception = False
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.token}')
+        data = json.dumps({"order_items": [{"product": self.product.id, "quantity": 3}], "order_status": "pending"})
+        barrier.wait()
+        try:
+            responses.append(client.post('/api/orders/', data=data, content_type='application/json',
+                                         HTTP_IDEMPOTENCY_KEY='same-key'))
+        finally:
+            connection.close()
+
+    def test_concurrent_duplicates_create_one_order(self):
+        responses = []
+        barrier = threading.Barrier(self.threads)
+        workers = [threading.Thread(target=self.place_order, args=(barrier, responses)) for _ in range(self.threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        self.assertEqual(Order.objects.count(), 1)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock_quantity, 97)
+        statuses = Counter(response.status_code for response in responses)
+        self.assertEqual(set(statuses) - {status.HTTP_201_CREATED, status.HTTP_409_CONFLICT}, set())
+        created = [response.json()["id"] for response in responses if response.status_code == status.HTTP_201_CREATED]
+        self.assertEqual(set(created), {Order.objects.get().pk})
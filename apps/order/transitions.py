@@ -0,0 +1,73 @@
+from collections import OrderedDict
+
+from django.db import transaction
+from django.db.models import Sum
+from django.utils import timezone
+
+from apps.base.middleware import get_current_user
+from apps.order.constant import CANCELED, ORDER_TRANSITIONS, SHIPPED
+from apps.order.models import Order, OrderItem, UserOrderSummary
+from apps.order.utils.stock import end_reservations, release_stock
+
+
+def can_transition(source, target):
+    """
+    Return True when an order may move from the `source` status to the `target` one.
+    """
+
+    return target in ORDER_TRANSITIONS.get(source, ())
+
+
+@transaction.atomic
+def transition_orders(order_ids, order_status, queryset=None):
+    """
+    Move orders to a status, validating every order against `ORDER_TRANSITIONS`.
+
+    The queries do not depend on the number of orders: one reads and locks their statuses, the stock of the
+    orders moving out of `pending` is handled with the grouped queries of `apps.order.utils.stock`, and one
+    update changes their status, another one the order summaries of their users. Orders that already have
+    the status are left as they are.
+
+    - `pending` to `shipped` ends the reservations of the orders, their stock stays taken.
+    - `pending` to `canceled` gives the ordered quantities back to the stock.
+    - `shipped` to `delivered` only changes the status.
+
+    Args:
+        order_ids (iterable): The orders to move.
+        order_status (str): The new status.
+        queryset (QuerySet, optional): The orders that may be moved, e.g. the ones of a user, all by default.
+
+    Returns:
+        OrderedDict: Mapping of every order id to its error message, or None when it has the new status.
+    """
+
+    order_ids = list(OrderedDict.fromkeys(order_ids))
+    queryset = Order.objects.all() if queryset is None else queryset
+    orders = {values[0]: values[1:] for values in queryset.select_for_update().filter(pk__in=order_ids).values_list(
+        "pk", *UserOrderSummary.ORDER_FIELDS)}
+
+    results, moved = OrderedDict(), []
+    for pk in order_ids:
+        status = orders[pk][1] if pk in orders else None
+        if status is None:
+            results[pk] = "Order not found."
+        elif status != order_status and not can_transition(status, order_status):
+            results[pk] = f"Order status cannot change from {status} to {order_status}."
+        else:
+            results[pk] = None
+            if status != order_status:
+                moved.append(pk)
+
+    if moved:
+        if order_status == CANCELED:
+            rows = OrderItem.objects.filter(order_id__in=moved).values("product_id").annotate(
+                total=Sum("quantity")).order_by("product_id")
+            release_stock({row["product_id"]: row["total"] for row in rows})
+        if order_status in (SHIPPED, CANCELED):
+            end_reservations(moved)
+        Order.objects.filter(pk__in=moved).update(order_status=order_status, updated_at=timezone.now(),
+                                                  updated_by=get_current_user())
+        removed = [orders[pk] for pk in moved]
+        UserOrderSummary.apply_order_changes(
+            added=[(user_id, order_status, *values) for user_id, _, *values in removed], removed=removed)
+    return results
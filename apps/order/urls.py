@@ -1,8 +1,12 @@
 from django.urls import path
-from .views import OrderListCreateView, OrderRUDAPIView
+from .views import (OrderExportAPIView, OrderListCreateView, OrderRUDAPIView, OrderSummaryAPIView,
+                    OrderTransitionAPIView)
 
 
 urlpatterns = [
     path('orders/', OrderListCreateView.as_view(), name='order-list-create'),
+    path('orders/export/', OrderExportAPIView.as_view(), name='order-export'),
+    path('orders/summary/', OrderSummaryAPIView.as_view(), name='order-summary'),
+    path('orders/transitions/', OrderTransitionAPIView.as_view(), name='order-transitions'),
     path('orders/<int:pk>/', OrderRUDAPIView.as_view(), name='order-retrieve-update'),
 ]
@@ -0,0 +1,306 @@
+from collections import OrderedDict
+from datetime import timedelta
+from functools import reduce
+from operator import or_
+
+from django.conf import settings
+from django.db import models, transaction
+from django.db.models import Case, F, Q, Sum, Value, When
+from django.utils import timezone
+
+from apps.base.cache import catalog_cache
+from apps.base.mixins.exception import StockInsufficient
+from apps.order.constant import CANCELED, PENDING
+from apps.order.models import Order, StockReservation, UserOrderSummary
+from apps.product.models import Product
+
+
+def aggregate_quantities(order_items):
+    """
+    Sum the requested quantities of the order items per product.
+
+    The same product may appear on several lines of one order, the stock has to be checked against the
+    total quantity. Products are returned in ascending primary key order so that every order locks the
+    product rows in the same sequence, which avoids deadlocks between concurrent checkouts.
+
+    Args:
+        order_items (list): Validated order item data, each item holding a `product` and a `quantity`.
+
+    Returns:
+        OrderedDict: Mapping of product id to the total quantity, sorted by product id.
+    """
+
+    quantities = {}
+    for item in order_items:
+        product = item["product"]
+        product_id = product.pk if isinstance(product, Product) else product
+        quantities[product_id] = quantities.get(product_id, 0) + item["quantity"]
+    return OrderedDict(sorted(quantities.items()))
+
+
+def reserve_stock(order_items, invalidate=True):
+    """
+    Decrement the stock of every product of an order with conditional updates.
+
+    The rows of the products are locked in product id order first, like every update of several products,
+    so that concurrent checkouts cannot deadlock. The whole order is then reserved with a single `UPDATE ...
+    SET stock_quantity = stock_quantity - n WHERE stock_quantity >= n` statement covering all of its products,
+    so the check and the decrement happen atomically inside the database and no concurrent checkout can
+    oversell a product. When that statement does not match every product, it is rolled back and the products
+    are reserved one by one to find out exactly which lines cannot be served.
+
+    Args:
+        order_items (list): Validated order item data, each item holding a `product` and a `quantity`.
+        invalidate (bool): Invalidate the cached products, False when the order event pipeline does it.
+
+    Returns:
+        OrderedDict: Mapping of product id to the reserved quantity.
+
+    Raises:
+        StockInsufficient: If at least one product does not have enough stock.
+    """
+
+    quantities = aggregate_quantities(order_items)
+    if not quantities:
+        return quantities
+
+    _lock_products(quantities.keys())
+    try:
+        with transaction.atomic():
+            condition = reduce(or_, (Q(pk=pk, stock_quantity__gte=quantity) for pk, quantity in quantities.items()))
+            updated = Product.objects.filter(condition).update(
+                stock_quantity=F("stock_quantity") - _quantity_case(quantities))
+            if updated != len(quantities):
+                raise StockInsufficient()
+    except StockInsufficient:
+        _reserve_stock_per_product(order_items, quantities)
+
+    if invalidate:
+        catalog_cache.invalidate_rows(Product, quantities.keys())
+    return quantities
+
+
+def release_stock(quantities, invalidate=True):
+    """
+    Give quantities back to the stock of their products with a single grouped update.
+
+    Args:
+        quantities (dict): Mapping of product id to the quantity to add back to the stock.
+        invalidate (bool): Invalidate the cached products, False when the order event pipeline does it.
+
+    Returns:
+        int: The number of products updated.
+    """
+
+    quantities = OrderedDict(sorted((pk, quantity) for pk, quantity in quantities.items() if quantity))
+    if not quantities:
+        return 0
+    _lock_products(quantities.keys())
+    updated = Product.objects.filter(pk__in=quantities.keys()).update(
+        stock_quantity=F("stock_quantity") + _quantity_case(quantities))
+    if invalidate:
+        catalog_cache.invalidate_rows(Product, quantities.keys())
+    return updated
+
+
+def ordered_quantities(order):
+    """
+    Sum the quantities of the stored order items of an order per product, with one grouped query.
+
+    Args:
+        order (Order): The order whose items are summed.
+
+    Returns:
+        OrderedDict: Mapping of product id to the ordered quantity, sorted by product id.
+    """
+
+    rows = order.order_items.values("product_id").annotate(total=Sum("quantity")).order_by("product_id")
+    return OrderedDict((row["product_id"], row["total"]) for row in rows)
+
+
+def adjust_stock(order, order_items, invalidate=True):
+    """
+    Move the stock of an order from its stored items to the new items, touching only the products whose
+    ordered quantity actually changed. Increases are reserved with conditional updates, decreases are
+    released with a single grouped update.
+
+    Args:
+        order (Order): The order being modified, its stored items are the current reservation.
+        order_items (list): Validated data of the new order items.
+        invalidate (bool): Invalidate the cached products, False when the order event pipeline does it.
+
+    Returns:
+        list: The ids of the products whose stock changed.
+
+    Raises:
+        StockInsufficient: If a product does not have enough stock for the increased quantity.
+    """
+
+    current = ordered_quantities(order)
+    requested = aggregate_quantities(order_items)
+    products = {item["product"].pk: item["product"] for item in order_items if isinstance(item["product"], Product)}
+
+    increases = [
+        {"product": products.get(pk, pk), "quantity": quantity - current.get(pk, 0)}
+        for pk, quantity in requested.items() if quantity > current.get(pk, 0)
+    ]
+    decreases = {pk: quantity - requested.get(pk, 0) for pk, quantity in current.items()
+                 if quantity > requested.get(pk, 0)}
+
+    reserve_stock(increases, invalidate)
+    release_stock(decreases, invalidate)
+    return sorted({item["product"].pk if isinstance(item["product"], Product) else item["product"]
+                   for item in increases} | decreases.keys())
+
+
+def hold_stock(order, quantities, ttl=None):
+    """
+    Hold the stock taken by a pending order with reservations, replacing the current ones of the order.
+
+    The reservations expire `ttl` seconds after the order first held stock, changing the order does not extend
+    them. The `reserved_quantity` of the products moves by the difference with a single grouped update.
+
+    Args:
+        order (Order): The pending order, its stock already taken.
+        quantities (dict): Mapping of product id to the quantity taken by the order.
+        ttl (int, optional): Lifetime of new reservations in seconds, `STOCK_RESERVATIONS['TTL']` by default.
+
+    Returns:
+        datetime: When the reservations expire.
+    """
+
+    current = list(order.reservations.all())
+    if current:
+        expires_at = min(reservation.expires_at for reservation in current)
+    else:
+        expires_at = timezone.now() + timedelta(seconds=ttl or settings.STOCK_RESERVATIONS["TTL"])
+
+    deltas = dict(quantities)
+    for reservation in current:
+        deltas[reservation.product_id] = deltas.get(reservation.product_id, 0) - reservation.quantity
+    _update_reserved_quantities({pk: delta for pk, delta in deltas.items() if delta})
+
+    if current:
+        StockReservation.objects.filter(pk__in=[reservation.pk for reservation in current]).delete()
+    StockReservation.objects.bulk_create([
+        StockReservation(order=order, product_id=pk, quantity=quantity, expires_at=expires_at)
+        for pk, quantity in quantities.items() if quantity
+    ])
+    return expires_at
+
+
+@transaction.atomic
+def end_reservations(order_ids, release=False):
+    """
+    Remove the reservations of orders, giving their stock back when `release` is True (canceled or expired
+    orders) or leaving it taken (shipped orders).
+
+    The queries do not depend on the number of orders: one reads and locks the reservations, one deletes them
+    and one grouped update moves the stock and the reserved quantities of all their products.
+
+    Args:
+        order_ids (list): The orders whose reservations end.
+        release (bool): Give the reserved quantities back to the stock.
+
+    Returns:
+        OrderedDict: Mapping of product id to the quantity that was reserved, sorted by product id.
+    """
+
+    rows = list(StockReservation.objects.select_for_update().filter(order_id__in=order_ids).order_by(
+        "pk").values_list("pk", "product_id", "quantity"))
+    if not rows:
+        return OrderedDict()
+
+    StockReservation.objects.filter(pk__in=[pk for pk, _, _ in rows]).delete()
+    quantities = aggregate_quantities([{"product": product_id, "quantity": quantity}
+                                       for _, product_id, quantity in rows])
+    changes = {"reserved_quantity": F("reserved_quantity") - _quantity_case(quantities)}
+    if release:
+        changes["stock_quantity"] = F("stock_quantity") + _quantity_case(quantities)
+    _lock_products(quantities.keys())
+    Product.objects.filter(pk__in=quantities.keys()).update(**changes)
+    catalog_cache.invalidate_rows(Product, quantities.keys())
+    return quantities
+
+
+def release_expired_reservations(batch_size=None, now=None):
+    """
+    Cancel the pending orders whose reservations expired, give their stock back and update the order
+    summaries of their users.
+
+    The orders are processed `batch_size` at a time, each batch in its own transaction with set based
+    queries, so the sweep holds its locks briefly whatever the number of expired orders.
+
+    Args:
+        batch_size (int, optional): Orders per batch, `STOCK_RESERVATIONS['SWEEP_BATCH_SIZE']` by default.
+        now (datetime, optional): Reservations expiring until then are released, the current time by default.
+
+    Returns:
+        int: The number of orders canceled.
+    """
+
+    batch_size = batch_size or settings.STOCK_RESERVATIONS["SWEEP_BATCH_SIZE"]
+    now = now or timezone.now()
+    expired = StockReservation.objects.filter(expires_at__lte=now, order__order_status=PENDING)
+    canceled = 0
+    while True:
+        with transaction.atomic():
+            order_ids = list(expired.values_list("order_id", flat=True).distinct().order_by("order_id")[:batch_size])
+            if not order_ids:
+                return canceled
+            orders = list(Order.objects.select_for_update().filter(pk__in=order_ids, order_status=PENDING).values_list(
+                *UserOrderSummary.ORDER_FIELDS))
+            end_reservations(order_ids, release=True)
+            canceled += Order.objects.filter(pk__in=order_ids, order_status=PENDING).update(order_status=CANCELED)
+            UserOrderSummary.apply_order_changes(
+                added=[(user_id, CANCELED, *values) for user_id, _, *values in orders], removed=orders)
+
+
+def _lock_products(product_ids):
+    """
+    Lock the rows of the products in product id order before they are updated with a single statement, which
+    locks its rows in no defined order: concurrent updates of overlapping products could deadlock. A single
+    product needs no ordering.
+    """
+
+    product_ids = sorted(product_ids)
+    if len(product_ids) > 1:
+        list(Product.objects.select_for_update().filter(pk__in=product_ids).order_by("pk").values_list(
+            "pk", flat=True))
+
+
+def _update_reserved_quantities(deltas):
+    if deltas:
+        _lock_products(deltas.keys())
+        Product.objects.filter(pk__in=deltas.keys()).update(
+            reserved_quantity=F("reserved_quantity") + _quantity_case(deltas, models.IntegerField()))
+
+
+def _quantity_case(quantities, output_field=None):
+    return Case(*[When(pk=pk, then=Value(quantity)) for pk, quantity in quantities.items()],
+                default=Value(0), output_field=output_field or models.PositiveIntegerField())
+
+
+def _reserve_stock_per_product(order_items, quantities):
+    """
+    Reserve the products one conditional update at a time, in product id order, and report every product
+    that does not have enough stock. The updates run in a savepoint, a failure leaves the stock untouched.
+    """
+
+    failed = []
+
+    with transaction.atomic():
+        for product_id, quantity in quantities.items():
+            updated = Product.objects.filter(pk=product_id, stock_quantity__gte=quantity).update(
+                stock_quantity=F("stock_quantity") - quantity)
+            if not updated:
+                failed.append(product_id)
+
+        if failed:
+            # Raising inside the savepoint rolls back the lines that were already decremented
+            names = {item["product"].pk: item["product"].name for item in order_items
+                     if isinstance(item["product"], Product)}
+            raise StockInsufficient(
+                "Insufficient stock for " + ", ".join(f"#{pk}-{names.get(pk, '')}" for pk in failed),
+                failed_items=failed
+            )
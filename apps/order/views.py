@@ -1,17 +1,23 @@
 from functools import cached_property
 
 from django.db import transaction
-from rest_framework import generics
+from rest_framework import generics, permissions
 from rest_framework.generics import get_object_or_404
+from rest_framework.response import Response
 
-from .constant import SHIPPED, DELIVERED
-from .models import Order
-from .serializers import OrderSerializer
+from .constant import PENDING
+from .models import Order, UserOrderSummary
+from .serializers import OrderSerializer, OrderTransitionSerializer, UserOrderSummarySerializer, is_compact
 from apps.base.mixins.exception import OrderExceptionMixin, OrderException
+from apps.base.mixins.idempotency import IdempotencyMixin
+from apps.base.mixins.streaming import StreamingExportMixin
+from apps.base.views import AsyncReadAPIView
 from apps.order.mixins.order_mixin import OrderManagerMixin
+from apps.order.transitions import can_transition, transition_orders
+from apps.order.utils.stock import end_reservations
 
 
-class OrderListCreateView(OrderManagerMixin, OrderExceptionMixin, generics.ListCreateAPIView):
+class OrderListCreateView(IdempotencyMixin, OrderManagerMixin, OrderExceptionMixin, generics.ListCreateAPIView):
     """
     API endpoint for listing and creating orders.
 
@@ -27,9 +33,10 @@ class OrderListCreateView(OrderManagerMixin, OrderExceptionMixin, generics.ListC
         GET /orders/
         ```
 
-     - To create a new order:
+     - To create a new order, the `Idempotency-Key` header makes the retries of the request safe:
         ```http
         POST /orders/
+        Idempotency-Key: 5f1c2a3e-0b7d-4c8e-9a41-2d6f3b8e7c10
         ```
         Payload:
         ```json
@@ -41,19 +48,83 @@ class OrderListCreateView(OrderManagerMixin, OrderExceptionMixin, generics.ListC
             // Additional fields for the order
         }
         ```
+
+     - To list orders with keyset pagination (no COUNT and OFFSET, follow the `next` link):
+        ```http
+        GET /orders/?pagination=cursor
+        ```
+
+     - To list orders with the compact items (product id, name and price only):
+        ```http
+        GET /orders/?compact=true
+        ```
+
+     - To list the orders of a status:
+        ```http
+        GET /orders/?order_status=shipped
+        ```
     """
 
     serializer_class = OrderSerializer
+    keyset_ordering = ('-created_at', '-id')
+    filterset_fields = ('order_status',)
 
     def get_queryset(self):
         return Order.objects.filter(user=self.request.user).prefetch_related(
-            "order_items", "order_items__product").select_related("user").order_by("-id")
+            OrderSerializer.get_order_items_prefetch(is_compact(self.request))
+        ).select_related("user").order_by("-id")
 
     @transaction.atomic
     def perform_create(self, serializer):
         self._process_order(serializer)  # add order
 
 
+class OrderExportAPIView(StreamingExportMixin, generics.GenericAPIView):
+    """
+    API endpoint streaming the full order history of the authenticated user as a JSON array, with bounded
+    memory whatever the number of orders.
+
+    Examples:
+     - To download all orders:
+        ```http
+        GET /orders/export/
+        ```
+
+     - To download all orders with the compact items:
+        ```http
+        GET /orders/export/?compact=true
+        ```
+    """
+
+    serializer_class = OrderSerializer
+    export_filename = 'orders.json'
+
+    def get_queryset(self):
+        return Order.objects.filter(user=self.request.user).prefetch_related(
+            OrderSerializer.get_order_items_prefetch(is_compact(self.request))
+        ).select_related("user").order_by("-id")
+
+    def get(self, request, *args, **kwargs):
+        return self.stream_export(request)
+
+
+class OrderListAsyncAPIView(AsyncReadAPIView):
+    """
+    Async list of the orders of the authenticated user, served by the ASGI deployment. The responses are the
+    same as the ones of `OrderListCreateView`, which handles the order creation.
+    """
+
+    serializer_class = OrderSerializer
+    keyset_ordering = OrderListCreateView.keyset_ordering
+    filterset_fields = OrderListCreateView.filterset_fields
+
+    def get_queryset(self):
+        # The serializer must not query lazily in the event loop
+        return Order.objects.filter(user=self.request.user).prefetch_related(
+            OrderSerializer.get_order_items_prefetch(is_compact(self.request))
+        ).select_related("user").order_by("-id")
+
+
 class OrderRUDAPIView(OrderManagerMixin, OrderExceptionMixin, generics.RetrieveUpdateDestroyAPIView):
     """
     API endpoint for retrieving, updating, and deleting a specific order.
@@ -71,6 +142,11 @@ class OrderRUDAPIView(OrderManagerMixin, OrderExceptionMixin, generics.RetrieveU
         GET /orders/{order_id}/
         ```
 
+     - To retrieve an order with the compact items (product id, name and price only):
+        ```http
+        GET /orders/{order_id}/?compact=true
+        ```
+
      - To update a specific order:
         ```http
         PUT /orders/{order_id}/
@@ -95,9 +171,16 @@ class OrderRUDAPIView(OrderManagerMixin, OrderExceptionMixin, generics.RetrieveU
     serializer_class = OrderSerializer
 
     def get_queryset(self):
-        return Order.objects.filter(
+        queryset = Order.objects.filter(
             pk=self.kwargs[self.lookup_field], user=self.request.user
-        ).prefetch_related("order_items", "order_items__product").select_related("user")
+        ).prefetch_related(
+            OrderSerializer.get_order_items_prefetch(is_compact(self.request))
+        ).select_related("user")
+        if self.request.method not in permissions.SAFE_METHODS:
+            # Lock the order until the write commits, the sweeper and the bulk transitions change its status
+            # concurrently and the write must see the current one
+            queryset = queryset.select_for_update(of=("self",))
+        return queryset
 
     @cached_property
     def order(self):
@@ -106,14 +189,119 @@ class OrderRUDAPIView(OrderManagerMixin, OrderExceptionMixin, generics.RetrieveU
     def get_object(self):
         return self.order
 
+    @transaction.atomic
+    def update(self, request, *args, **kwargs):
+        return super().update(request, *args, **kwargs)
+
+    @transaction.atomic
+    def destroy(self, request, *args, **kwargs):
+        return super().destroy(request, *args, **kwargs)
+
     @transaction.atomic
     def perform_update(self, serializer):
-        # Check if the order is in a modifiable status
-        if self.order.order_status not in [SHIPPED, DELIVERED]:
-            if serializer.validated_data.get("order_items", None) is not None:
-                # Delete existing order items and create new ones
-                self.restore_order_items(self.order)  # restore order
-                self._process_order(serializer)  # add order
-        else:
-            # If the order status is not eligible for modification, raise an exception
-            raise OrderException("Order status not eligible for modification")
+        # Read under the lock taken by get_queryset(), the status cannot change until the update commits
+        current = self.order.order_status
+        order_status = serializer.validated_data.get("order_status", current)
+        if order_status != current and not can_transition(current, order_status):
+            raise OrderException(f"Order status cannot change from {current} to {order_status}")
+
+        if serializer.validated_data.get("order_items", None) is not None:
+            # Only pending orders can change their items
+            if current != PENDING:
+                raise OrderException("Order status not eligible for modification")
+            # Adjust the stock of the changed items and replace the order items
+            self._update_order(serializer)  # update order
+        elif order_status != current:
+            # Same side effects as the bulk transitions, e.g. canceling gives the stock back
+            transition_orders([self.order.pk], order_status)
+            self.order.order_status = order_status
+
+    @transaction.atomic
+    def perform_destroy(self, instance):
+        # The stock held by a pending order is given back
+        if instance.order_status == PENDING:
+            end_reservations([instance.pk], release=True)
+        instance.delete()
+
+
+class OrderTransitionAPIView(OrderExceptionMixin, generics.GenericAPIView):
+    """
+    API endpoint moving many orders to a new status at once, e.g. to ship the orders of a warehouse.
+
+    Every order is validated against the allowed transitions (pending to shipped or canceled, shipped to
+    delivered), the valid ones are moved with a few set based queries whatever their number and the result of
+    each order is returned. Staff users may move any order, the other users their own orders.
+
+    Examples:
+     - To ship orders:
+        ```http
+        POST /orders/transitions/
+        ```
+        Payload:
+        ```json
+        {"ids": [1, 2, 3], "order_status": "shipped"}
+        ```
+        Response:
+        ```json
+        {
+            "order_status": "shipped",
+            "succeeded": 2,
+            "results": [
+                {"id": 1, "ok": true},
+                {"id": 2, "ok": true},
+                {"id": 3, "ok": false, "detail": "Order status cannot change from delivered to shipped."}
+            ]
+        }
+        ```
+    """
+
+    serializer_class = OrderTransitionSerializer
+
+    def get_queryset(self):
+        if self.request.user.is_staff:
+            return Order.objects.all()
+        return Order.objects.filter(user=self.request.user)
+
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        order_status = serializer.validated_data["order_status"]
+        results = transition_orders(serializer.validated_data["ids"], order_status, self.get_queryset())
+        return Response({
+            "order_status": order_status,
+            "succeeded": sum(detail is None for detail in results.values()),
+            "results": [{"id": pk, "ok": True} if detail is None else {"id": pk, "ok": False, "detail": detail}
+                        for pk, detail in results.items()],
+        })
+
+
+class OrderSummaryAPIView(generics.RetrieveAPIView):
+    """
+    API endpoint returning the order history totals of the authenticated user: the number of orders per
+    status, the total price of the orders that were not canceled and the date of the latest order.
+
+    The totals are maintained with every order write (see `UserOrderSummary`), they are read from one row
+    whatever the number of orders.
+
+    Examples:
+     - To retrieve the summary:
+        ```http
+        GET /orders/summary/
+        ```
+        Response:
+        ```json
+        {
+            "order_count": 3,
+            "status_counts": {"pending": 1, "shipped": 1, "delivered": 0, "canceled": 1},
+            "lifetime_total": "89.97",
+            "last_order_at": "2023-08-01T10:00:00Z"
+        }
+        ```
+    """
+
+    serializer_class = UserOrderSummarySerializer
+
+    def get_object(self):
+        # Users without orders have no summary row
+        summary = UserOrderSummary.objects.filter(user_id=self.request.user.pk).first()
+        return summary or UserOrderSummary(user_id=self.request.user.pk)
@@ -1,5 +1,111 @@
+from django import forms
 from django.apps import apps
-from django.contrib import admin
+from django.contrib import admin, messages
+from django.http import StreamingHttpResponse
+from django.shortcuts import redirect
+from django.template.response import TemplateResponse
+from django.urls import path
 
-app_models = apps.get_app_config('product').get_models()
-admin.site.register(list(app_models))
+from apps.base.importexport import CONTENT_TYPES, FORMATS, import_stream, iter_export
+from .models import Product, ProductCategory
+from .resources import ProductCategoryResource, ProductResource, ProductStockResource
+
+MAX_ERROR_MESSAGES = 20
+
+
+class CatalogImportForm(forms.Form):
+    resource = forms.ChoiceField()
+    file = forms.FileField(help_text="CSV or JSONL file, with the columns of the export.")
+    dry_run = forms.BooleanField(required=False, help_text="Validate the rows without saving them.")
+
+    def __init__(self, *args, resources=(), **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fields["resource"].choices = [(name, name) for name in resources]
+
+    def clean_file(self):
+        upload = self.cleaned_data["file"]
+        if upload.name.rsplit(".", 1)[-1].lower() not in FORMATS:
+            raise forms.ValidationError(f"Unsupported file type, use one of {', '.join(FORMATS)}.")
+        return upload
+
+
+class CatalogImportExportAdmin(admin.ModelAdmin):
+    """
+    Admin with streamed CSV and JSONL exports of the selected rows, and an import page processing the uploaded
+    file in chunks with `import_stream()`.
+
+    Attributes:
+        resources (dict): Resources of the model by name, the first one is used by the export actions.
+    """
+
+    resources = {}
+    actions = ["export_csv", "export_jsonl"]
+    change_list_template = "admin/product/import_export_change_list.html"
+
+    def get_urls(self):
+        info = self.model._meta.app_label, self.model._meta.model_name
+        return [
+            path("import/", self.admin_site.admin_view(self.import_view), name="%s_%s_import" % info),
+        ] + super().get_urls()
+
+    def import_view(self, request):
+        if not self.has_add_permission(request) or not self.has_change_permission(request):
+            return redirect("admin:index")
+
+        form = CatalogImportForm(request.POST or None, request.FILES or None, resources=self.resources)
+        if request.method == "POST" and form.is_valid():
+            upload = form.cleaned_data["file"]
+            resource = self.resources[form.cleaned_data["resource"]]()
+            report = import_stream(resource, upload, upload.name.rsplit(".", 1)[-1].lower(),
+                                   dry_run=form.cleaned_data["dry_run"])
+            level = messages.WARNING if report.error_count else messages.SUCCESS
+            self.message_user(request, f"{upload.name}: {report.summary()}", level)
+            for line, message in report.errors[:MAX_ERROR_MESSAGES]:
+                self.message_user(request, f"Line {line}: {message}", messages.ERROR)
+            return redirect(f"admin:{self.model._meta.app_label}_{self.model._meta.model_name}_changelist")
+
+        context = {
+            **self.admin_site.each_context(request),
+            "opts": self.model._meta,
+            "form": form,
+            "title": f"Import {self.model._meta.verbose_name_plural}",
+        }
+        return TemplateResponse(request, "admin/product/import_form.html", context)
+
+    def export(self, queryset, file_format):
+        resource = next(iter(self.resources.values()))()
+        response = StreamingHttpResponse(iter_export(resource, queryset.order_by("pk"), file_format),
+                                         content_type=CONTENT_TYPES[file_format])
+        response["Content-Disposition"] = f'attachment; filename="{self.model._meta.model_name}.{file_format}"'
+        return response
+
+    @admin.action(description="Export selected rows as CSV")
+    def export_csv(self, request, queryset):
+        return self.export(queryset, "csv")
+
+    @admin.action(description="Export selected rows as JSONL")
+    def export_jsonl(self, request, queryset):
+        return self.export(queryset, "jsonl")
+
+
+@admin.register(Product)
+class ProductAdmin(CatalogImportExportAdmin):
+    resources = {"products": ProductResource, "stock": ProductStockResource}
+    actions = CatalogImportExportAdmin.actions + ["export_stock_csv"]
+
+    @admin.action(description="Export stock levels of selected products as CSV")
+    def export_stock_csv(self, request, queryset):
+        response = StreamingHttpResponse(iter_export(ProductStockResource(), queryset.order_by("pk"), "csv"),
+                                         content_type=CONTENT_TYPES["csv"])
+        response["Content-Disposition"] = 'attachment; filename="stock.csv"'
+        return response
+
+
+@admin.register(ProductCategory)
+class ProductCategoryAdmin(CatalogImportExportAdmin):
+    resources = {"categories": ProductCategoryResource}
+
+
+app_models = [model for model in apps.get_app_config('product').get_models()
+              if not admin.site.is_registered(model)]
+admin.site.register(app_models)
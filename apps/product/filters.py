@@ -0,0 +1,128 @@
+from collections import OrderedDict
+
+import django_filters
+from django.db.models import Case, CharField, Count, IntegerField, Q, Subquery, Value, When
+from django.db.models.functions import Substr
+
+from apps.product.models import PATH_SEGMENT_WIDTH, Product, ProductCategory
+
+# Bounds of the price facet ranges, the last range has no upper bound
+PRICE_BOUNDS = (0, 25, 50, 100, 250, 500)
+RATING_THRESHOLDS = (4, 3, 2, 1)
+
+
+class ProductFilterSet(django_filters.FilterSet):
+    """
+    Filters of the product lists, and facet counts of the filtered products.
+
+    Every facet is counted over the products matching all the filters except its own ones, so that selecting
+    a price range still shows the counts of the other ranges, with one grouped query per facet.
+
+    Example:
+        GET /products/?min_price=25&max_price=100&in_stock=true&category=4&min_rating=4&facets=true
+    """
+
+    min_price = django_filters.NumberFilter(field_name="price", lookup_expr="gte")
+    max_price = django_filters.NumberFilter(field_name="price", lookup_expr="lte")
+    in_stock = django_filters.BooleanFilter(method="filter_in_stock")
+    category = django_filters.NumberFilter(method="filter_category", help_text="Category, subcategories included.")
+    min_rating = django_filters.NumberFilter(field_name="rating_average", lookup_expr="gte")
+
+    facet_query_param = "facets"
+    facet_filters = OrderedDict([
+        ("price", ("min_price", "max_price")),
+        ("stock", ("in_stock",)),
+        ("category", ("category",)),
+        ("rating", ("min_rating",)),
+    ])
+
+    class Meta:
+        model = Product
+        fields = ["min_price", "max_price", "in_stock", "category", "min_rating"]
+
+    def filter_in_stock(self, queryset, name, value):
+        return queryset.filter(stock_quantity__gt=0) if value else queryset.filter(stock_quantity=0)
+
+    def filter_category(self, queryset, name, value):
+        # The path of the category is read by a subquery, the products of the subtree are found in one query
+        path = Subquery(ProductCategory.objects.filter(pk=value).values("path")[:1])
+        in_subtree = Product.categories.through.objects.filter(
+            productcategory__path__startswith=path).values("product_id")
+        return queryset.filter(pk__in=in_subtree)
+
+    @classmethod
+    def facets_requested(cls, request):
+        return request.query_params.get(cls.facet_query_param, "").lower() in ("1", "true", "yes")
+
+    def filter_queryset_excluding(self, queryset, excluded):
+        for name, value in self.form.cleaned_data.items():
+            if name not in excluded:
+                queryset = self.filters[name].filter(queryset, value)
+        return queryset
+
+    def get_facets(self):
+        """
+        Return the counts of the products per price range, stock status, category and minimum rating.
+
+        Returns:
+            dict: The counts of every facet, keyed by facet name.
+        """
+
+        facets = OrderedDict()
+        for facet, excluded in self.facet_filters.items():
+            queryset = self.filter_queryset_excluding(self.queryset, excluded).order_by()
+            facets[facet] = getattr(self, f"get_{facet}_facet")(queryset)
+        return facets
+
+    @staticmethod
+    def get_price_facet(queryset):
+        ranges = list(zip(PRICE_BOUNDS, PRICE_BOUNDS[1:] + (None,)))
+        bucket = Case(*[When(price__gte=low, then=Value(index)) if high is None else
+                        When(price__gte=low, price__lt=high, then=Value(index))
+                        for index, (low, high) in enumerate(ranges)], output_field=IntegerField())
+        counts = dict(queryset.annotate(bucket=bucket).values_list("bucket").annotate(count=Count("pk")))
+        return [{"min": low, "max": high, "count": counts.get(index, 0)} for index, (low, high) in enumerate(ranges)]
+
+    @staticmethod
+    def get_stock_facet(queryset):
+        return queryset.aggregate(in_stock=Count("pk", filter=Q(stock_quantity__gt=0)),
+                                  out_of_stock=Count("pk", filter=Q(stock_quantity=0)))
+
+    def get_category_facet(self, queryset):
+        """
+        Count the products of every subcategory of the filtered category, or of every root category, their
+        own subcategories included. The products are grouped by the path prefix of the subcategories.
+        """
+
+        category_id, parent = self.form.cleaned_data.get("category"), None
+        if category_id is not None:
+            parent = ProductCategory.objects.filter(pk=category_id).only("path", "depth").first()
+            if parent is None:
+                return []
+
+        depth = parent.depth + 1 if parent else 0
+        prefix_length = (depth + 1) * (PATH_SEGMENT_WIDTH + 1)
+        memberships = Product.categories.through.objects.filter(
+            product__in=queryset.values("pk"), productcategory__depth__gte=depth)
+        if parent:
+            memberships = memberships.filter(productcategory__path__startswith=parent.path)
+        counts = memberships.annotate(
+            prefix=Substr("productcategory__path", 1, prefix_length, output_field=CharField())).values_list(
+            "prefix").annotate(count=Count("product_id", distinct=True))
+
+        counts = {int(prefix[-PATH_SEGMENT_WIDTH - 1:-1]): count for prefix, count in counts}
+        names = dict(ProductCategory.objects.filter(pk__in=counts.keys()).values_list("pk", "name"))
+        return [{"id": pk, "name": names.get(pk, ""), "count": count}
+                for pk, count in sorted(counts.items(), key=lambda item: (-item[1], item[0]))]
+
+    @staticmethod
+    def get_rating_facet(queryset):
+        bucket = Case(*[When(rating_average__gte=threshold, then=Value(threshold))
+                        for threshold in RATING_THRESHOLDS], default=Value(0), output_field=IntegerField())
+        counts = dict(queryset.annotate(bucket=bucket).values_list("bucket").annotate(count=Count("pk")))
+        # Cumulative counts, a product rated 4.5 counts for "4 and up" and every lower threshold
+        facet, total = [], 0
+        for threshold in RATING_THRESHOLDS:
+            total += counts.get(threshold, 0)
+            facet.append({"min_rating": threshold, "count": total})
+        return facet
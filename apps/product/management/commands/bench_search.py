@@ -0,0 +1,93 @@
+import itertools
+import random
+import statistics
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q
+
+from apps.product.management.commands.rebuild_search_index import rebuild_index
+from apps.product.models import Product
+from apps.product.search import search_products
+
+
+class Command(BaseCommand):
+    """
+    Benchmark of the product search index against `icontains` filters on synthetic products.
+
+    The products and their index are written in a transaction rolled back at the end, so the database is
+    left unchanged. Descriptions are drawn from a Zipf-like vocabulary, the queries are two words, the last
+    one cut for prefix matching. The `icontains` filters stop at the 20 newest matches, but have to scan the
+    table until they find them.
+
+    Example:
+        python manage.py bench_search --products 1000000 --queries 50
+    """
+
+    help = "Compare the latency of the search index with LIKE scans on synthetic products."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--products", type=int, default=1000000, help="Number of synthetic products.")
+        parser.add_argument("--queries", type=int, default=50, help="Number of queries per method.")
+        parser.add_argument("--vocabulary", type=int, default=20000, help="Number of distinct words.")
+        parser.add_argument("--batch-size", type=int, default=5000, help="Number of products per insert batch.")
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        generator = random.Random(options["seed"])
+        vocabulary = [self.make_word(generator) for _ in range(options["vocabulary"])]
+        weights = list(itertools.accumulate(1 / rank for rank in range(1, len(vocabulary) + 1)))
+        queries = [f"{generator.choice(vocabulary)} {generator.choice(vocabulary)[:4]}"
+                   for _ in range(options["queries"])]
+
+        with transaction.atomic():
+            started = time.perf_counter()
+            self.create_products(generator, vocabulary, weights, options["products"], options["batch_size"])
+            self.stdout.write(f"Created {options['products']} products in {time.perf_counter() - started:.1f}s")
+
+            started = time.perf_counter()
+            rebuild_index(options["batch_size"])
+            self.stdout.write(f"Indexed them in {time.perf_counter() - started:.1f}s")
+
+            self.stdout.write(f"{'method':<10} {'p50 ms':>9} {'p95 ms':>9} {'max ms':>9}")
+            for name, run in (("index", self.search_index), ("icontains", self.search_like)):
+                durations = []
+                for query in queries:
+                    started = time.perf_counter()
+                    run(query)
+                    durations.append((time.perf_counter() - started) * 1000)
+                durations.sort()
+                p95 = durations[min(len(durations) - 1, int(len(durations) * 0.95))]
+                self.stdout.write(f"{name:<10} {statistics.median(durations):>9.2f} {p95:>9.2f} "
+                                  f"{durations[-1]:>9.2f}")
+
+            transaction.set_rollback(True)
+
+    @staticmethod
+    def make_word(generator):
+        return "".join(generator.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(generator.randint(4, 9)))
+
+    @staticmethod
+    def create_products(generator, vocabulary, weights, count, batch_size):
+        for start in range(0, count, batch_size):
+            Product.objects.bulk_create([
+                Product(name=" ".join(generator.choices(vocabulary, cum_weights=weights, k=3)),
+                        description=" ".join(generator.choices(vocabulary, cum_weights=weights, k=20)),
+                        price=Decimal(generator.randint(100, 100000)) / 100, stock_quantity=generator.randint(0, 100))
+                for _ in range(min(batch_size, count - start))
+            ])
+
+    @staticmethod
+    def search_index(query):
+        ranked = search_products(query, limit=20)
+        return list(Product.objects.in_bulk([product_id for product_id, _ in ranked]))
+
+    @staticmethod
+    def search_like(query):
+        words = query.split()
+        condition = Q()
+        for word in words:
+            condition |= Q(name__icontains=word) | Q(description__icontains=word)
+        return list(Product.objects.filter(condition).order_by("-id")[:20])
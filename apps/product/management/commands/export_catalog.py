@@ -0,0 +1,43 @@
+import sys
+
+from django.core.management.base import BaseCommand
+
+from apps.base.importexport import FORMATS, iter_export
+from apps.product.resources import RESOURCES
+
+
+class Command(BaseCommand):
+    """
+    Export all products, categories or stock levels as CSV or JSONL, in the columns read by `import_catalog`.
+
+    Rows are read in chunks with a server-side cursor where the database supports it and written as they are
+    read, so the memory used does not depend on the number of rows.
+
+    Example:
+        python manage.py export_catalog products products.csv
+        python manage.py export_catalog stock - --format jsonl > stock.jsonl
+    """
+
+    help = "Export products, categories or stock levels to a CSV or JSONL file."
+
+    def add_arguments(self, parser):
+        parser.add_argument("resource", choices=sorted(RESOURCES), help="What to export.")
+        parser.add_argument("path", help="Path of the file, - for the standard output.")
+        parser.add_argument("--format", choices=FORMATS, help="File format, guessed from the extension by default.")
+        parser.add_argument("--chunk-size", type=int, default=1000, help="Number of rows per chunk.")
+
+    def handle(self, *args, **options):
+        path = options["path"]
+        file_format = options["format"] or (path.rsplit(".", 1)[-1].lower() if path != "-" else "csv")
+        resource = RESOURCES[options["resource"]]()
+        queryset = resource.get_queryset().order_by("pk")
+
+        stream = sys.stdout.buffer if path == "-" else open(path, "wb")
+        try:
+            for chunk in iter_export(resource, queryset, file_format, options["chunk_size"]):
+                stream.write(chunk)
+        finally:
+            if stream is not sys.stdout.buffer:
+                stream.close()
+        if path != "-":
+            self.stdout.write(self.style.SUCCESS(f"Exported {options['resource']} to {path}"))
@@ -0,0 +1,53 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.base.importexport import FORMATS, import_stream
+from apps.base.middleware import acting_user
+from apps.product.resources import RESOURCES
+
+
+class Command(BaseCommand):
+    """
+    Import products, categories or stock levels from a CSV or JSONL file, in chunks of bulk writes.
+
+    The file is read one chunk at a time, so the memory used does not depend on its size. Invalid rows are
+    reported with their line number and skipped, the other rows are imported. Stock levels are the quantities
+    on hand, the units held by pending orders included.
+
+    Example:
+        python manage.py import_catalog products products.csv --user admin@gmail.com
+        python manage.py import_catalog stock stock.jsonl --chunk-size 5000 --dry-run
+    """
+
+    help = "Import products, categories or stock levels from a CSV or JSONL file."
+
+    def add_arguments(self, parser):
+        parser.add_argument("resource", choices=sorted(RESOURCES), help="What the file contains.")
+        parser.add_argument("path", help="Path of the file.")
+        parser.add_argument("--format", choices=FORMATS, help="File format, guessed from the extension by default.")
+        parser.add_argument("--chunk-size", type=int, default=1000, help="Number of rows per chunk.")
+        parser.add_argument("--dry-run", action="store_true", help="Validate the rows without saving them.")
+        parser.add_argument("--user", help="Username the created rows are attributed to.")
+
+    def handle(self, *args, **options):
+        file_format = options["format"] or options["path"].rsplit(".", 1)[-1].lower()
+        if file_format not in FORMATS:
+            raise CommandError(f"Unknown format {file_format!r}, use --format with one of {', '.join(FORMATS)}")
+
+        user = None
+        if options["user"]:
+            user = get_user_model().objects.filter(username=options["user"]).first()
+            if user is None:
+                raise CommandError(f"User {options['user']!r} not found")
+
+        log = lambda report: self.stdout.write(report.summary())  # noqa: E731
+        with open(options["path"], "rb") as stream, acting_user(user):
+            report = import_stream(RESOURCES[options["resource"]](), stream, file_format,
+                                   chunk_size=options["chunk_size"], dry_run=options["dry_run"], log=log)
+
+        for line, message in report.errors:
+            self.stderr.write(f"Line {line}: {message}")
+        if report.error_count > len(report.errors):
+            self.stderr.write(f"... {report.error_count - len(report.errors)} more errors")
+        style = self.style.WARNING if report.error_count else self.style.SUCCESS
+        self.stdout.write(style(f"Imported {report.imported} rows ({report.summary()})"))
@@ -0,0 +1,31 @@
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from apps.base.cache import catalog_cache
+from apps.product.models import ProductCategory
+
+
+class Command(BaseCommand):
+    """
+    Rebuild the materialized paths of all product categories from their parents, e.g. after categories were
+    imported with `bulk_create()` or moved with `QuerySet.update()`.
+
+    The categories are loaded with one query and the changed paths written with bulk updates, in a single
+    transaction.
+
+    Example:
+        python manage.py rebuild_category_paths
+    """
+
+    help = "Rebuild the materialized paths of the product category tree."
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                rebuilt = ProductCategory.rebuild_paths()
+        except ValidationError as exc:
+            raise CommandError(exc.messages[0])
+
+        catalog_cache.invalidate(ProductCategory)
+        self.stdout.write(self.style.SUCCESS(f"Category paths rebuilt for {rebuilt} categories"))
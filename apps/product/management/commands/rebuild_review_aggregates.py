@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from apps.base.cache import catalog_cache
+from apps.product.models import Product
+
+
+class Command(BaseCommand):
+    """
+    Rebuild the review aggregates (count, sum, average and histogram) of all products from their reviews.
+
+    Products are processed in batches of primary keys, each batch costs one grouped query over the reviews
+    and one bulk update, in its own transaction.
+
+    Example:
+        python manage.py rebuild_review_aggregates --batch-size 1000
+    """
+
+    help = "Rebuild the review aggregates of all products in batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000, help="Number of products per batch.")
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        last_id = 0
+        rebuilt = 0
+
+        while True:
+            product_ids = list(Product.objects.filter(pk__gt=last_id).order_by("pk").values_list(
+                "pk", flat=True)[:batch_size])
+            if not product_ids:
+                break
+
+            with transaction.atomic():
+                Product.rebuild_review_aggregates(product_ids)
+
+            rebuilt += len(product_ids)
+            last_id = product_ids[-1]
+            self.stdout.write(f"Rebuilt {rebuilt} products")
+
+        catalog_cache.invalidate(Product)
+        self.stdout.write(self.style.SUCCESS(f"Review aggregates rebuilt for {rebuilt} products"))
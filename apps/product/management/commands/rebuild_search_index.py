@@ -0,0 +1,55 @@
+from django.core.management.base import BaseCommand
+
+from apps.base.cache import catalog_cache
+from apps.product.models import Product, ProductSearchDocument, ProductSearchPosting, ProductSearchTerm
+from apps.product.search import index_products
+
+
+class Command(BaseCommand):
+    """
+    Rebuild the product search index, e.g. after products were imported with `bulk_create()` which does not
+    update it.
+
+    The index is emptied, then products are indexed in batches of primary keys, each batch in its own
+    transaction.
+
+    Example:
+        python manage.py rebuild_search_index --batch-size 1000
+    """
+
+    help = "Rebuild the product search index in batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000, help="Number of products per batch.")
+
+    def handle(self, *args, **options):
+        ProductSearchPosting.objects.all().delete()
+        ProductSearchDocument.objects.all().delete()
+        ProductSearchTerm.objects.all().delete()
+
+        indexed = rebuild_index(options["batch_size"], self.stdout.write)
+        catalog_cache.invalidate(Product)
+        self.stdout.write(self.style.SUCCESS(f"Search index rebuilt for {indexed} products"))
+
+
+def rebuild_index(batch_size, log=None):
+    """
+    Index all products in batches of primary keys.
+
+    Returns:
+        int: The number of products indexed.
+    """
+
+    last_id = 0
+    indexed = 0
+    while True:
+        product_ids = list(Product.objects.filter(pk__gt=last_id).order_by("pk").values_list(
+            "pk", flat=True)[:batch_size])
+        if not product_ids:
+            break
+
+        indexed += index_products(product_ids)
+        last_id = product_ids[-1]
+        if log:
+            log(f"Indexed {indexed} products")
+    return indexed
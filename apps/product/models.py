@@ -1,28 +1,184 @@
-from django.db import models
+from collections import Counter
+from django.core.exceptions import ValidationError
+from django.db import models, transaction
+from django.db.models import Case, Count, F, FloatField, Value, When
+from django.db.models.functions import Cast, Concat, Substr
 from apps.base.models import BaseModel
 from django.conf import settings
 
+RATINGS = range(1, 6)
+PATH_SEGMENT_WIDTH = 10  # digits per category id in the materialized paths
+
 
 class ProductCategory(BaseModel):
     """
     A model representing product categories.
 
+    Categories form a tree through `parent`, indexed by a materialized path: `path` is the list of the ids of
+    the ancestors and of the category itself, zero-padded and slash-terminated (e.g. `0000000001/0000000004/`).
+    A subtree is then a single `path LIKE 'prefix%'` query and ancestors a single `id IN (...)` query. The path
+    is maintained on save (see `update_path()`), moving a category re-roots its whole subtree with one `UPDATE`.
+    Categories written without `save()` (`bulk_create()`, `update()`) need `manage.py rebuild_category_paths`.
+
     Attributes:
         parent (Category, optional): The parent category to which this category belongs (can be blank or null).
         name (str): The name of the category.
         description (str, optional): A textual description of the category (can be blank).
+        path (str): The materialized path of the category.
+        depth (int): The number of ancestors of the category, 0 for root categories.
 
     Methods:
         __str__(): Returns a string representation of the category, which is its name.
+        get_descendants(include_self): Returns the categories of the subtree.
+        get_ancestors(): Returns the ancestors of the category, from the root.
+        get_products(): Returns the products of the subtree.
     """
 
     parent = models.ForeignKey("self", related_name='children', blank=True, null=True, on_delete=models.CASCADE)
     name = models.CharField(max_length=255)
     description = models.TextField(blank=True)
+    path = models.CharField(max_length=255, db_index=True, editable=False, default="")
+    depth = models.PositiveSmallIntegerField(editable=False, default=0)
 
     def __str__(self):
         return self.name
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the stored name, the search index entries of the products are refreshed on rename
+        loaded_values = dict(zip(field_names, values))
+        if loaded_values.get("name", models.DEFERRED) is not models.DEFERRED:
+            instance._loaded_name = loaded_values["name"]
+        return instance
+
+    @staticmethod
+    def path_segment(pk):
+        return f"{pk:0{PATH_SEGMENT_WIDTH}d}/"
+
+    @transaction.atomic
+    def save(self, *args, **kwargs):
+        if self.pk and self.parent_id:
+            # Paths read from the database, the instances may hold the ones they had before a move
+            paths = dict(ProductCategory.objects.nocache().filter(
+                pk__in=[self.pk, self.parent_id]).values_list("pk", "path"))
+            if self.pk in paths and paths.get(self.parent_id, "").startswith(paths[self.pk]):
+                raise ValidationError("A category cannot be moved under itself or one of its subcategories.")
+        # The path is set by the post save signal once the id is known, in the same transaction
+        super().save(*args, **kwargs)
+
+    def update_path(self):
+        """
+        Set the path and depth of the category from its parent, and re-root its subcategories with a single
+        `UPDATE` when it has moved.
+
+        Returns:
+            list: Ids of the categories whose path changed.
+        """
+
+        categories = ProductCategory.objects.nocache()
+        parent_path = ""
+        if self.parent_id:
+            parent_path = categories.filter(pk=self.parent_id).values_list("path", flat=True).get()
+        old_path = categories.filter(pk=self.pk).values_list("path", flat=True).get()
+        old_depth = old_path.count("/") - 1 if old_path else 0
+
+        self.path = parent_path + self.path_segment(self.pk)
+        self.depth = self.path.count("/") - 1
+        if self.path == old_path:
+            return []
+
+        categories.filter(pk=self.pk).update(path=self.path, depth=self.depth)
+        if not old_path:
+            return [self.pk]
+
+        subtree = categories.filter(path__startswith=old_path).exclude(pk=self.pk)
+        moved_ids = list(subtree.values_list("pk", flat=True))
+        subtree.update(
+            path=Concat(Value(self.path), Substr("path", len(old_path) + 1), output_field=models.CharField()),
+            depth=F("depth") + (self.depth - old_depth),
+        )
+        return [self.pk] + moved_ids
+
+    def get_descendants(self, include_self=False):
+        """
+        Return the categories of the subtree of the category, in depth-first order, with a single query.
+        """
+
+        categories = ProductCategory.objects.filter(path__startswith=self.path).order_by("path")
+        return categories if include_self else categories.exclude(pk=self.pk)
+
+    def get_ancestors(self):
+        """
+        Return the ancestors of the category from the root down to its parent, with a single query.
+        """
+
+        ancestor_ids = [int(segment) for segment in self.path.split("/")[:-2]]
+        return ProductCategory.objects.filter(pk__in=ancestor_ids).order_by("depth")
+
+    def get_products(self):
+        """
+        Return the products in the category or any of its subcategories, with a single query.
+        """
+
+        in_subtree = Product.categories.through.objects.filter(
+            productcategory__path__startswith=self.path).values("product_id")
+        return Product.objects.filter(pk__in=in_subtree)
+
+    @classmethod
+    def find_cycles(cls, category_ids):
+        """
+        Return the ids of the given categories that are their own ancestor, which `save()` refuses but writes
+        without it (`bulk_update()`, `update()`) do not.
+        """
+
+        parents = dict(cls.objects.nocache().values_list("pk", "parent_id"))
+        cycle_ids = []
+        for category_id in category_ids:
+            seen, ancestor_id = set(), parents.get(category_id)
+            while ancestor_id is not None and ancestor_id != category_id and ancestor_id not in seen:
+                seen.add(ancestor_id)
+                ancestor_id = parents.get(ancestor_id)
+            if ancestor_id == category_id:
+                cycle_ids.append(category_id)
+        return cycle_ids
+
+    @classmethod
+    def rebuild_paths(cls):
+        """
+        Recompute the path and depth of all categories from their parents, level by level.
+
+        Returns:
+            int: The number of categories updated.
+
+        Raises:
+            ValidationError: When categories are not under a root category, i.e. their parents form a cycle.
+                Nothing is updated.
+        """
+
+        categories = {category.pk: category
+                      for category in cls.objects.nocache().only("id", "parent_id", "path", "depth")}
+        children = {}
+        for category in categories.values():
+            children.setdefault(category.parent_id, []).append(category)
+
+        changed, level, parent_paths = [], children.get(None, []), {None: ""}
+        while level:
+            next_level = []
+            for category in level:
+                path = parent_paths[category.parent_id] + cls.path_segment(category.pk)
+                if (category.path, category.depth) != (path, path.count("/") - 1):
+                    category.path, category.depth = path, path.count("/") - 1
+                    changed.append(category)
+                parent_paths[category.pk] = path
+                next_level.extend(children.get(category.pk, []))
+            level = next_level
+
+        unreachable = sorted(categories.keys() - parent_paths.keys())
+        if unreachable:
+            raise ValidationError(f"The parents of categories {unreachable} form a cycle.")
+        return cls.objects.bulk_update(changed, ["path", "depth"], batch_size=1000)
+
 
 class Product(BaseModel):
     """
@@ -32,24 +188,149 @@ class Product(BaseModel):
         name (str): The name of the product.
         description (str): A detailed description of the product.
         price (Decimal): The price of the product.
-        stock_quantity (int): The available quantity of the product in the inventory.
+        stock_quantity (int): The available quantity of the product in the inventory, the quantities taken by
+            orders excluded.
+        reserved_quantity (int): The part of the taken quantities held by pending orders, given back to the stock
+            when their reservations expire (see `apps.order.utils.stock.hold_stock()`). The quantity on hand is
+            `stock_quantity + reserved_quantity`.
         categories (Category, many-to-many): The categories to which the product belongs.
         images (ImageField, optional): An image representing the product (can be blank or null).
+        review_count (int): The number of reviews of the product.
+        rating_sum (int): The sum of the ratings of all reviews of the product.
+        rating_average (Decimal): The average rating of the product, 0 without reviews.
+        rating_1_count ... rating_5_count (int): The number of reviews per rating, the rating histogram.
+
+    The review aggregates are maintained incrementally whenever a review is created, updated or deleted
+    (see `apps.product.signals`) and can be rebuilt with `python manage.py rebuild_review_aggregates`.
 
     Methods:
         __str__(): Returns a string representation of the product, which is its name.
+        rating_histogram: Returns the number of reviews per rating.
+        apply_review_changes(product_id, added, removed): Updates the review aggregates of a product.
     """
 
     name = models.CharField(max_length=255)
     description = models.TextField()
     price = models.DecimalField(max_digits=10, decimal_places=2)
     stock_quantity = models.PositiveIntegerField()
+    reserved_quantity = models.PositiveIntegerField(default=0, editable=False)
     categories = models.ManyToManyField(ProductCategory, related_name='products', blank=True)
     images = models.ImageField(upload_to='product/images/', blank=True, null=True)
+    review_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_sum = models.PositiveIntegerField(default=0, editable=False)
+    rating_average = models.DecimalField(max_digits=3, decimal_places=2, default=0, editable=False)
+    rating_1_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_2_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_3_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_4_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_5_count = models.PositiveIntegerField(default=0, editable=False)
+
+    class Meta:
+        # Product lists are always restricted to their owner, then filtered by `ProductFilterSet`
+        indexes = [
+            models.Index(fields=["created_by", "price"], name="product_owner_price_idx"),
+            models.Index(fields=["created_by", "stock_quantity"], name="product_owner_stock_idx"),
+            models.Index(fields=["created_by", "rating_average"], name="product_owner_rating_idx"),
+        ]
+
+    # Columns only written with set-based updates (see `apply_review_changes()` and `apps.order.utils.stock`),
+    # a save writing back the values the instance loaded would undo the concurrent changes
+    AGGREGATE_FIELDS = ("reserved_quantity", "review_count", "rating_sum", "rating_average",
+                        *(f"rating_{rating}_count" for rating in RATINGS))
+
+    # Columns of the search index, see `apps.product.search`
+    INDEXED_FIELDS = ("name", "description")
 
     def __str__(self):
         return self.name
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the stored indexed values, the search index entry is only refreshed when they change
+        loaded_values = dict(zip(field_names, values))
+        indexed = tuple(loaded_values.get(name, models.DEFERRED) for name in cls.INDEXED_FIELDS)
+        if models.DEFERRED not in indexed:
+            instance._loaded_indexed = indexed
+        return instance
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding and not args and kwargs.get("update_fields") is None:
+            deferred = self.get_deferred_fields()
+            kwargs["update_fields"] = [field.name for field in self._meta.concrete_fields
+                                       if not field.primary_key and field.name not in self.AGGREGATE_FIELDS
+                                       and field.attname not in deferred]
+        super().save(*args, **kwargs)
+
+    @property
+    def rating_histogram(self):
+        return {str(rating): getattr(self, f"rating_{rating}_count") for rating in RATINGS}
+
+    @classmethod
+    def apply_review_changes(cls, product_id, added=(), removed=()):
+        """
+        Update the review aggregates of a product with a single `UPDATE` statement.
+
+        The average is computed from the old column values plus the deltas, which is how SQLite and
+        PostgreSQL evaluate the right-hand side of every `SET` assignment.
+
+        Args:
+            product_id (int): The product whose reviews changed.
+            added (iterable): Ratings of the reviews added to the product.
+            removed (iterable): Ratings of the reviews removed from the product.
+
+        Returns:
+            int: The number of products updated.
+        """
+
+        added, removed = list(added), list(removed)
+        count = len(added) - len(removed)
+        total = sum(added) - sum(removed)
+        histogram = Counter(added)
+        histogram.subtract(removed)
+
+        updates = {
+            "review_count": F("review_count") + count,
+            "rating_sum": F("rating_sum") + total,
+            "rating_average": Case(
+                When(review_count__lte=-count, then=Value(0.0)),
+                default=Cast(F("rating_sum") + total, FloatField()) / (F("review_count") + count),
+                output_field=FloatField(),
+            ),
+        }
+        for rating, delta in histogram.items():
+            if delta:
+                updates[f"rating_{rating}_count"] = F(f"rating_{rating}_count") + delta
+        return cls.objects.filter(pk=product_id).update(**updates)
+
+    @classmethod
+    def rebuild_review_aggregates(cls, product_ids):
+        """
+        Recompute the review aggregates of the given products from their reviews, with one grouped query
+        and one bulk update.
+
+        Args:
+            product_ids (iterable): The products to rebuild.
+
+        Returns:
+            int: The number of products updated.
+        """
+
+        products = {pk: cls(pk=pk) for pk in product_ids}
+        rows = ProductReview.objects.filter(product_id__in=products.keys()).values(
+            "product_id", "rating").annotate(total=Count("id")).order_by()
+        for row in rows:
+            setattr(products[row["product_id"]], f"rating_{row['rating']}_count", row["total"])
+
+        for product in products.values():
+            histogram = product.rating_histogram
+            product.review_count = sum(histogram.values())
+            product.rating_sum = sum(int(rating) * total for rating, total in histogram.items())
+            product.rating_average = round(product.rating_sum / product.review_count, 2) if product.review_count else 0
+
+        fields = ["review_count", "rating_sum", "rating_average"] + [f"rating_{rating}_count" for rating in RATINGS]
+        return cls.objects.bulk_update(products.values(), fields)
+
 
 RATING_CHOICES = [
     (1, '1 Star'),
@@ -88,6 +369,76 @@ class ProductReview(BaseModel):
     class Meta:
         verbose_name = "Product Review"
         verbose_name_plural = "Product Reviews"
+        indexes = [
+            # Review lists of a product, newest first, and the rating counts of the review aggregates
+            models.Index(fields=["product", "-id"], name="review_product_id_idx"),
+            models.Index(fields=["product", "rating"], name="review_product_rating_idx"),
+        ]
 
     def __str__(self):
         return f"Review by {self.user.username} for {self.product.name}"
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the stored product and rating, the review aggregates are updated from the difference
+        loaded_values = dict(zip(field_names, values))
+        if models.DEFERRED not in (loaded_values.get("product_id"), loaded_values.get("rating")):
+            instance._loaded_values = {"product_id": loaded_values["product_id"], "rating": loaded_values["rating"]}
+        return instance
+
+
+class ProductSearchTerm(models.Model):
+    """
+    A term of the product search index with the number of products containing it, the dictionary of the
+    inverted index. Terms are listed in order for the prefix matching of autocomplete queries.
+
+    Attributes:
+        term (str): The normalized token.
+        document_count (int): The number of products containing the term, the document frequency of BM25.
+    """
+
+    term = models.CharField(max_length=64, unique=True)
+    document_count = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return self.term
+
+
+class ProductSearchDocument(models.Model):
+    """
+    A product of the search index with its length in tokens, for the length normalization of BM25.
+
+    Attributes:
+        product (Product): The indexed product.
+        length (int): The number of tokens of its name, description and category names.
+    """
+
+    product = models.OneToOneField(Product, primary_key=True, on_delete=models.CASCADE,
+                                   related_name="search_document")
+    length = models.PositiveIntegerField(default=0)
+
+
+class ProductSearchPosting(models.Model):
+    """
+    An entry of the posting list of a term: a product containing it and how many times.
+
+    The term is stored as text and the document length is copied from `ProductSearchDocument`, so a query is
+    scored from the postings of its terms alone, read through the `(term, product)` index.
+
+    Attributes:
+        term (str): The term.
+        product (Product): The product containing the term.
+        frequency (int): The number of occurrences of the term in the product, name tokens counting double.
+        document_length (int): The length of the product in tokens.
+    """
+
+    term = models.CharField(max_length=64)
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name="search_postings")
+    frequency = models.PositiveIntegerField()
+    document_length = models.PositiveIntegerField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["term", "product"], name="product_search_posting_term_product"),
+        ]
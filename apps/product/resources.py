@@ -0,0 +1,105 @@
+from django.core.exceptions import ValidationError
+from import_export import fields
+
+from apps.base.cache import catalog_cache
+from apps.base.importexport import ChunkedModelResource, IntegerWidget, LockingChunkInstanceLoader
+from apps.product.models import Product, ProductCategory
+from apps.product.search import index_products
+
+
+class OnHandStockMixin:
+    """
+    Stock column carrying the quantity on hand, `stock_quantity + reserved_quantity` of the product.
+
+    The rows of a chunk are locked while it is imported, so the orders taking stock meanwhile wait for the chunk
+    instead of being overwritten by it. The imported quantity is stored minus the quantity held by the pending
+    orders, which goes back to the stock when their reservations expire.
+    """
+
+    def dehydrate_stock_quantity(self, product):
+        return product.stock_quantity + product.reserved_quantity
+
+    def import_obj(self, obj, data, dry_run, **kwargs):
+        super().import_obj(obj, data, dry_run, **kwargs)
+        held = obj.reserved_quantity
+        if isinstance(obj.stock_quantity, int) and held:
+            if obj.stock_quantity < held:
+                raise ValidationError({"stock_quantity": f"Lower than the {held} units held by pending orders."})
+            obj.stock_quantity -= held
+
+
+class ProductResource(OnHandStockMixin, ChunkedModelResource):
+    """
+    Products by id, rows without an id or with an unknown one are created. The categories are not part of the
+    rows, bulk writes do not save many-to-many relations. The stock is the quantity on hand, see
+    `OnHandStockMixin`.
+    """
+
+    class Meta:
+        model = Product
+        fields = ("id", "name", "description", "price", "stock_quantity")
+        instance_loader_class = LockingChunkInstanceLoader
+
+    def after_chunk(self, instances):
+        product_ids = [product.pk for product in instances]
+        index_products(product_ids)
+        catalog_cache.invalidate_rows(Product, product_ids)
+
+
+class ProductCategoryResource(ChunkedModelResource):
+    """
+    Categories by id, with the id of their parent. Parents must come before their subcategories, in the same
+    chunk or an earlier one. A chunk making a category its own ancestor is rolled back, the products of the
+    renamed categories are reindexed, and the category paths are rebuilt once at the end of the import.
+    """
+
+    parent = fields.Field(attribute="parent_id", column_name="parent", widget=IntegerWidget())
+
+    class Meta:
+        model = ProductCategory
+        fields = ("id", "name", "description", "parent")
+
+    def after_chunk(self, instances):
+        # The bulk writes skip the checks of ProductCategory.save() and the signals
+        cycle_ids = ProductCategory.find_cycles([category.pk for category in instances])
+        if cycle_ids:
+            raise ValidationError(f"Categories {cycle_ids} would be their own ancestor.")
+
+        renamed_ids = [category.pk for category in instances
+                       if getattr(category, "_loaded_name", category.name) != category.name]
+        if renamed_ids:
+            index_products(Product.categories.through.objects.filter(
+                productcategory_id__in=renamed_ids).values_list("product_id", flat=True).distinct())
+
+    def after_import_stream(self, report):
+        if report.imported:
+            ProductCategory.rebuild_paths()
+            catalog_cache.invalidate(ProductCategory)
+
+
+class ProductStockResource(OnHandStockMixin, ChunkedModelResource):
+    """
+    Stock levels of existing products as quantities on hand, see `OnHandStockMixin`. Rows of unknown products
+    are invalid.
+    """
+
+    class Meta:
+        model = Product
+        fields = ("id", "stock_quantity")
+        instance_loader_class = LockingChunkInstanceLoader
+
+    def get_or_init_instance(self, instance_loader, row):
+        instance = self.get_instance(instance_loader, row)
+        if instance is None:
+            raise ValidationError({"id": "Unknown product."})
+        return instance, False
+
+    def after_chunk(self, instances):
+        catalog_cache.invalidate_rows(Product, [product.pk for product in instances])
+
+
+RESOURCES = {
+    "products": ProductResource,
+    "categories": ProductCategoryResource,
+    "stock": ProductStockResource,
+}
@@ -0,0 +1,215 @@
+import math
+import re
+from collections import Counter
+
+from django.core.cache import cache
+from django.db import connections, router, transaction
+from django.db.models import Avg, Case, Count, F, FloatField, Prefetch, Sum, Value, When
+from django.db.models.functions import Cast
+
+from apps.product.models import (Product, ProductCategory, ProductSearchDocument, ProductSearchPosting,
+                                 ProductSearchTerm)
+
+TOKEN_PATTERN = re.compile(r"\w+")
+MAX_TERM_LENGTH = 64
+MIN_PREFIX_LENGTH = 2
+MAX_PREFIX_EXPANSIONS = 20
+MAX_RESULTS = 1000
+NAME_WEIGHT = 2  # name tokens count as many occurrences
+STOP_WORDS = frozenset("a an and are as at be by for from in is it of on or the to with".split())
+
+# BM25 parameters, the usual defaults
+K1 = 1.2
+B = 0.75
+
+STATS_CACHE_KEY = "product-search:stats"
+STATS_CACHE_TIMEOUT = 60 * 5
+
+
+def tokenize(text):
+    """
+    Split a text into lowercase word tokens, without the stop words.
+    """
+
+    return [token[:MAX_TERM_LENGTH] for token in TOKEN_PATTERN.findall(text.lower()) if token not in STOP_WORDS]
+
+
+def get_term_frequencies(product):
+    """
+    Return the occurrences of every term of a product, its categories must be prefetched.
+    """
+
+    frequencies = Counter()
+    for token in tokenize(product.name):
+        frequencies[token] += NAME_WEIGHT
+    frequencies.update(tokenize(product.description))
+    for category in product.categories.all():
+        frequencies.update(tokenize(category.name))
+    return frequencies
+
+
+def update_document_counts(deltas):
+    """
+    Apply document frequency changes to the term dictionary, with one `UPDATE` per distinct change.
+    """
+
+    deltas = {term: delta for term, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    ProductSearchTerm.objects.bulk_create([ProductSearchTerm(term=term) for term in deltas], ignore_conflicts=True)
+
+    terms_by_delta = {}
+    for term, delta in deltas.items():
+        terms_by_delta.setdefault(delta, []).append(term)
+    for delta, terms in terms_by_delta.items():
+        ProductSearchTerm.objects.filter(term__in=terms).update(document_count=F("document_count") + delta)
+
+
+@transaction.atomic
+def index_products(product_ids):
+    """
+    Add or refresh the products in the search index.
+
+    The postings of the products are replaced, and the document frequencies of the terms they gained or lost
+    are updated, so the cost depends on the indexed products only and not on the size of the index.
+
+    Args:
+        product_ids (iterable): The products to index, missing ones are removed from the index.
+
+    Returns:
+        int: The number of products indexed.
+    """
+
+    product_ids = list(product_ids)
+    products = Product.objects.filter(pk__in=product_ids).only("id", "name", "description").prefetch_related(
+        Prefetch("categories", queryset=ProductCategory.objects.only("id", "name")))
+
+    postings, documents, deltas = [], [], Counter()
+    for product in products:
+        frequencies = get_term_frequencies(product)
+        length = sum(frequencies.values())
+        documents.append(ProductSearchDocument(product_id=product.pk, length=length))
+        postings.extend((term, product.pk, frequency, length) for term, frequency in frequencies.items())
+        deltas.update(frequencies.keys())
+
+    deltas.subtract(remove_postings(product_ids))
+    ProductSearchDocument.objects.filter(product_id__in=product_ids).delete()
+    ProductSearchDocument.objects.bulk_create(documents, batch_size=1000)
+    insert_postings(postings)
+    update_document_counts(deltas)
+    return len(documents)
+
+
+def insert_postings(rows):
+    """
+    Insert postings given as `(term, product id, frequency, document length)` tuples.
+
+    A product has tens of postings, building model instances for `bulk_create()` takes most of the indexing
+    time, so the rows are handed to `executemany()` as they are.
+    """
+
+    if not rows:
+        return
+    meta = ProductSearchPosting._meta
+    connection = connections[router.db_for_write(ProductSearchPosting)]
+    columns = ", ".join(connection.ops.quote_name(meta.get_field(name).column)
+                        for name in ("term", "product", "frequency", "document_length"))
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            f"INSERT INTO {connection.ops.quote_name(meta.db_table)} ({columns}) VALUES (%s, %s, %s, %s)", rows)
+
+
+@transaction.atomic
+def unindex_products(product_ids):
+    """
+    Remove the products from the search index.
+    """
+
+    product_ids = list(product_ids)
+    deltas = Counter()
+    deltas.subtract(remove_postings(product_ids))
+    ProductSearchDocument.objects.filter(product_id__in=product_ids).delete()
+    update_document_counts(deltas)
+
+
+def remove_postings(product_ids):
+    """
+    Delete the postings of the products and return the number of them containing each term.
+    """
+
+    postings = ProductSearchPosting.objects.filter(product_id__in=product_ids)
+    terms = Counter(postings.values_list("term", flat=True))
+    postings.delete()
+    return terms
+
+
+def get_index_stats():
+    """
+    Return the number of indexed products and their average length.
+
+    The values are cached for a few minutes, BM25 scores barely move with them and computing them scans the
+    whole document table.
+    """
+
+    stats = cache.get(STATS_CACHE_KEY)
+    if stats is None:
+        stats = ProductSearchDocument.objects.aggregate(documents=Count("pk"), average_length=Avg("length"))
+        stats = {"documents": stats["documents"], "average_length": float(stats["average_length"] or 0)}
+        cache.set(STATS_CACHE_KEY, stats, STATS_CACHE_TIMEOUT)
+    return stats
+
+
+def expand_query(query):
+    """
+    Return the document frequency of the terms matched by a query.
+
+    Every token matches the identical term, and the last one also up to `MAX_PREFIX_EXPANSIONS` of the most
+    frequent terms it prefixes so that partially typed words match. Prefixes are looked up with a range on
+    the term index instead of a `LIKE`, which not all databases answer from an index.
+    """
+
+    tokens = tokenize(query)
+    if not tokens:
+        return {}
+
+    terms = ProductSearchTerm.objects.filter(document_count__gt=0)
+    matched = dict(terms.filter(term__in=set(tokens)).values_list("term", "document_count"))
+    prefix = tokens[-1]
+    if len(prefix) >= MIN_PREFIX_LENGTH:
+        expansions = terms.filter(term__gte=prefix, term__lt=prefix + "\U0010ffff").order_by(
+            "-document_count").values_list("term", "document_count")[:MAX_PREFIX_EXPANSIONS]
+        matched.update(expansions)
+    return matched
+
+
+def search_products(query, queryset=None, limit=MAX_RESULTS):
+    """
+    Rank the products matching a query with BM25, in a single grouped query over the postings of its terms.
+
+    Args:
+        query (str): The search text, its last word is matched as a prefix.
+        queryset (QuerySet, optional): Products to search in, e.g. the products of a user.
+        limit (int): Maximum number of results.
+
+    Returns:
+        list: The `(product id, score)` of the best matches, best first.
+    """
+
+    document_counts = expand_query(query)
+    if not document_counts:
+        return []
+
+    stats = get_index_stats()
+    documents = max(stats["documents"], 1)
+    average_length = stats["average_length"] or 1.0
+    idf = Case(*[When(term=term, then=Value(math.log(1 + (documents - count + 0.5) / (count + 0.5))))
+                 for term, count in document_counts.items()], output_field=FloatField())
+    frequency = Cast(F("frequency"), FloatField())
+    normalization = Value(K1 * (1 - B)) + Value(K1 * B / average_length) * F("document_length")
+    score = Sum(idf * frequency * Value(K1 + 1) / (frequency + normalization), output_field=FloatField())
+
+    postings = ProductSearchPosting.objects.filter(term__in=document_counts.keys())
+    if queryset is not None:
+        postings = postings.filter(product__in=queryset.values("pk"))
+    rows = postings.values("product_id").annotate(score=score).order_by("-score", "-product_id")[:limit]
+    return [(row["product_id"], row["score"]) for row in rows]
@@ -1,21 +1,57 @@
 from rest_framework import serializers
-from .models import Product, ProductReview
-from ..user.serializers import UserSerializer
+from .models import Product, ProductCategory, ProductReview
+from apps.base.serializers import CompiledSerializerMixin, InstrumentedSerializerMixin
+from ..user.serializers import UserReadSerializer
 
 
-class ProductSerializer(serializers.ModelSerializer):
-    created_by = UserSerializer(read_only=True)
+class ProductSerializer(InstrumentedSerializerMixin, CompiledSerializerMixin, serializers.ModelSerializer):
+    created_by = UserReadSerializer(read_only=True)
+    rating_histogram = serializers.DictField(child=serializers.IntegerField(), read_only=True)
 
     class Meta:
         model = Product
-        fields = ["id", "name", "price", "stock_quantity", "created_by"]
+        fields = ["id", "name", "price", "stock_quantity", "created_by", "review_count", "rating_average",
+                  "rating_histogram"]
 
 
-class ProductReviewSerializer(serializers.ModelSerializer):
+class ProductCompactSerializer(CompiledSerializerMixin, serializers.ModelSerializer):
+    """
+    Product id, name and price only, for listings embedding many products such as the order history.
+    """
+
+    class Meta:
+        model = Product
+        fields = ["id", "name", "price"]
+        read_only_fields = fields
+
+
+class ProductReviewSerializer(InstrumentedSerializerMixin, CompiledSerializerMixin, serializers.ModelSerializer):
     product = ProductSerializer(read_only=True)
-    user = UserSerializer(read_only=True)
+    user = UserReadSerializer(read_only=True)
 
     class Meta:
         model = ProductReview
         fields = ['id', 'user', 'product', 'text', 'rating']
         extra_kwargs = {"product": {"read_only": True}, "user": {"read_only": True}}
+
+
+class ProductCategorySerializer(CompiledSerializerMixin, serializers.ModelSerializer):
+    class Meta:
+        model = ProductCategory
+        fields = ["id", "name", "description", "parent", "depth"]
+        read_only_fields = fields
+
+
+class ProductCategoryDetailSerializer(ProductCategorySerializer):
+    """
+    Category with its breadcrumbs, the ancestors from the root category down to its parent.
+    """
+
+    breadcrumbs = serializers.SerializerMethodField()
+
+    class Meta(ProductCategorySerializer.Meta):
+        fields = ProductCategorySerializer.Meta.fields + ["breadcrumbs"]
+        read_only_fields = fields
+
+    def get_breadcrumbs(self, category):
+        return [{"id": ancestor.id, "name": ancestor.name} for ancestor in category.get_ancestors()]
@@ -0,0 +1,143 @@
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from apps.base.cache import catalog_cache
+from apps.product.models import Product, ProductCategory, ProductReview
+from apps.product.search import index_products, unindex_products
+
+# The user fields shown in the reviews by their `UserReadSerializer`, `name` being the first and last names
+REVIEW_USER_FIELDS = ("username", "first_name", "last_name", "profile_photo")
+
+
+@receiver(post_save, sender=ProductReview, dispatch_uid="product-review-aggregates-save")
+def update_review_aggregates_on_save(sender, instance, created, **kwargs):
+    """
+    Apply a created or modified review to the review aggregates of its product.
+    """
+
+    loaded = getattr(instance, "_loaded_values", None)
+    if not created and loaded is None:
+        # The stored values are unknown (e.g. deferred fields), recompute the product from its reviews
+        Product.rebuild_review_aggregates([instance.product_id])
+        catalog_cache.invalidate_rows(Product, [instance.product_id])
+        changes = []
+    elif created:
+        changes = [(instance.product_id, [instance.rating], [])]
+    elif loaded["product_id"] != instance.product_id:
+        changes = [(loaded["product_id"], [], [loaded["rating"]]), (instance.product_id, [instance.rating], [])]
+    elif loaded["rating"] != instance.rating:
+        changes = [(instance.product_id, [instance.rating], [loaded["rating"]])]
+    else:
+        changes = []
+
+    for product_id, added, removed in changes:
+        Product.apply_review_changes(product_id, added=added, removed=removed)
+    if changes:
+        catalog_cache.invalidate_rows(Product, [product_id for product_id, _, _ in changes])
+
+    instance._loaded_values = {"product_id": instance.product_id, "rating": instance.rating}
+
+
+@receiver(post_delete, sender=ProductReview, dispatch_uid="product-review-aggregates-delete")
+def update_review_aggregates_on_delete(sender, instance, **kwargs):
+    """
+    Remove a deleted review from the review aggregates of its product.
+    """
+
+    loaded = getattr(instance, "_loaded_values", None) or {}
+    product_id = loaded.get("product_id", instance.product_id)
+    Product.apply_review_changes(product_id, removed=[loaded.get("rating", instance.rating)])
+    catalog_cache.invalidate_rows(Product, [product_id])
+
+
+@receiver(post_save, sender=get_user_model(), dispatch_uid="product-review-cache-user-save")
+def invalidate_user_reviews_on_save(sender, instance, created, update_fields=None, **kwargs):
+    """
+    Invalidate the cached reviews showing a changed user, the reviews the user wrote and the reviews of the
+    products the user owns. Saves of other fields, such as the last login, invalidate nothing.
+    """
+
+    if created or (update_fields is not None and not set(update_fields) & set(REVIEW_USER_FIELDS)):
+        return
+    product_ids = set(ProductReview.objects.nocache().filter(user=instance).values_list("product_id", flat=True))
+    product_ids.update(Product.objects.nocache().filter(created_by=instance).values_list("pk", flat=True))
+    catalog_cache.invalidate_scopes(ProductReview, "product_id", product_ids)
+
+
+@receiver(post_save, sender=ProductCategory, dispatch_uid="product-category-path-save")
+def update_category_path_on_save(sender, instance, raw=False, **kwargs):
+    """
+    Maintain the materialized path of a saved category and of its subcategories when it has moved.
+    """
+
+    if raw:
+        return
+    moved_ids = instance.update_path()
+    if moved_ids:
+        catalog_cache.invalidate_rows(ProductCategory, moved_ids)
+
+
+def index_products_on_commit(product_ids):
+    """
+    Refresh the search index entries of products once the transaction commits, off the writes holding the row
+    locks. A rolled back change indexes nothing.
+    """
+
+    product_ids = list(product_ids)
+    if product_ids:
+        transaction.on_commit(lambda: index_products(product_ids))
+
+
+@receiver(post_save, sender=Product, dispatch_uid="product-search-index-save")
+def index_product_on_save(sender, instance, created, raw=False, update_fields=None, **kwargs):
+    """
+    Refresh the search index entry of a created product, or of a saved one whose indexed fields changed.
+    """
+
+    if raw or (update_fields is not None and not set(update_fields) & set(Product.INDEXED_FIELDS)):
+        return
+    indexed = tuple(getattr(instance, name) for name in Product.INDEXED_FIELDS)
+    if created or getattr(instance, "_loaded_indexed", None) != indexed:
+        index_products_on_commit([instance.pk])
+    instance._loaded_indexed = indexed
+
+
+@receiver(pre_delete, sender=Product, dispatch_uid="product-search-index-delete")
+def unindex_product_on_delete(sender, instance, **kwargs):
+    """
+    Remove a product from the search index while its postings still exist, to update the term frequencies.
+    """
+
+    unindex_products([instance.pk])
+
+
+@receiver(m2m_changed, sender=Product.categories.through, dispatch_uid="product-search-index-categories")
+def index_product_on_categories_change(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Refresh the search index entries of the products whose categories changed, category names are indexed.
+    """
+
+    if not reverse:
+        if action.startswith("post_"):
+            index_products_on_commit([instance.pk])
+    elif action == "pre_clear":
+        # The products of a cleared category are not reported by post_clear
+        instance._cleared_product_ids = list(instance.products.values_list("pk", flat=True))
+    elif action == "post_clear":
+        index_products_on_commit(instance.__dict__.pop("_cleared_product_ids", []))
+    elif action.startswith("post_") and pk_set:
+        index_products_on_commit(pk_set)
+
+
+@receiver(post_save, sender=ProductCategory, dispatch_uid="product-search-index-category-save")
+def index_category_products_on_save(sender, instance, created, raw=False, **kwargs):
+    """
+    Refresh the search index entries of the products of a renamed category.
+    """
+
+    loaded_name = getattr(instance, "_loaded_name", None)
+    if not raw and not created and loaded_name != instance.name:
+        index_products_on_commit(instance.products.values_list("pk", flat=True))
+    instance._loaded_name = instance.name
@@ -1,2 +1,6 @@
 from .product import *
 from .review import *
+from .category import *
+from .search import *
+from .filters import *
+from .importexport import *
@@ -0,0 +1,103 @@
+from apps.base.tests import APITestCase
+from apps.product.models import Product, ProductCategory
+from django.core.exceptions import ValidationError
+from django.core.management import call_command
+from io import StringIO
+from rest_framework import status
+
+
+class CategoryTreeTests(APITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.root = ProductCategory.objects.create(name="Electronics")
+        self.computers = ProductCategory.objects.create(name="Computers", parent=self.root)
+        self.laptops = ProductCategory.objects.create(name="Laptops", parent=self.computers)
+        self.phones = ProductCategory.objects.create(name="Phones", parent=self.root)
+        self.books = ProductCategory.objects.create(name="Books")
+
+    def refresh(self):
+        for category in (self.root, self.computers, self.laptops, self.phones, self.books):
+            category.refresh_from_db()
+
+    def test_paths(self):
+        self.refresh()
+        self.assertEqual(self.laptops.path, f"{self.root.pk:010d}/{self.computers.pk:010d}/{self.laptops.pk:010d}/")
+        self.assertEqual([self.root.depth, self.computers.depth, self.laptops.depth], [0, 1, 2])
+
+    def test_subtree_ancestors_and_products_queries(self):
+        self.refresh()
+        with self.assertNumQueries(1):
+            self.assertEqual(list(self.root.get_descendants()), [self.computers, self.laptops, self.phones])
+        with self.assertNumQueries(1):
+            self.assertEqual(list(self.laptops.get_ancestors()), [self.root, self.computers])
+
+        laptop = Product.objects.create(name="Laptop", price=900, stock_quantity=1, created_by=self.user)
+        laptop.categories.add(self.laptops)
+        self.product.categories.add(self.laptops, self.phones)
+        Product.objects.create(name="Novel", price=9, stock_quantity=1, created_by=self.user).categories.add(
+            self.books)
+        with self.assertNumQueries(1):
+            self.assertEqual(sorted(self.root.get_products().values_list("pk", flat=True)),
+                             sorted([self.product.pk, laptop.pk]))
+
+    def test_move_reroots_subtree(self):
+        self.computers.parent = self.books
+        self.computers.save()
+        self.refresh()
+
+        self.assertTrue(self.laptops.path.startswith(self.books.path))
+        self.assertEqual(self.laptops.depth, 2)
+        self.assertEqual(list(self.root.get_descendants()), [self.phones])
+        self.assertEqual(list(self.laptops.get_ancestors()), [self.books, self.computers])
+
+        self.computers.parent = None
+        self.computers.save()
+        self.laptops.refresh_from_db()
+        self.assertEqual(self.laptops.depth, 1)
+
+    def test_move_under_own_subtree_is_rejected(self):
+        self.root.parent = self.laptops
+        with self.assertRaises(ValidationError):
+            self.root.save()
+
+    def test_rebuild_category_paths_command(self):
+        ProductCategory.objects.update(path="", depth=0)
+        out = StringIO()
+        call_command("rebuild_category_paths", stdout=out)
+        self.refresh()
+        self.assertIn("5 categories", out.getvalue())
+        self.assertEqual(list(self.laptops.get_ancestors()), [self.root, self.computers])
+
+    def test_tree_endpoint(self):
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.token}')
+        response = self.client.get('/api/categories/tree/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response["X-Cache"], "MISS")
+        self.assertEqual([node["name"] for node in response.json()], ["Electronics", "Books"])
+        electronics = response.json()[0]
+        self.assertEqual([node["name"] for node in electronics["children"]], ["Computers", "Phones"])
+        self.assertEqual(electronics["children"][0]["children"][0]["name"], "Laptops")
+
+        with self.assertNumQueries(1):  # the authenticated user
+            self.assertEqual(self.client.get('/api/categories/tree/')["X-Cache"], "HIT")
+
+        ProductCategory.objects.create(name="Tablets", parent=self.computers)
+        response = self.client.get('/api/categories/tree/')
+        self.assertEqual(response["X-Cache"], "MISS")
+        self.assertEqual(len(response.json()[0]["children"][0]["children"]), 2)
+
+    def test_retrieve_breadcrumbs(self):
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.token}')
+        response = self.client.get(f'/api/categories/{self.laptops.pk}/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([crumb["name"] for crumb in response.json()["breadcrumbs"]], ["Electronics", "Computers"])
+
+    def test_products_endpoint(self):
+        self.product.categories.add(self.laptops)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.token}')
+        response = self.client.get(f'/api/categories/{self.root.pk}/products/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([product["id"] for product in response.json()["results"]], [self.product.pk])
+        response = self.client.get(f'/api/categories/{self.books.pk}/products/')
+        self.assertEqual(response.json()["results"], [])
@@ -0,0 +1,76 @@
+from apps.base.tests import APITestCase, QueryScalingMixin
+from apps.product.models import Product, ProductCategory
+from asgiref.sync import async_to_sync
+from django.test import AsyncClient
+from rest_framework import status
+
+
+class ProductFilterTests(QueryScalingMixin, APITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.token}')
+        self.electronics = ProductCategory.objects.create(name="Electronics")
+        self.audio = ProductCategory.objects.create(name="Audio", parent=self.electronics)
+        self.books = ProductCategory.objects.create(name="Books")
+
+        self.product.categories.add(self.books)
+        self.cheap = self.create_product("Cable", 5, 0, 3.5, self.electronics)
+        self.headphones = self.create_product("Headphones", 80, 4, 4.5, self.audio)
+        self.speaker = self.create_product("Speaker", 300, 2, 2.0, self.audio)
+
+    def create_product(self, name, price, stock, rating, category):
+        product = Product.objects.create(name=name, description="", price=price, stock_quantity=stock,
+                                         created_by=self.user)
+        Product.objects.filter(pk=product.pk).update(rating_average=rating)
+        product.categories.add(category)
+        return product
+
+    def get_ids(self, query):
+        response = self.client.get(f'/api/products/?{query}')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return sorted(product["id"] for product in response.json()["results"])
+
+    def test_filters(self):
+        self.assertEqual(self.get_ids("min_price=50&max_price=100"), [self.headphones.pk])
+        self.assertEqual(self.get_ids("in_stock=false"), [self.cheap.pk])
+        self.assertEqual(self.get_ids(f"category={self.electronics.pk}"),
+                         [self.cheap.pk, self.headphones.pk, self.speaker.pk])
+        self.assertEqual(self.get_ids(f"category={self.audio.pk}&min_rating=4"), [self.headphones.pk])
+        self.assertEqual(self.get_ids("category=0"), [])
+        self.assertEqual(self.client.get('/api/products/?min_price=abc').status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_facets(self):
+        # User, count, page, then one query per facet and the parent and names of the category facet
+        with self.assertNumQueries(9):
+            response = self.client.get(f'/api/products/?facets=true&category={self.electronics.pk}&in_stock=true')
+        facets = response.json()["facets"]
+        self.assertEqual(response.json()["count"], 2)
+
+        price = {bucket["min"]: bucket["count"] for bucket in facets["price"]}
+        self.assertEqual((price[50], price[250], price[0]), (1, 1, 0))
+        # Each facet ignores its own filter: the out of stock cable is counted in the stock facet
+        self.assertEqual(facets["stock"], {"in_stock": 2, "out_of_stock": 1})
+        self.assertEqual(facets["category"], [{"id": self.audio.pk, "name": "Audio", "count": 2}])
+        self.assertEqual(facets["rating"][0], {"min_rating": 4, "count": 1})
+        self.assertEqual(facets["rating"][2], {"min_rating": 2, "count": 2})
+
+        roots = self.client.get('/api/products/?facets=true').json()["facets"]["category"]
+        self.assertEqual(roots, [{"id": self.electronics.pk, "name": "Electronics", "count": 3},
+                                 {"id": self.books.pk, "name": "Books", "count": 1}])
+        self.assertNotIn("facets", self.client.get('/api/products/').json())
+
+    def test_async_view_filters_and_facets(self):
+        path = f'/api/products/?facets=true&min_price=10&category={self.electronics.pk}'
+        with self.settings(ROOT_URLCONF='ecommerce_project.urls'):
+            expected = self.client.get(path).json()
+        with self.settings(ROOT_URLCONF='ecommerce_project.asgi_urls'):
+            response = async_to_sync(AsyncClient().get)(path, headers={'Authorization': f'Bearer {self.token}'})
+        self.assertEqual(response.json(), expected)
+
+    def seed_products(self, count):
+        for index in range(count):
+            self.create_product(f'Product {index}', 10 * index, index % 2, 4, self.audio)
+
+    def test_faceted_list_queries(self):
+        self.assertQueriesDoNotScale('/api/products/?facets=true&in_stock=true&min_price=5', self.seed_products)
@@ -0,0 +1,228 @@
+from apps.base.importexport import import_stream, iter_export
+from apps.base.models import UserHistoryAuditQuerySet
+from apps.base.tests import APITestCase
+from apps.order.models import Order
+from apps.product.models import Product, ProductCategory
+from apps.product.resources import ProductCategoryResource, ProductResource, ProductStockResource
+from apps.product.search import search_products
+from django.contrib.auth import get_user_model
+from django.core.exceptions import ValidationError
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import IntegrityError, connection
+from django.test import Client, TransactionTestCase
+from io import BytesIO, StringIO
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+import json
+import os
+import tempfile
+import threading
+import time
+from unittest import mock
+
+
+class CatalogImportTests(APITestCase):
+
+    def import_csv(self, resource, text, **kwargs):
+        return import_stream(resource, BytesIO(text.encode()), "csv", **kwargs)
+
+    def test_import_creates_and_updates_products_in_chunks(self):
+        text = ("id,name,description,price,stock_quantity\n"
+                f"{self.product.pk},Renamed,Updated,10.50,7\n"
+                ",Lamp,Desk lamp,15,3\n"
+                ",Chair,,abc,1\n"
+                ",Table,Oak table,120,many\n"
+                ",Shelf,Wall shelf,40,5\n")
+        report = self.import_csv(ProductResource(), text, chunk_size=2)
+
+        self.assertEqual(report.totals["new"], 2)
+        self.assertEqual(report.totals["update"], 1)
+        self.assertEqual(report.totals["invalid"], 2)
+        self.assertEqual([line for line, _ in report.errors], [4, 5])
+        self.assertIn("price", report.errors[0][1])
+
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.name, self.product.stock_quantity), ("Renamed", 7))
+        self.assertEqual(sorted(Product.objects.values_list("name", flat=True)), ["Lamp", "Renamed", "Shelf"])
+        # Imported products are searchable
+        lamp = Product.objects.get(name="Lamp")
+        self.assertEqual(search_products("desk"), [(lamp.pk, search_products("desk")[0][1])])
+
+    def test_dry_run_saves_nothing(self):
+        report = self.import_csv(ProductResource(), "name,description,price,stock_quantity\nLamp,Desk lamp,15,3\n",
+                                 dry_run=True)
+        self.assertEqual(report.totals["new"], 1)
+        self.assertFalse(Product.objects.filter(name="Lamp").exists())
+
+    def test_stock_import_from_jsonl(self):
+        text = (f'{{"id": {self.product.pk}, "stock_quantity": 42}}\n'
+                '\n'
+                '{"id": 999999, "stock_quantity": 1}\n'
+                'not json\n')
+        report = import_stream(ProductStockResource(), BytesIO(text.encode()), "jsonl")
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock_quantity, 42)
+        self.assertEqual(report.totals["update"], 1)
+        self.assertEqual([line for line, _ in report.errors], [3, 4])
+
+    def test_stock_import_keeps_the_holds_of_pending_orders(self):
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.token}')
+        data = {"order_items": [{"product": self.product.pk, "quantity": 3}], "order_status": "pending"}
+        self.client.post('/api/orders/', data=json.dumps(data), content_type='application/json')
+
+        # The file carries the quantities on hand, the 3 units held by the pending order included
+        report = self.import_csv(ProductStockResource(), f"id,stock_quantity\n{self.product.pk},50\n")
+        self.assertEqual(report.totals["update"], 1)
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.stock_quantity, self.product.reserved_quantity), (47, 3))
+        lines = b"".join(iter_export(ProductStockResource(), Product.objects.filter(pk=self.product.pk), "jsonl"))
+        self.assertEqual(json.loads(lines), {"id": self.product.pk, "stock_quantity": 50})
+
+        report = self.import_csv(ProductStockResource(), f"id,stock_quantity\n{self.product.pk},2\n")
+        self.assertEqual(report.totals["invalid"], 1)
+        self.assertIn("held by pending orders", report.errors[0][1])
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock_quantity, 47)
+
+    def test_category_import_rebuilds_paths(self):
+        text = "id,name,description,parent\n1000,Garden,,\n1001,Tools,,1000\n1002,Spades,,1001\n"
+        report = self.import_csv(ProductCategoryResource(), text)
+        self.assertEqual(report.totals["new"], 3)
+        spades = ProductCategory.objects.get(pk=1002)
+        self.assertEqual([category.name for category in spades.get_ancestors()], ["Garden", "Tools"])
+
+    def test_category_import_rejects_cycles(self):
+        garden = ProductCategory.objects.create(name="Garden")
+        tools = ProductCategory.objects.create(name="Tools", parent=garden)
+        text = f"id,name,description,parent\n{garden.pk},Garden,,{tools.pk}\n"
+        report = self.import_csv(ProductCategoryResource(), text)
+        self.assertEqual(report.totals["error"], 1)
+        self.assertIn("own ancestor", report.errors[0][1])
+        garden.refresh_from_db()
+        self.assertIsNone(garden.parent_id)
+
+        ProductCategory.objects.filter(pk=garden.pk).update(parent=tools)
+        with self.assertRaises(ValidationError):
+            ProductCategory.rebuild_paths()
+
+    def test_category_import_reindexes_renamed_categories(self):
+        garden = ProductCategory.objects.create(name="Garden")
+        self.product.categories.add(garden)
+        report = self.import_csv(ProductCategoryResource(), f"id,name,description,parent\n{garden.pk},Orchard,,\n")
+        self.assertEqual(report.totals["update"], 1)
+        self.assertEqual([product_id for product_id, _ in search_products("orchard")], [self.product.pk])
+
+    def test_chunk_with_database_error_is_reported(self):
+        text = "id,name,description,parent\n2000,Garden,,\n2001,Tools,,2000\n2002,Seeds,,\n"
+        with mock.patch.object(UserHistoryAuditQuerySet, 'bulk_create', side_effect=IntegrityError("failed")):
+            report = self.import_csv(ProductCategoryResource(), text, chunk_size=2)
+        self.assertEqual(report.totals["error"], 3)
+        self.assertEqual(report.errors, [(2, "Lines 2-3 not imported: failed"), (4, "Lines 4-4 not imported: failed")])
+        self.assertFalse(ProductCategory.objects.filter(pk__gte=2000).exists())
+
+
+class CatalogExportTests(APITestCase):
+
+    def test_export_round_trip(self):
+        Product.objects.create(name="Lamp, desk", description='Say "hi"', price=15, stock_quantity=3)
+        content = b"".join(iter_export(ProductResource(), Product.objects.order_by("pk"), "csv", chunk_size=1))
+        self.assertTrue(content.startswith(b"id,name,description,price,stock_quantity\r\n"))
+
+        Product.objects.update(stock_quantity=0)
+        report = import_stream(ProductResource(), BytesIO(content), "csv")
+        self.assertEqual(report.totals["update"], 2)
+        self.assertEqual(Product.objects.get(name="Lamp, desk").stock_quantity, 3)
+
+        lines = b"".join(iter_export(ProductStockResource(), Product.objects.order_by("pk"), "jsonl")).splitlines()
+        self.assertEqual(json.loads(lines[0]), {"id": self.product.pk, "stock_quantity": 100})
+
+    def test_commands(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "products.jsonl")
+            call_command("export_catalog", "products", path, stdout=StringIO())
+            Product.objects.all().delete()
+
+            out = StringIO()
+            call_command("import_catalog", "products", path, "--user", self.user.username, stdout=out)
+        self.assertIn("Imported 1 rows", out.getvalue())
+        self.assertEqual(Product.objects.get().created_by, self.user)
+
+
+class CatalogAdminTests(APITestCase):
+
+    def setUp(self):
+        super().setUp()
+        admin = get_user_model().objects.create_superuser(username="admin", password="password")
+        self.admin_client = Client()
+        self.admin_client.force_login(admin)
+
+    def test_export_action_streams_selected_rows(self):
+        response = self.admin_client.post('/admin/product/product/', {
+            'action': 'export_jsonl', '_selected_action': [self.product.pk]})
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        rows = [json.loads(line) for line in b"".join(response.streaming_content).splitlines()]
+        self.assertEqual([row["id"] for row in rows], [self.product.pk])
+
+    def test_import_view(self):
+        self.assertEqual(self.admin_client.get('/admin/product/product/import/').status_code, 200)
+        upload = SimpleUploadedFile("stock.csv", f"id,stock_quantity\n{self.product.pk},5\n".encode())
+        response = self.admin_client.post('/admin/product/product/import/',
+                                          {'resource': 'stock', 'file': upload}, follow=True)
+        self.assertContains(response, "1 update")
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock_quantity, 5)
+
+
+class StockImportConcurrencyTests(TransactionTestCase):
+    """
+    An order taking stock while a stock import is running must not be overwritten by the import.
+    """
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username='testuser', password='testpassword')
+        self.product = Product.objects.create(name='Test Product', description='', price=10, stock_quantity=100,
+                                              created_by=self.user, updated_by=self.user)
+        self.token = str(RefreshToken.for_user(self.user).access_token)
+
+    def place_order(self, ordering):
+        client = APIClient()
+        client.raise_request_exception = False
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.token}')
+        data = json.dumps({"order_items": [{"product": self.product.pk, "quantity": 3}], "order_status": "pending"})
+        ordering.set()
+        try:
+            client.post('/api/orders/', data=data, content_type='application/json')
+        finally:
+            connection.close()
+
+    def test_order_during_stock_import(self):
+        loaded, ordering, reports = threading.Event(), threading.Event(), []
+
+        def pause(*args, **kwargs):
+            # The rows of the chunk are loaded, let the order run before they are written
+            loaded.set()
+            ordering.wait(5)
+            time.sleep(0.2)
+
+        def run_import():
+            try:
+                with mock.patch.object(ProductStockResource, 'after_import_instance', side_effect=pause):
+                    reports.append(import_stream(ProductStockResource(), BytesIO(
+                        f"id,stock_quantity\n{self.product.pk},50\n".encode()), "csv"))
+            finally:
+                connection.close()
+
+        importer = threading.Thread(target=run_import)
+        importer.start()
+        loaded.wait(5)
+        orderer = threading.Thread(target=self.place_order, args=(ordering,))
+        orderer.start()
+        importer.join()
+        orderer.join()
+
+        # The order waits for the chunk, then takes its stock from the imported quantity
+        self.assertEqual(reports[0].totals["update"], 1, reports[0].errors)
+        self.assertEqual(Order.objects.count(), 1)
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.stock_quantity, self.product.reserved_quantity), (47, 3))
@@ -1,5 +1,9 @@
-from apps.base.tests import APITestCase
+import json
+from apps.base.cache import catalog_cache
+from apps.base.tests import APITestCase, QueryScalingMixin
 from apps.product.models import Product
+from django.contrib.auth import get_user_model
+from django.utils import timezone
 from rest_framework import status
 
 
@@ -31,3 +35,145 @@ class ProductAPITests(APITestCase):
         self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.token}')
         response = self.client.get(f'/api/products/{self.product.id}/')
         self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+
+class ProductCacheTests(APITestCase):
+
+    def test_product_list_is_cached(self):
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.token}')
+        catalog_cache.reset_stats()
+        first = self.client.get('/api/products/')
+        second = self.client.get('/api/products/')
+        self.assertEqual(first["X-Cache"], "MISS")
+        self.assertEqual(second["X-Cache"], "HIT")
+        self.assertEqual(first.json(), second.json())
+        self.assertEqual(catalog_cache.stats()["hits"], 1)
+        self.assertEqual(catalog_cache.stats()["misses"], 1)
+
+    def test_product_save_invalidates_cache(self):
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.token}')
+        self.client.get(f'/api/products/{self.product.id}/')
+        self.product.name = 'Renamed Product'
+        self.product.save()
+        response = self.client.get(f'/api/products/{self.product.id}/')
+        self.assertEqual(response["X-Cache"], "MISS")
+        self.assertEqual(response.data["name"], 'Renamed Product')
+
+    def test_changes_of_other_owners_keep_the_cache(self):
+        other_user = get_user_model().objects.create_user(username='other', password='secret')
+        other_product = Product.objects.create(name='Other Product', description='', price=5, stock_quantity=1,
+                                               created_by=other_user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.token}')
+        self.client.get('/api/products/')
+
+        other_product.name = 'Renamed Product'
+        other_product.save()
+        other_user.first_name = 'Other'
+        other_user.save()
+        self.assertEqual(self.client.get('/api/products/')["X-Cache"], "HIT")
+
+        self.user.first_name = 'Renamed'
+        self.user.save()
+        response = self.client.get('/api/products/')
+        self.assertEqual(response["X-Cache"], "MISS")
+        self.assertEqual(response.data["results"][0]["created_by"]["name"], f'Renamed {self.user.last_name}')
+
+    def test_reviews_follow_their_users(self):
+        path = f'/api/products/{self.product.id}/reviews/'
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.token}')
+        self.client.get(path)
+
+        self.user.last_login = timezone.now()
+        self.user.save(update_fields=["last_login"])
+        self.assertEqual(self.client.get(path)["X-Cache"], "HIT")
+
+        self.user.username = 'renamed'
+        self.user.save()
+        response = self.client.get(path)
+        self.assertEqual(response["X-Cache"], "MISS")
+        self.assertEqual(response.data["results"][0]["user"]["username"], 'renamed')
+
+    def test_order_stock_update_invalidates_cache(self):
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.token}')
+        self.client.get(f'/api/products/{self.product.id}/')
+        data = {"order_items": [{"product": self.product.id, "quantity": 2}], "order_status": "pending"}
+        # The cache is invalidated by the order event pipeline once the order is committed
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/api/orders/', data=json.dumps(data), content_type='application/json')
+        response = self.client.get(f'/api/products/{self.product.id}/')
+        self.assertEqual(response["X-Cache"], "MISS")
+        self.assertEqual(response.data["stock_quantity"], 98)
+
+
+class ProductPaginationTests(APITestCase):
+
+    def setUp(self):
+        super().setUp()
+        Product.objects.bulk_create([
+            Product(name=f'Product {i}', description='Product description', price=10, stock_quantity=10,
+                    created_by=self.user)
+            for i in range(24)
+        ])
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.token}')
+
+    def test_keyset_pagination_walks_all_pages(self):
+        expected = list(Product.objects.order_by("-id").values_list("id", flat=True))
+        ids, pages = [], []
+        url = '/api/products/?pagination=cursor&size=10'
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertNotIn("count", response.data)
+            pages.append(response.data)
+            ids += [product["id"] for product in response.data["results"]]
+            url = response.data["next"]
+        self.assertEqual(ids, expected)
+        self.assertEqual(len(pages), 3)
+
+        previous = self.client.get(pages[2]["previous"])
+        self.assertEqual([product["id"] for product in previous.data["results"]], expected[10:20])
+
+    def test_keyset_pagination_count_and_invalid_cursor(self):
+        response = self.client.get('/api/products/?pagination=cursor&count=true')
+        self.assertEqual(response.data["count"], 25)
+        self.assertIsNone(response.data["previous"])
+        response = self.client.get('/api/products/?cursor=tampered')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_page_number_pagination_is_default(self):
+        response = self.client.get('/api/products/?page=2')
+        self.assertEqual(response.data["count"], 25)
+        self.assertEqual(len(response.data["results"]), 10)
+
+
+class ProductExportTests(APITestCase):
+
+    def test_export_streams_all_products(self):
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.token}')
+        for index in range(12):
+            Product.objects.create(name=f'Product {index}', description='', price=10, stock_quantity=1,
+                                   created_by=self.user, updated_by=self.user)
+        response = self.client.get('/api/products/export/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('products.json', response['Content-Disposition'])
+        products = json.loads(b''.join(response.streaming_content))
+        self.assertEqual(len(products), 13)
+        self.assertEqual(products[0], self.client.get('/api/products/').data['results'][0])
+
+
+class ProductQueryTests(QueryScalingMixin, APITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.token}')
+
+    def seed_products(self, count):
+        for index in range(count):
+            Product.objects.create(name=f'Product {index}', description='', price=10, stock_quantity=1,
+                                   created_by=self.user, updated_by=self.user)
+
+    def test_product_list_queries(self):
+        self.assertQueriesDoNotScale('/api/products/', self.seed_products)
+
+    def test_product_keyset_list_queries(self):
+        self.assertQueriesDoNotScale('/api/products/?pagination=cursor', self.seed_products)
@@ -1,5 +1,11 @@
-from apps.base.tests import APITestCase
-from apps.product.models import ProductReview
+from apps.base.tests import APITestCase, QueryScalingMixin
+from apps.product.models import Product, ProductReview
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from decimal import Decimal
+from io import StringIO
 import json
 from rest_framework import status
 
@@ -30,3 +36,84 @@ class ReviewAPITests(APITestCase):
         self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.token}')
         response = self.client.get(f'/api/products/{self.product.id}/reviews/{self.review.id}/')
         self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+
+class ReviewAggregateTests(APITestCase):
+
+    def assertAggregates(self, count, average, histogram):
+        product = Product.objects.get(pk=self.product.pk)
+        self.assertEqual(product.review_count, count)
+        self.assertEqual(product.rating_average, Decimal(average))
+        self.assertEqual(product.rating_histogram, histogram)
+
+    def test_aggregates_follow_review_changes(self):
+        self.assertAggregates(1, "5.00", {"1": 0, "2": 0, "3": 0, "4": 0, "5": 1})
+
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.token}')
+        data = {"text": "Not so great", "rating": 2}
+        response = self.client.post(f'/api/products/{self.product.id}/reviews/', data=json.dumps(data),
+                                    content_type='application/json')
+        self.assertAggregates(2, "3.50", {"1": 0, "2": 1, "3": 0, "4": 0, "5": 1})
+
+        review = ProductReview.objects.get(pk=response.data["id"])
+        review.rating = 3
+        review.save()
+        self.assertAggregates(2, "4.00", {"1": 0, "2": 0, "3": 1, "4": 0, "5": 1})
+
+        self.client.delete(f'/api/products/{self.product.id}/reviews/{self.review.id}/')
+        self.assertAggregates(1, "3.00", {"1": 0, "2": 0, "3": 1, "4": 0, "5": 0})
+
+        review.delete()
+        self.assertAggregates(0, "0.00", {"1": 0, "2": 0, "3": 0, "4": 0, "5": 0})
+
+    def test_product_saves_keep_concurrent_aggregate_changes(self):
+        product = Product.objects.get(pk=self.product.pk)
+        ProductReview.objects.create(user=self.user, product=self.product, text='Fine', rating=4)
+        product.name = 'Renamed'
+        product.save()
+
+        self.assertAggregates(2, "4.50", {"1": 0, "2": 0, "3": 0, "4": 1, "5": 1})
+        self.assertEqual(Product.objects.get(pk=self.product.pk).name, 'Renamed')
+
+    def test_product_update_does_not_write_the_aggregates(self):
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.token}')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.patch(f'/api/products/{self.product.id}/', data=json.dumps({"name": "Renamed"}),
+                                         content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        updates = [query["sql"] for query in queries.captured_queries
+                   if query["sql"].startswith('UPDATE "product_product"')]
+        self.assertEqual(len(updates), 1)
+        self.assertNotIn('"review_count"', updates[0])
+        self.assertNotIn('"reserved_quantity"', updates[0])
+
+    def test_product_serializer_exposes_aggregates(self):
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.token}')
+        response = self.client.get(f'/api/products/{self.product.id}/')
+        self.assertEqual(response.data["review_count"], 1)
+        self.assertEqual(response.data["rating_average"], "5.00")
+        self.assertEqual(response.data["rating_histogram"]["5"], 1)
+
+    def test_rebuild_review_aggregates_command(self):
+        Product.objects.filter(pk=self.product.pk).update(review_count=0, rating_sum=0, rating_average=0,
+                                                          rating_5_count=0)
+        ProductReview.objects.create(user=self.user, product=self.product, text='Fine', rating=4)
+        Product.objects.filter(pk=self.product.pk).update(review_count=7)
+        call_command("rebuild_review_aggregates", batch_size=1, stdout=StringIO())
+        self.assertAggregates(2, "4.50", {"1": 0, "2": 0, "3": 0, "4": 1, "5": 1})
+
+
+class ReviewQueryTests(QueryScalingMixin, APITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.token}')
+
+    def seed_reviews(self, count):
+        for _ in range(count):
+            user = get_user_model().objects.create_user(username=f'reviewer{ProductReview.objects.count()}',
+                                                        password='x')
+            ProductReview.objects.create(user=user, product=self.product, text='Fine', rating=4)
+
+    def test_review_list_queries(self):
+        self.assertQueriesDoNotScale(f'/api/products/{self.product.id}/reviews/', self.seed_reviews)
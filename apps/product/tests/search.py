@@ -0,0 +1,112 @@
+from apps.base.tests import APITestCase
+from apps.product.models import Product, ProductCategory, ProductSearchPosting, ProductSearchTerm
+from apps.product.search import search_products, tokenize
+from django.core.management import call_command
+from io import StringIO
+from unittest import mock
+from rest_framework import status
+
+
+class ProductSearchIndexTests(APITestCase):
+
+    def setUp(self):
+        super().setUp()
+        # The index is refreshed once the changes are committed
+        with self.captureOnCommitCallbacks(execute=True):
+            self.headphones = Product.objects.create(
+                name="Wireless headphones", description="Noise cancelling over-ear headphones", price=99,
+                stock_quantity=5, created_by=self.user)
+            self.speaker = Product.objects.create(
+                name="Bluetooth speaker", description="Wireless speaker with deep bass", price=49, stock_quantity=5,
+                created_by=self.user)
+
+    def ranked_ids(self, query):
+        return [product_id for product_id, _ in search_products(query)]
+
+    def document_count(self, term):
+        return ProductSearchTerm.objects.get(term=term).document_count
+
+    def test_tokenize(self):
+        self.assertEqual(tokenize("The Over-Ear headphones, for music"), ["over", "ear", "headphones", "music"])
+
+    def test_index_is_maintained_on_save_and_delete(self):
+        self.assertEqual(self.document_count("wireless"), 2)
+        self.speaker.description = "Deep bass"
+        with self.captureOnCommitCallbacks(execute=True):
+            self.speaker.save()
+        self.assertEqual(self.document_count("wireless"), 1)
+        self.assertEqual(self.ranked_ids("bass"), [self.speaker.pk])
+
+        self.headphones.delete()
+        self.assertEqual(self.document_count("wireless"), 0)
+        self.assertFalse(ProductSearchPosting.objects.filter(term="headphones").exists())
+        self.assertEqual(self.ranked_ids("wireless"), [])
+
+    def test_bm25_ranking(self):
+        # The name counts double, and the word appears in the description of the headphones too
+        self.assertEqual(self.ranked_ids("headphones"), [self.headphones.pk])
+        self.assertEqual(self.ranked_ids("wireless bass")[0], self.speaker.pk)
+        self.assertEqual(self.ranked_ids("speaker wireless")[0], self.speaker.pk)
+
+    def test_prefix_matching(self):
+        self.assertEqual(self.ranked_ids("headph"), [self.headphones.pk])
+        self.assertEqual(sorted(self.ranked_ids("wire")), sorted([self.headphones.pk, self.speaker.pk]))
+        self.assertEqual(self.ranked_ids("w"), [])
+
+    def test_category_names_are_indexed(self):
+        audio = ProductCategory.objects.create(name="Audio")
+        with self.captureOnCommitCallbacks(execute=True):
+            self.speaker.categories.add(audio)
+        self.assertEqual(self.ranked_ids("audio"), [self.speaker.pk])
+
+        audio.name = "Sound"
+        with self.captureOnCommitCallbacks(execute=True):
+            audio.save()
+        self.assertEqual(self.ranked_ids("audio"), [])
+        self.assertEqual(self.ranked_ids("sound"), [self.speaker.pk])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            audio.products.clear()
+        self.assertEqual(self.ranked_ids("sound"), [])
+
+    def test_only_changes_of_indexed_fields_reindex(self):
+        with mock.patch('apps.product.signals.index_products') as index_products:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.speaker.stock_quantity = 3
+                self.speaker.save()
+                Product.objects.get(pk=self.speaker.pk).save()
+                self.speaker.save(update_fields=["price"])
+            index_products.assert_not_called()
+
+            with self.captureOnCommitCallbacks(execute=True):
+                self.speaker.name = "Bluetooth soundbar"
+                self.speaker.save()
+                # Nothing is indexed before the commit
+                index_products.assert_not_called()
+            index_products.assert_called_once_with([self.speaker.pk])
+
+    def test_search_does_not_scan_products(self):
+        with self.assertNumQueries(4):
+            search_products("wireless spea")
+
+    def test_rebuild_search_index_command(self):
+        ProductSearchPosting.objects.all().delete()
+        out = StringIO()
+        call_command("rebuild_search_index", stdout=out)
+        self.assertIn("3 products", out.getvalue())
+        self.assertEqual(self.document_count("wireless"), 2)
+        self.assertEqual(self.ranked_ids("headphones"), [self.headphones.pk])
+
+    def test_search_endpoint(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            other_user_product = Product.objects.create(name="Wireless mouse", description="", price=9,
+                                                        stock_quantity=1)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.token}')
+        response = self.client.get('/api/products/search/', {'q': 'wireless'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        ids = [product["id"] for product in response.json()["results"]]
+        self.assertEqual(sorted(ids), sorted([self.headphones.pk, self.speaker.pk]))
+        self.assertNotIn(other_user_product.pk, ids)
+
+        self.assertEqual(self.client.get('/api/products/search/', {'q': 'wireless'})["X-Cache"], "HIT")
+        self.assertEqual(self.client.get('/api/products/search/')["X-Cache"], "MISS")
@@ -1,10 +1,13 @@
 # urls.py
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter, SimpleRouter
-from .views import ProductAPIViewSet, ProductReviewAPIViewSet
+from .views import ProductAPIViewSet, ProductCategoryAPIViewSet, ProductReviewAPIViewSet, ProductSearchAPIViewSet
 
 router = DefaultRouter()
+# Before the products, whose detail route would match `search` as an id
+router.register(r'products/search', ProductSearchAPIViewSet, basename='product-search')
 router.register(r'products', ProductAPIViewSet, basename='product')
+router.register(r'categories', ProductCategoryAPIViewSet, basename='category')
 
 # Nested router for product reviews
 product_router = SimpleRouter()
@@ -1,9 +1,20 @@
+from asgiref.sync import sync_to_async
+from django.contrib.auth import get_user_model
 from rest_framework import viewsets
-from .models import Product, ProductReview
-from .serializers import ProductSerializer, ProductReviewSerializer
-
-
-class ProductAPIViewSet(viewsets.ModelViewSet):
+from rest_framework.decorators import action
+from rest_framework.response import Response
+from .filters import ProductFilterSet
+from .models import Product, ProductCategory, ProductReview
+from .search import search_products
+from .serializers import (ProductCategoryDetailSerializer, ProductCategorySerializer, ProductReviewSerializer,
+                          ProductSerializer)
+from apps.base.cache import catalog_cache
+from apps.base.mixins.cache import CatalogCacheMixin
+from apps.base.mixins.streaming import StreamingExportMixin
+from apps.base.views import AsyncReadAPIView
+
+
+class ProductAPIViewSet(CatalogCacheMixin, StreamingExportMixin, viewsets.ModelViewSet):
     """
     API endpoint for managing products.
 
@@ -68,6 +79,11 @@ class ProductAPIViewSet(viewsets.ModelViewSet):
         ```http
         DELETE /products/{id}/
         ```
+
+    - To download all the products of the user as a streamed JSON array:
+        ```http
+        GET /products/export/
+        ```
     Note:
 
     * To create a new product (return status):
@@ -89,19 +105,49 @@ class ProductAPIViewSet(viewsets.ModelViewSet):
       - 204 No Content: If the product is successfully deleted.
       - 404 Not Found: If the product does not exist.
       - 403 Forbidden: If the user is not the creator of the product.
+
+    * List and retrieve responses are served from the catalog cache, see the `X-Cache` response header.
+
+    * Lists are paginated by page number, `?pagination=cursor` switches to keyset pagination on `-id`.
+
+    * Lists and exports are filtered by `min_price`, `max_price`, `in_stock`, `category` (subcategories included)
+      and `min_rating`. With `?facets=true` lists also return the counts per price range, stock status, category
+      and minimum rating in `facets`, see `ProductFilterSet`.
     """
 
     serializer_class = ProductSerializer
+    filterset_class = ProductFilterSet
+    keyset_ordering = ('-id',)
+    cache_models = (Product, ProductCategory, get_user_model())
+    export_filename = 'products.json'
 
     def get_queryset(self):
         return Product.objects.filter(
             created_by=self.request.user).select_related('created_by').order_by("-id")
 
+    def get_cache_models(self, request):
+        # The products of the user only, with the user as their owner
+        user_id = request.user.pk
+        return (Product, "created_by_id", user_id), ProductCategory, (get_user_model(), "pk", user_id)
+
     def perform_create(self, serializer):
         serializer.save(created_by=self.request.user)
 
+    def get_paginated_response(self, data):
+        response = super().get_paginated_response(data)
+        if self.filterset_class.facets_requested(self.request):
+            filterset = self.filterset_class(self.request.query_params, queryset=self.get_queryset(),
+                                             request=self.request)
+            if filterset.is_valid():
+                response.data["facets"] = filterset.get_facets()
+        return response
+
+    @action(detail=False, methods=['get'])
+    def export(self, request):
+        return self.stream_export(request)
+
 
-class ProductReviewAPIViewSet(viewsets.ModelViewSet):
+class ProductReviewAPIViewSet(CatalogCacheMixin, viewsets.ModelViewSet):
     """
     API endpoint for managing product reviews.
 
@@ -184,14 +230,193 @@ class ProductReviewAPIViewSet(viewsets.ModelViewSet):
       - 204 No Content: If the review is successfully deleted.
       - 404 Not Found: If the review or product does not exist.
       - 403 Forbidden: If the user is not the creator of the review.
+
+    * List and retrieve responses are served from the catalog cache, see the `X-Cache` response header.
+
+    * Lists are paginated by page number, `?pagination=cursor` switches to keyset pagination on `-id`.
     """
 
     serializer_class = ProductReviewSerializer
+    keyset_ordering = ('-id',)
+    cache_models = (ProductReview, Product, get_user_model())
 
     def get_queryset(self):
         return ProductReview.objects.filter(product_id=self.kwargs["product_id"]).select_related(
             'product', 'product__created_by', 'user').order_by('-id')
 
+    def get_cache_models(self, request):
+        # Changes of the reviewers and of the owner invalidate the reviews of their products, see
+        # apps.product.signals.invalidate_user_reviews_on_save
+        product_id = int(self.kwargs["product_id"])
+        return (ProductReview, "product_id", product_id), (Product, "pk", product_id)
+
     def perform_create(self, serializer):
         serializer.save(product_id=self.kwargs["product_id"], user=self.request.user)
 
+
+class ProductCategoryAPIViewSet(CatalogCacheMixin, viewsets.ReadOnlyModelViewSet):
+    """
+    API endpoint for browsing the product category tree.
+
+    - List all categories in depth-first order.
+    - Retrieve a category with its breadcrumbs.
+    - Fetch the whole tree, or the products of the authenticated user in a category and its subcategories.
+
+    Responses:
+
+    - GET request:
+        - 200 OK: Returns the categories, the category, the tree or the products.
+        - 404 Not Found: If the category does not exist.
+
+    Examples:
+    - To list all categories:
+        ```http
+        GET /categories/
+        ```
+
+    - To retrieve a specific category and its breadcrumbs:
+        ```http
+        GET /categories/{id}/
+        ```
+
+    - To fetch the whole category tree, each category nesting its subcategories in `children`:
+        ```http
+        GET /categories/tree/
+        ```
+
+    - To list the products of a category and of all its subcategories:
+        ```http
+        GET /categories/{id}/products/
+        ```
+    Note:
+
+    * Categories are managed from the admin, their tree is indexed by a materialized path, see `ProductCategory`.
+
+    * List, retrieve and tree responses are served from the catalog cache, see the `X-Cache` response header.
+    """
+
+    serializer_class = ProductCategorySerializer
+    cache_models = (ProductCategory,)
+
+    def get_queryset(self):
+        return ProductCategory.objects.order_by("path")
+
+    def get_serializer_class(self):
+        if self.action == "retrieve":
+            return ProductCategoryDetailSerializer
+        if self.action == "products":
+            return ProductSerializer
+        return super().get_serializer_class()
+
+    @action(detail=False, methods=['get'])
+    def tree(self, request):
+        data, hit = catalog_cache.get_or_set(("category-tree",), self.build_tree, self.cache_models)
+        response = Response(data)
+        response["X-Cache"] = "HIT" if hit else "MISS"
+        return response
+
+    @action(detail=True, methods=['get'])
+    def products(self, request, pk=None):
+        queryset = self.get_object().get_products().filter(
+            created_by=request.user).select_related('created_by').order_by("-id")
+        page = self.paginate_queryset(queryset)
+        return self.get_paginated_response(self.get_serializer(page, many=True).data)
+
+    def build_tree(self):
+        """
+        Build the nested category tree from a single query, the path order lists every parent before its
+        subcategories.
+        """
+
+        nodes, roots = {}, []
+        for category in self.get_queryset().values("id", "parent_id", "name", "description"):
+            parent_id = category.pop("parent_id")
+            node = nodes[category["id"]] = {**category, "children": []}
+            parent = nodes.get(parent_id)
+            (parent["children"] if parent else roots).append(node)
+        return roots
+
+
+class ProductSearchAPIViewSet(CatalogCacheMixin, viewsets.GenericViewSet):
+    """
+    API endpoint for the full-text search of the products of the authenticated user.
+
+    Products are matched on the words of their name, description and category names through the product
+    search index (see `apps.product.search`), ranked with BM25. The last word of the query also matches the
+    words it starts, for autocomplete.
+
+    Responses:
+
+    - GET request:
+        - 200 OK: Returns the matching products, best first. Empty without a `q` parameter.
+
+    Examples:
+    - To search the products:
+        ```http
+        GET /products/search/?q=wireless head
+        ```
+    Note:
+
+    * Responses are served from the catalog cache, see the `X-Cache` response header.
+
+    * Results are paginated by page number, up to the 1000 best matches.
+    """
+
+    serializer_class = ProductSerializer
+    cache_models = ProductAPIViewSet.cache_models
+    get_cache_models = ProductAPIViewSet.get_cache_models
+
+    def get_queryset(self):
+        return Product.objects.filter(created_by=self.request.user)
+
+    def list(self, request, *args, **kwargs):
+        return self.get_cached_response(self.search, request, *args, **kwargs)
+
+    def search(self, request, *args, **kwargs):
+        ranked = search_products(request.query_params.get("q", ""), self.get_queryset())
+        page = self.paginate_queryset(ranked)
+        products = self.get_queryset().select_related('created_by').in_bulk([product_id for product_id, _ in page])
+        serializer = self.get_serializer([products[product_id] for product_id, _ in page if product_id in products],
+                                         many=True)
+        return self.get_paginated_response(serializer.data)
+
+
+class ProductAsyncAPIView(AsyncReadAPIView):
+    """
+    Async list and retrieve of the products of the authenticated user, served by the ASGI deployment.
+    The responses are the same as the ones of `ProductAPIViewSet`, which handles the other methods.
+    """
+
+    serializer_class = ProductSerializer
+    filterset_class = ProductAPIViewSet.filterset_class
+    keyset_ordering = ProductAPIViewSet.keyset_ordering
+    cache_models = ProductAPIViewSet.cache_models
+    get_cache_models = ProductAPIViewSet.get_cache_models
+
+    def get_queryset(self):
+        return Product.objects.filter(
+            created_by=self.request.user).select_related('created_by').order_by("-id")
+
+    async def list(self, request, *args, **kwargs):
+        data = await super().list(request, *args, **kwargs)
+        if self.filterset_class.facets_requested(request):
+            filterset = self.filterset_class(request.query_params, queryset=self.get_queryset(), request=request)
+            if filterset.is_valid():
+                data["facets"] = await sync_to_async(filterset.get_facets)()
+        return data
+
+
+class ProductReviewAsyncAPIView(AsyncReadAPIView):
+    """
+    Async list of the reviews of a product, served by the ASGI deployment. The responses are the same as the
+    ones of `ProductReviewAPIViewSet`, which handles the other methods.
+    """
+
+    serializer_class = ProductReviewSerializer
+    keyset_ordering = ProductReviewAPIViewSet.keyset_ordering
+    cache_models = ProductReviewAPIViewSet.cache_models
+    get_cache_models = ProductReviewAPIViewSet.get_cache_models
+
+    def get_queryset(self):
+        return ProductReview.objects.filter(product_id=self.kwargs["product_id"]).select_related(
+            'product', 'product__created_by', 'user').order_by('-id')
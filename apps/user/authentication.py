@@ -0,0 +1,60 @@
+from django.contrib.auth import get_user_model
+from django.db import DEFAULT_DB_ALIAS
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+
+from .cache import get_cached_user, get_claims_changed_at, is_stateless
+from .tokens import USER_CLAIMS
+
+
+class StatelessJWTAuthentication(JWTAuthentication):
+    """
+    JWT authentication that builds the user from the token claims instead of loading it on every request.
+
+    For tokens issued by `UserRefreshToken`, the user is a `User` instance holding only the id and the
+    `USER_CLAIMS`. It can be used as a foreign key value or in queryset filters without any query, and its
+    other fields are loaded at once on first access (see `User.refresh_from_db`). Tokens without these
+    claims fall back to the full user from the short-TTL user cache.
+
+    The claims of a token issued before the claims of its user changed (deactivation, deletion, username or
+    permission change) are not trusted, its user is loaded instead. The time of the change is recorded by the
+    user signals in the user cache, which must be shared by all processes: with a per-process cache every
+    request loads its user from the database.
+    """
+
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_("Token contained no recognizable user identification"))
+
+        if not is_stateless():
+            user = get_user_model().objects.filter(pk=user_id).first()
+        elif all(claim in validated_token for claim in USER_CLAIMS) and not self.claims_changed(validated_token):
+            user = self.get_claims_user(user_id, validated_token)
+        else:
+            user = get_cached_user(user_id)
+        if user is None:
+            raise AuthenticationFailed(_("User not found"), code="user_not_found")
+
+        if not user.is_active:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+
+        return user
+
+    @staticmethod
+    def claims_changed(validated_token):
+        changed_at = get_claims_changed_at(validated_token[api_settings.USER_ID_CLAIM])
+        return changed_at is not None and validated_token.get("iat", 0) <= changed_at
+
+    @staticmethod
+    def get_claims_user(user_id, validated_token):
+        user_model = get_user_model()
+        claims = {user_model._meta.pk.attname: user_id, **{claim: validated_token[claim] for claim in USER_CLAIMS}}
+        # from_db() expects the values in the order of the model fields, the missing ones are deferred
+        field_names = [field.attname for field in user_model._meta.concrete_fields if field.attname in claims]
+        user = user_model.from_db(DEFAULT_DB_ALIAS, field_names, [claims[name] for name in field_names])
+        user.is_token_user = True
+        return user
@@ -0,0 +1,144 @@
+import math
+import threading
+import time
+from hashlib import blake2b
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils import timezone
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken
+
+from apps.base.cache import is_shared_cache
+
+
+class BloomFilter:
+    """
+    Fixed-size Bloom filter over strings.
+
+    Membership tests never give false negatives, and give false positives at about the `error_rate` the filter
+    was sized for while it holds at most `capacity` items.
+
+    Example:
+        bloom = BloomFilter(capacity=1000, error_rate=0.001)
+        bloom.add("jti")
+        "jti" in bloom  # True
+    """
+
+    def __init__(self, capacity, error_rate):
+        self.capacity = max(capacity, 1)
+        self.size = max(int(-self.capacity * math.log(error_rate) / math.log(2) ** 2), 8)
+        self.hash_count = max(int(round(self.size / self.capacity * math.log(2))), 1)
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def positions(self, item):
+        # Double hashing, two 64 bit halves of one digest give all the positions
+        digest = blake2b(item.encode(), digest_size=16).digest()
+        first, second = int.from_bytes(digest[:8], "little"), int.from_bytes(digest[8:], "little") | 1
+        return ((first + index * second) % self.size for index in range(self.hash_count))
+
+    def add(self, item):
+        for position in self.positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, item):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self.positions(item))
+
+
+class BlacklistIndex:
+    """
+    In-memory index of the blacklisted token ids (JTIs), consulted before querying the token blacklist tables.
+
+    A JTI that is not in the Bloom filter is certainly not blacklisted, so only the rare possible hits
+    reach the database. The filter is built from the not yet expired blacklisted tokens on first use and is
+    updated incrementally whenever a token is blacklisted in this process. A generation number stored in the
+    shared cache tells other processes that a token was blacklisted elsewhere, they then rebuild their filter
+    with a single query on their next check.
+
+    The index is only used when its cache is shared by all processes (Redis). With a per-process cache the
+    other processes would never learn about the tokens blacklisted elsewhere, so every check goes to the
+    database.
+    """
+
+    generation_key = "token-blacklist:generation"
+
+    def __init__(self, capacity, error_rate, cache_alias="default"):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.cache_alias = cache_alias
+        self.lock = threading.Lock()
+        self.bloom = None
+        self.generation = None
+
+    @property
+    def cache(self):
+        return caches[self.cache_alias]
+
+    @property
+    def enabled(self):
+        return is_shared_cache(self.cache)
+
+    def get_shared_generation(self):
+        generation = self.cache.get(self.generation_key)
+        if generation is None:
+            generation = time.time_ns()
+            self.cache.add(self.generation_key, generation, timeout=None)
+            generation = self.cache.get(self.generation_key, generation)
+        return generation
+
+    def rebuild(self, generation=None):
+        """
+        Rebuild the filter from the blacklisted tokens that are not expired yet.
+        """
+
+        generation = generation if generation is not None else self.get_shared_generation()
+        jtis = BlacklistedToken.objects.filter(token__expires_at__gt=timezone.now()).values_list(
+            "token__jti", flat=True)
+        count = jtis.count()
+        bloom = BloomFilter(max(self.capacity, count * 2), self.error_rate)
+        for jti in jtis.iterator(chunk_size=2000):
+            bloom.add(jti)
+
+        with self.lock:
+            self.bloom, self.generation = bloom, generation
+        return bloom
+
+    def might_contain(self, jti):
+        """
+        Return False if the token id is certainly not blacklisted, True if the database must be checked.
+        """
+
+        if not self.enabled:
+            return True
+        generation = self.get_shared_generation()
+        bloom = self.bloom
+        if bloom is None or generation != self.generation:
+            bloom = self.rebuild(generation)
+        return jti in bloom
+
+    def add(self, jti):
+        """
+        Add a newly blacklisted token id and tell the other processes to rebuild their filter.
+        """
+
+        if not self.enabled:
+            return
+        generation = time.time_ns()
+        previous = self.cache.get(self.generation_key)
+        self.cache.set(self.generation_key, generation, timeout=None)
+        with self.lock:
+            # Rebuild on the next check when another process blacklisted a token since the last build, or
+            # when the filter is over capacity and its error rate grows
+            if self.bloom is None or previous != self.generation or self.bloom.count >= self.bloom.capacity:
+                self.bloom = None
+                return
+            self.bloom.add(jti)
+            self.generation = generation
+
+
+blacklist_index = BlacklistIndex(
+    capacity=settings.TOKEN_BLACKLIST_INDEX["CAPACITY"],
+    error_rate=settings.TOKEN_BLACKLIST_INDEX["ERROR_RATE"],
+    cache_alias=settings.TOKEN_BLACKLIST_INDEX["CACHE_ALIAS"],
+)
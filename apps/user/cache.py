@@ -0,0 +1,75 @@
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+
+from apps.base.cache import is_shared_cache
+
+
+def get_user_cache():
+    return caches[settings.STATELESS_JWT["USER_CACHE_ALIAS"]]
+
+
+def is_stateless():
+    """
+    Tell whether the users may be built from their token claims and cached. The claims changes are only seen
+    by every process through a shared user cache (Redis), otherwise every request loads its user.
+    """
+
+    return is_shared_cache(get_user_cache())
+
+
+def user_key(user_id):
+    return f"user:{user_id}"
+
+
+def claims_changed_key(user_id):
+    return f"user:claims-changed:{user_id}"
+
+
+def get_cached_user(user_id):
+    """
+    Return the full user model for the id, from a short-TTL cache shared by the requests of a process (or of all
+    processes when the cache is Redis).
+
+    Args:
+        user_id (int): The user id.
+
+    Returns:
+        User or None: The user, or None if it does not exist.
+    """
+
+    cache = get_user_cache()
+    user = cache.get(user_key(user_id))
+    if user is None:
+        user = get_user_model().objects.filter(pk=user_id).first()
+        if user is not None:
+            cache.set(user_key(user_id), user, timeout=settings.STATELESS_JWT["USER_CACHE_TIMEOUT"])
+    return user
+
+
+def get_claims_changed_at(user_id):
+    """
+    Return when the token claims of the user last changed (deactivation, deletion, username or permission
+    change), as a timestamp, or None when they did not change during the lifetime of the tokens.
+    """
+
+    return get_user_cache().get(claims_changed_key(user_id))
+
+
+def invalidate_user(user, claims_changed=False):
+    """
+    Drop the cached user and, when its token claims changed, record the time of the change so that the claims
+    of the tokens issued before are not trusted until the refresh tokens issued before have expired.
+
+    Args:
+        user (User): The changed user.
+        claims_changed (bool): True when the user was deleted or a field copied into the tokens changed.
+    """
+
+    cache = get_user_cache()
+    cache.delete(user_key(user.pk))
+    if claims_changed:
+        lifetime = max(settings.SIMPLE_JWT["ACCESS_TOKEN_LIFETIME"], settings.SIMPLE_JWT["REFRESH_TOKEN_LIFETIME"])
+        cache.set(claims_changed_key(user.pk), time.time(), timeout=int(lifetime.total_seconds()))
@@ -0,0 +1,16 @@
+from django.conf import settings
+from django.contrib.auth.hashers import PBKDF2PasswordHasher
+
+
+class ConfigurablePBKDF2PasswordHasher(PBKDF2PasswordHasher):
+    """
+    PBKDF2 hasher whose cost is the `PASSWORD_HASHER_ITERATIONS` setting.
+
+    It keeps the `pbkdf2_sha256` algorithm name, so existing hashes stay valid. When the setting changes,
+    `must_update()` reports the stored hashes with another iteration count and they are re-hashed with the
+    new cost on the next successful login.
+    """
+
+    @property
+    def iterations(self):
+        return getattr(settings, "PASSWORD_HASHER_ITERATIONS", PBKDF2PasswordHasher.iterations)
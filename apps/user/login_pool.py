@@ -0,0 +1,115 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import authenticate, user_logged_in
+from django.db import close_old_connections
+
+from apps.base.mixins.exception import LoginPoolSaturated, LoginPoolTimeout
+
+
+class BoundedExecutor:
+    """
+    Thread pool accepting at most `max_workers + max_queue` pending calls, and rejecting the others at once.
+
+    Example:
+        executor = BoundedExecutor(max_workers=4, max_queue=16)
+        future = executor.submit(pow, 2, 10)  # raises LoginPoolSaturated when full
+    """
+
+    def __init__(self, max_workers, max_queue):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.slots = threading.BoundedSemaphore(max_workers + max_queue)
+        self.lock = threading.Lock()
+        self.executor = None
+
+    def get_executor(self):
+        # Created on first use, so forked worker processes never inherit a pool without threads
+        with self.lock:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="login")
+            return self.executor
+
+    def submit(self, fn, *args, **kwargs):
+        if not self.slots.acquire(blocking=False):
+            raise LoginPoolSaturated("Too many login attempts in progress, retry later")
+        try:
+            future = self.get_executor().submit(fn, *args, **kwargs)
+        except Exception:
+            self.slots.release()
+            raise
+        future.add_done_callback(lambda _: self.slots.release())
+        return future
+
+
+login_executor = BoundedExecutor(
+    max_workers=settings.LOGIN_POOL["MAX_WORKERS"],
+    max_queue=settings.LOGIN_POOL["MAX_QUEUE"],
+)
+
+
+def authenticate_on_pool(request, username, password):
+    """
+    Run `authenticate()` on a pool thread, through the `AUTHENTICATION_BACKENDS`. The thread has its own
+    database connection, closed like the ones of the request threads.
+    """
+
+    close_old_connections()
+    try:
+        return authenticate(request, username=username, password=password)
+    finally:
+        close_old_connections()
+
+
+def logged_in(request, user):
+    if user is not None:
+        user_logged_in.send(sender=user.__class__, request=request, user=user)
+    return user
+
+
+def verify_credentials(request, username, password):
+    """
+    Authenticate a user by username and password with `authenticate()` on the bounded login pool, and send
+    `user_logged_in` once authenticated.
+
+    The backends load the user and verify the password hash on a pool thread, re-hashing it when it was made
+    with another cost than the current hasher, and send `user_login_failed` for wrong credentials. The
+    calling thread waits for the result, async views use `averify_credentials()` instead.
+
+    Args:
+        request (HttpRequest): The login request, passed to the backends and the signals.
+        username (str): The username.
+        password (str): The raw password.
+
+    Returns:
+        User or None: The active user matching the credentials, or None.
+
+    Raises:
+        LoginPoolSaturated: If the pool and its queue are full.
+        LoginPoolTimeout: If the verification did not finish within `LOGIN_POOL['TIMEOUT']` seconds.
+    """
+
+    future = login_executor.submit(authenticate_on_pool, request, username, password)
+    try:
+        user = future.result(timeout=settings.LOGIN_POOL["TIMEOUT"])
+    except TimeoutError:
+        future.cancel()
+        raise LoginPoolTimeout("Login is temporarily unavailable, retry later")
+    return logged_in(request, user)
+
+
+async def averify_credentials(request, username, password):
+    """
+    Async variant of `verify_credentials()`, the event loop awaits the pool without holding a thread.
+    """
+
+    future = login_executor.submit(authenticate_on_pool, request, username, password)
+    try:
+        # A timeout cancels the pool call as well
+        user = await asyncio.wait_for(asyncio.wrap_future(future), settings.LOGIN_POOL["TIMEOUT"])
+    except asyncio.TimeoutError:
+        raise LoginPoolTimeout("Login is temporarily unavailable, retry later")
+    return await sync_to_async(logged_in)(request, user)
@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from rest_framework_simplejwt.token_blacklist.models import OutstandingToken
+
+
+class Command(BaseCommand):
+    """
+    Delete the expired outstanding tokens, and with them their blacklist entries, in batches.
+
+    Each batch selects a bounded number of expired token ids and deletes them in its own short transaction,
+    so the blacklist tables can be pruned periodically (e.g. from cron) without long locks.
+
+    Example:
+        python manage.py prune_tokens --batch-size 5000
+    """
+
+    help = "Delete expired outstanding and blacklisted tokens in batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=5000, help="Number of tokens deleted per batch.")
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        now = timezone.now()
+        deleted = 0
+
+        while True:
+            token_ids = list(OutstandingToken.objects.filter(expires_at__lte=now).order_by("pk").values_list(
+                "pk", flat=True)[:batch_size])
+            if not token_ids:
+                break
+
+            with transaction.atomic():
+                # Blacklisted tokens are deleted with their outstanding token (on_delete=CASCADE)
+                OutstandingToken.objects.filter(pk__in=token_ids).delete()
+            deleted += len(token_ids)
+
+        self.stdout.write(self.style.SUCCESS(f"Deleted {deleted} expired tokens"))
@@ -18,6 +18,36 @@ class User(AbstractUser):
 
     profile_photo = models.ImageField(upload_to='user/profile/', blank=True, null=True)
 
+    # True for users built from JWT claims by `StatelessJWTAuthentication`
+    is_token_user = False
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        from apps.user.tokens import USER_CLAIMS
+        instance = super().from_db(db, field_names, values)
+        # Remember the stored token claims, the tokens issued before they change are not trusted anymore
+        loaded_values = dict(zip(field_names, values))
+        if all(loaded_values.get(claim, models.DEFERRED) is not models.DEFERRED for claim in USER_CLAIMS):
+            instance._loaded_claims = {claim: loaded_values[claim] for claim in USER_CLAIMS}
+        return instance
+
     @property
     def name(self):
         return f"{self.first_name} {self.last_name}"
+
+    def refresh_from_db(self, using=None, fields=None):
+        """
+        Load deferred fields. A user built from token claims loads all of its missing fields on the first
+        access to any of them, from the user cache when possible, instead of one query per field.
+        """
+
+        deferred_fields = self.get_deferred_fields()
+        if self.is_token_user and fields is not None and set(fields) <= deferred_fields:
+            from apps.user.cache import get_cached_user
+            user = get_cached_user(self.pk)
+            if user is not None:
+                for field_name in deferred_fields:
+                    setattr(self, field_name, getattr(user, field_name))
+                return
+            fields = deferred_fields
+        super().refresh_from_db(using=using, fields=fields)
@@ -1,5 +1,10 @@
 from django.contrib.auth import get_user_model
-from rest_framework import serializers
+from django.utils.translation import gettext_lazy as _
+from rest_framework import exceptions, serializers
+from rest_framework_simplejwt import serializers as jwt_serializers
+from rest_framework_simplejwt.settings import api_settings
+from .tokens import UserRefreshToken
+from apps.base.serializers import CompiledSerializerMixin
 
 
 class UserSerializer(serializers.ModelSerializer):
@@ -13,6 +18,18 @@ class UserSerializer(serializers.ModelSerializer):
         return get_user_model().objects.create_user(**validated_data)
 
 
+class UserReadSerializer(CompiledSerializerMixin, serializers.ModelSerializer):
+    """
+    Public fields of a user, for the representations embedding users such as the products and the reviews.
+    Same representation as `UserSerializer`, which handles the registrations.
+    """
+
+    class Meta:
+        model = get_user_model()
+        fields = ["id", "profile_photo", "name", "username"]
+        read_only_fields = fields
+
+
 class LoginSerializer(serializers.Serializer):
     username = serializers.CharField()
     password = serializers.CharField()
@@ -20,3 +37,31 @@ class LoginSerializer(serializers.Serializer):
 
 class LogoutSerializer(serializers.Serializer):
     refresh_token = serializers.CharField()
+
+
+class TokenRefreshSerializer(jwt_serializers.TokenRefreshSerializer):
+    """
+    Refresh an access token for an active user only. The new access token carries the current claims of the
+    user, not the ones copied into the refresh token when it was issued.
+    """
+
+    token_class = UserRefreshToken
+
+    def validate(self, attrs):
+        refresh = self.token_class(attrs["refresh"])
+        user = get_user_model().objects.filter(pk=refresh.get(api_settings.USER_ID_CLAIM)).first()
+        if user is None or not api_settings.USER_AUTHENTICATION_RULE(user):
+            raise exceptions.AuthenticationFailed(_("No active account found with the given credentials"),
+                                                  code="no_active_account")
+        refresh.set_user_claims(user)
+        refresh.set_iat()
+
+        data = {"access": str(refresh.access_token)}
+        if api_settings.ROTATE_REFRESH_TOKENS:
+            if api_settings.BLACKLIST_AFTER_ROTATION:
+                refresh.blacklist()
+            refresh.set_jti()
+            refresh.set_exp()
+            refresh.set_iat()
+            data["refresh"] = str(refresh)
+        return data
@@ -0,0 +1,33 @@
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken
+
+from apps.user.blacklist import blacklist_index
+from apps.user.cache import invalidate_user
+from apps.user.tokens import USER_CLAIMS
+
+
+@receiver(post_save, sender=get_user_model(), dispatch_uid="user-cache-save")
+def invalidate_user_on_save(sender, instance, created, **kwargs):
+    loaded = getattr(instance, "_loaded_claims", None)
+    claims = {claim: getattr(instance, claim) for claim in USER_CLAIMS}
+    if not created:
+        # Unknown stored claims (e.g. deferred fields) count as changed
+        invalidate_user(instance, claims_changed=loaded != claims)
+    instance._loaded_claims = claims
+
+
+@receiver(post_delete, sender=get_user_model(), dispatch_uid="user-cache-delete")
+def invalidate_user_on_delete(sender, instance, **kwargs):
+    invalidate_user(instance, claims_changed=True)
+
+
+@receiver(post_save, sender=BlacklistedToken, dispatch_uid="token-blacklist-index")
+def add_to_blacklist_index(sender, instance, created, **kwargs):
+    if created:
+        jti = instance.token.jti
+        blacklist_index.add(jti)
+        # Again once committed, processes rebuilding in between could not see the row yet
+        transaction.on_commit(lambda: blacklist_index.add(jti))
@@ -1,8 +1,266 @@
-from django.contrib.auth import get_user_model
+from datetime import timedelta
+from io import StringIO
+from unittest.mock import Mock, patch
+import threading
+import time
+from asgiref.sync import async_to_sync
+from django.contrib.auth import get_user_model, user_logged_in, user_login_failed
+from django.core.management import call_command
+from django.test import AsyncClient, TransactionTestCase, override_settings
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.test import APIRequestFactory
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, TokenError
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+from rest_framework_simplejwt.tokens import AccessToken
 from apps.base.tests import APITestCase
+from apps.user.authentication import StatelessJWTAuthentication
+from apps.user.blacklist import BlacklistIndex, BloomFilter, blacklist_index
+from apps.user.cache import claims_changed_key, get_user_cache, user_key
+from apps.user.login_pool import BoundedExecutor
+from apps.user.tokens import UserRefreshToken
 
 
 class UserModelTests(APITestCase):
 
     def test_user_creation(self):
         self.assertEqual(get_user_model().objects.count(), 1)
+
+
+@patch("apps.user.cache.is_shared_cache", return_value=True)
+class StatelessJWTAuthenticationTests(APITestCase):
+
+    def login(self):
+        # The tokens of UserLoginAPIView, which authenticates on the login pool threads (see LoginPoolTests)
+        access = str(UserRefreshToken.for_user(self.user).access_token)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {access}')
+        return access
+
+    def test_claims_user_is_built_without_query(self, is_shared_cache):
+        self.login()
+        request = APIRequestFactory().get('/', HTTP_AUTHORIZATION=self.client._credentials["HTTP_AUTHORIZATION"])
+        with self.assertNumQueries(0):
+            user, _ = StatelessJWTAuthentication().authenticate(request)
+        self.assertEqual(user.pk, self.user.pk)
+        self.assertTrue(user.is_authenticated)
+        self.user.first_name, self.user.last_name = "Test", "User"
+        self.user.save()
+        with self.assertNumQueries(1):
+            self.assertEqual(user.name, "Test User")
+            self.assertFalse(user.profile_photo)
+
+    def test_deactivated_user_is_rejected(self, is_shared_cache):
+        self.login()
+        self.assertEqual(self.client.get('/api/orders/').status_code, status.HTTP_200_OK)
+        self.user.is_active = False
+        self.user.save()
+        response = self.client.get('/api/orders/')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        self.assertEqual(response.data["code"], "user_inactive")
+
+    def test_claims_change_is_not_trusted(self, is_shared_cache):
+        self.user.is_staff = True
+        self.user.save()
+        self.login()
+        self.user.refresh_from_db()
+        self.user.is_staff = False
+        self.user.save()
+        request = APIRequestFactory().get('/', HTTP_AUTHORIZATION=self.client._credentials["HTTP_AUTHORIZATION"])
+        with self.assertNumQueries(1):
+            user, _ = StatelessJWTAuthentication().authenticate(request)
+        self.assertFalse(user.is_staff)
+        self.assertFalse(user.is_token_user)
+
+    def test_unchanged_claims_are_still_trusted(self, is_shared_cache):
+        self.login()
+        self.user.refresh_from_db()
+        self.user.first_name = "Test"
+        self.user.save()
+        request = APIRequestFactory().get('/', HTTP_AUTHORIZATION=self.client._credentials["HTTP_AUTHORIZATION"])
+        with self.assertNumQueries(0):
+            user, _ = StatelessJWTAuthentication().authenticate(request)
+        self.assertTrue(user.is_token_user)
+
+    def test_refresh_rejects_deactivated_user_and_updates_claims(self, is_shared_cache):
+        refresh = str(UserRefreshToken.for_user(self.user))
+        self.user.refresh_from_db()
+        self.user.is_staff = True
+        self.user.save()
+        # Changed a while before the refresh, the tokens issued in the second of the change are not trusted
+        get_user_cache().set(claims_changed_key(self.user.pk), time.time() - 5)
+        response = self.client.post('/api/user/token/refresh/', data={"refresh": refresh})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        access = AccessToken(response.data["access"])
+        self.assertTrue(access["is_staff"])
+        self.assertFalse(StatelessJWTAuthentication.claims_changed(access))
+
+        self.user.is_active = False
+        self.user.save()
+        response = self.client.post('/api/user/token/refresh/', data={"refresh": refresh})
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_token_without_claims_uses_user_cache(self, is_shared_cache):
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.token}')
+        self.client.get('/api/orders/')
+        self.assertIsNotNone(get_user_cache().get(user_key(self.user.pk)))
+        self.user.save()
+        self.assertIsNone(get_user_cache().get(user_key(self.user.pk)))
+
+
+class PerProcessUserCacheTests(APITestCase):
+
+    def test_claims_user_is_loaded_without_shared_cache(self):
+        access = UserRefreshToken.for_user(self.user).access_token
+        request = APIRequestFactory().get('/', HTTP_AUTHORIZATION=f'Bearer {access}')
+        with self.assertNumQueries(1):
+            user, _ = StatelessJWTAuthentication().authenticate(request)
+        self.assertFalse(user.is_token_user)
+        # Another worker deactivates the user, this process cannot see it in its own cache
+        get_user_model().objects.filter(pk=self.user.pk).update(is_active=False)
+        with self.assertRaises(AuthenticationFailed):
+            StatelessJWTAuthentication().authenticate(request)
+
+
+class TokenBlacklistTests(APITestCase):
+
+    def test_bloom_filter_has_no_false_negatives(self):
+        bloom = BloomFilter(capacity=1000, error_rate=0.01)
+        for index in range(1000):
+            bloom.add(f"jti-{index}")
+        self.assertTrue(all(f"jti-{index}" in bloom for index in range(1000)))
+        false_positives = sum(f"other-{index}" in bloom for index in range(10000))
+        self.assertLess(false_positives, 300)
+
+    def test_blacklisted_refresh_token_is_rejected(self):
+        refresh = str(UserRefreshToken.for_user(self.user))
+        response = self.client.post('/api/user/token/refresh/', data={"refresh": refresh})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.token}')
+        response = self.client.post('/api/user/logout/', data={"refresh_token": refresh})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        response = self.client.post('/api/user/token/refresh/', data={"refresh": refresh})
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    @patch("apps.user.blacklist.is_shared_cache", return_value=True)
+    def test_index_skips_database_for_unknown_tokens(self, is_shared_cache):
+        blacklisted = UserRefreshToken.for_user(self.user)
+        blacklisted.blacklist()
+        refresh = UserRefreshToken.for_user(self.user)
+        blacklist_index.might_contain("warm-up")
+        with self.assertNumQueries(0):
+            refresh.check_blacklist()
+        with self.assertRaises(TokenError):
+            UserRefreshToken(str(blacklisted))
+
+    def test_per_process_cache_checks_the_database(self):
+        # Another worker blacklists the token, this process never hears about it through a local cache
+        refresh = UserRefreshToken.for_user(self.user)
+        blacklist_index.might_contain("warm-up")
+        outstanding = OutstandingToken.objects.get(jti=refresh["jti"])
+        BlacklistedToken.objects.bulk_create([BlacklistedToken(token=outstanding)])
+        with self.assertNumQueries(1):
+            with self.assertRaises(TokenError):
+                refresh.check_blacklist()
+
+    @patch("apps.user.blacklist.is_shared_cache", return_value=True)
+    def test_shared_cache_tells_other_processes(self, is_shared_cache):
+        this_process, other_process = BlacklistIndex(1000, 0.001), BlacklistIndex(1000, 0.001)
+        refresh = UserRefreshToken.for_user(self.user)
+        self.assertFalse(this_process.might_contain(refresh["jti"]))
+
+        refresh.blacklist()
+        other_process.add(refresh["jti"])
+        self.assertTrue(this_process.might_contain(refresh["jti"]))
+
+    def test_prune_tokens_command(self):
+        expired = OutstandingToken.objects.create(user=self.user, jti="expired", token="token",
+                                                  expires_at=timezone.now() - timedelta(days=1))
+        BlacklistedToken.objects.create(token=expired)
+        valid = UserRefreshToken.for_user(self.user)
+        call_command("prune_tokens", batch_size=1, stdout=StringIO())
+        self.assertFalse(OutstandingToken.objects.filter(jti="expired").exists())
+        self.assertFalse(BlacklistedToken.objects.exists())
+        self.assertTrue(OutstandingToken.objects.filter(jti=valid["jti"]).exists())
+
+
+class LoginPoolTests(TransactionTestCase):
+    """
+    The credentials are verified on the login pool threads, which only see committed rows.
+    """
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username='testuser', password='testpassword')
+
+    def login(self, password='testpassword'):
+        return self.client.post('/api/user/login/', data={"username": "testuser", "password": password})
+
+    def test_login_verifies_credentials(self):
+        self.assertEqual(self.login().status_code, status.HTTP_200_OK)
+        self.assertEqual(self.login('wrong').status_code, status.HTTP_401_UNAUTHORIZED)
+        response = self.client.post('/api/user/login/', data={"username": "nobody", "password": "testpassword"})
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.login().status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_login_token_carries_user_claims(self):
+        token = AccessToken(self.login().data["access"])
+        self.assertEqual(token["username"], "testuser")
+        self.assertTrue(token["is_active"])
+        self.assertFalse(token["is_staff"])
+
+    def test_login_goes_through_the_authentication_backends(self):
+        with patch("django.contrib.auth.backends.ModelBackend.authenticate", return_value=None) as backend:
+            self.assertEqual(self.login().status_code, status.HTTP_401_UNAUTHORIZED)
+        backend.assert_called_once()
+
+    def test_login_sends_the_login_signals(self):
+        with patch.object(user_logged_in, "receivers", []), patch.object(user_login_failed, "receivers", []):
+            logged_in, failed = Mock(), Mock()
+            user_logged_in.connect(logged_in, weak=False)
+            user_login_failed.connect(failed, weak=False)
+            self.login()
+            self.login('wrong')
+        self.assertEqual(logged_in.call_args.kwargs["user"], self.user)
+        self.assertEqual(failed.call_args.kwargs["credentials"]["username"], "testuser")
+
+    def test_login_updates_last_login(self):
+        self.assertIsNone(self.user.last_login)
+        self.login()
+        self.user.refresh_from_db()
+        self.assertIsNotNone(self.user.last_login)
+
+    @override_settings(PASSWORD_HASHER_ITERATIONS=1000)
+    def test_login_rehashes_password_when_cost_changes(self):
+        self.assertNotIn("$1000$", self.user.password)
+        self.assertEqual(self.login().status_code, status.HTTP_200_OK)
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.password.startswith("pbkdf2_sha256$1000$"))
+        self.assertEqual(self.login().status_code, status.HTTP_200_OK)
+
+    @override_settings(ROOT_URLCONF='ecommerce_project.asgi_urls')
+    def test_async_login(self):
+        client = AsyncClient()
+        response = async_to_sync(client.post)('/api/user/login/', {"username": "testuser", "password": "testpassword"},
+                                              content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(AccessToken(response.json()["access"])["username"], "testuser")
+        response = async_to_sync(client.post)('/api/user/login/', {"username": "testuser", "password": "wrong"},
+                                              content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_saturated_pool_rejects_logins(self):
+        executor = BoundedExecutor(max_workers=1, max_queue=0)
+        release = threading.Event()
+        blocker = executor.submit(release.wait)
+        try:
+            with patch("apps.user.login_pool.login_executor", executor):
+                response = self.login()
+            self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+            self.assertIn("Retry-After", response)
+        finally:
+            release.set()
+            blocker.result()
@@ -0,0 +1,34 @@
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from .blacklist import blacklist_index
+
+# User fields copied into the tokens, enough to authenticate a request without loading the user
+USER_CLAIMS = ("username", "is_active", "is_staff", "is_superuser")
+
+
+class UserRefreshToken(RefreshToken):
+    """
+    Refresh token carrying the `USER_CLAIMS` of the user, the access tokens derived from it copy them.
+
+    The blacklist is checked against the in-memory `blacklist_index` first when the cache is shared by all
+    processes, the database is only queried for the token ids the index cannot rule out.
+
+    Example:
+        refresh = UserRefreshToken.for_user(user)
+        access = str(refresh.access_token)
+    """
+
+    @classmethod
+    def for_user(cls, user):
+        token = super().for_user(user)
+        token.set_user_claims(user)
+        return token
+
+    def set_user_claims(self, user):
+        for claim in USER_CLAIMS:
+            self[claim] = getattr(user, claim)
+
+    def check_blacklist(self):
+        if blacklist_index.might_contain(self.payload[api_settings.JTI_CLAIM]):
+            super().check_blacklist()
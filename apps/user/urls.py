@@ -1,10 +1,11 @@
 from django.urls import path
-from .views import UserRegisterAPIView, UserLoginAPIView, UserLogoutAPIView
+from .views import UserRegisterAPIView, UserLoginAPIView, UserLogoutAPIView, UserTokenRefreshAPIView
 
 
 urlpatterns = [
     path('user/register/', UserRegisterAPIView.as_view(), name='user-register'),
     path('user/login/', UserLoginAPIView.as_view(), name='user-login'),
     path('user/logout/', UserLogoutAPIView.as_view(), name='user-logout'),
+    path('user/token/refresh/', UserTokenRefreshAPIView.as_view(), name='user-token-refresh'),
 ]
 
@@ -1,10 +1,14 @@
-from django.contrib.auth import authenticate
+from asgiref.sync import sync_to_async
 from rest_framework import generics, permissions, status
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework_simplejwt.exceptions import TokenError
-from rest_framework_simplejwt.tokens import RefreshToken
-from .serializers import UserSerializer, LoginSerializer, LogoutSerializer
+from rest_framework_simplejwt.views import TokenRefreshView
+from .tokens import UserRefreshToken
+from apps.base.mixins.exception import LoginExceptionMixin
+from apps.base.views import AsyncAPIView
+from .login_pool import averify_credentials, verify_credentials
+from .serializers import UserSerializer, LoginSerializer, LogoutSerializer, TokenRefreshSerializer
 
 
 class UserRegisterAPIView(generics.CreateAPIView):
@@ -37,7 +41,7 @@ class UserRegisterAPIView(generics.CreateAPIView):
     serializer_class = UserSerializer
 
 
-class UserLoginAPIView(APIView):
+class UserLoginAPIView(LoginExceptionMixin, APIView):
     """
     API endpoint for user login.
 
@@ -48,6 +52,11 @@ class UserLoginAPIView(APIView):
         - 200 OK: Returns the access and refresh tokens.
         - 400 Bad Request: If the request data is invalid.
         - 401 Unauthorized: If the credentials are invalid.
+        - 429 Too Many Requests: If too many logins are being verified, see the `Retry-After` header.
+        - 503 Service Unavailable: If the password verification timed out.
+
+    The password hash is verified on the bounded login pool (`settings.LOGIN_POOL`), so a burst of logins
+    cannot starve the other endpoints of CPU.
 
     Example:
        ```http
@@ -72,19 +81,39 @@ class UserLoginAPIView(APIView):
         password = request.data.get('password')
 
         if username and password:
-            user = authenticate(username=username, password=password)
-
-            if user:
-                refresh = RefreshToken.for_user(user)
-                return Response({
-                    'refresh': str(refresh),
-                    'access': str(refresh.access_token),
-                }, status=status.HTTP_200_OK)
-            else:
-                return Response({'detail': 'Invalid credentials'}, status=status.HTTP_401_UNAUTHORIZED)
+            return self.get_login_response(verify_credentials(request, username, password))
         else:
             return Response({'detail': 'Both username and password are required'}, status=status.HTTP_400_BAD_REQUEST)
 
+    @staticmethod
+    def get_login_response(user):
+        if user:
+            refresh = UserRefreshToken.for_user(user)
+            return Response({
+                'refresh': str(refresh),
+                'access': str(refresh.access_token),
+            }, status=status.HTTP_200_OK)
+        else:
+            return Response({'detail': 'Invalid credentials'}, status=status.HTTP_401_UNAUTHORIZED)
+
+
+class UserLoginAsyncAPIView(LoginExceptionMixin, AsyncAPIView):
+    """
+    Async login served by the ASGI deployment, the responses are the same as the ones of `UserLoginAPIView`.
+    The event loop awaits the login pool, no thread waits for the password verification.
+    """
+
+    permission_classes = UserLoginAPIView.permission_classes
+    serializer_class = UserLoginAPIView.serializer_class
+
+    async def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        user = await averify_credentials(request, serializer.validated_data['username'],
+                                         serializer.validated_data['password'])
+        # The refresh token is recorded in the database
+        return await sync_to_async(UserLoginAPIView.get_login_response)(user)
+
 
 class UserLogoutAPIView(APIView):
     """
@@ -120,9 +149,35 @@ class UserLogoutAPIView(APIView):
 
         if refresh_token:
             try:
-                RefreshToken(refresh_token).blacklist()
+                UserRefreshToken(refresh_token).blacklist()
                 return Response({'detail': 'Logout successful'}, status=status.HTTP_200_OK)
             except TokenError:
                 return Response({'detail': 'Invalid token'}, status=status.HTTP_400_BAD_REQUEST)
         else:
             return Response({'detail': 'Refresh token is required'}, status=status.HTTP_400_BAD_REQUEST)
+
+
+class UserTokenRefreshAPIView(TokenRefreshView):
+    """
+    API endpoint for refreshing an access token.
+
+    This endpoint allows users to obtain a new access token from a refresh token that is not blacklisted.
+
+    Responses:
+     - POST request:
+        - 200 OK: Returns the new access token.
+        - 401 Unauthorized: If the refresh token is invalid, expired or blacklisted.
+
+    Example:
+      ```http
+        POST /api/user/token/refresh/
+      ```
+      Payload:
+      ```json
+        {
+            "refresh": "valid_refresh_token"
+        }
+      ```
+    """
+
+    serializer_class = TokenRefreshSerializer
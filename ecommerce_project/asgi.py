@@ -0,0 +1,20 @@
+"""
+ASGI config for ecommerce_project project.
+
+It exposes the ASGI callable as a module-level variable named ``application``. The ASGI deployment serves
+the product, review and order lists with async views (see ``ecommerce_project/asgi_urls.py``), e.g.:
+
+    gunicorn ecommerce_project.asgi:application -k uvicorn.workers.UvicornWorker -w 4
+
+For more information on this file, see
+https://docs.djangoproject.com/en/4.2/howto/deployment/asgi/
+"""
+
+import os
+
+from django.core.asgi import get_asgi_application
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'ecommerce_project.settings')
+os.environ.setdefault('DJANGO_ASGI_MODE', '1')
+
+application = get_asgi_application()
@@ -0,0 +1,33 @@
+"""
+URL configuration of the ASGI deployment.
+
+The GET requests of the read-heavy endpoints and the logins are served by async views, the other methods by
+the DRF views of the same URLs. Everything else is routed as in `ecommerce_project.urls`.
+"""
+from django.urls import path
+
+from apps.order.views import OrderListAsyncAPIView, OrderListCreateView
+from apps.product.views import (
+    ProductAPIViewSet,
+    ProductAsyncAPIView,
+    ProductReviewAPIViewSet,
+    ProductReviewAsyncAPIView,
+)
+from apps.user.views import UserLoginAsyncAPIView
+from ecommerce_project import urls
+
+product_list = ProductAPIViewSet.as_view({'get': 'list', 'post': 'create'})
+product_detail = ProductAPIViewSet.as_view(
+    {'get': 'retrieve', 'put': 'update', 'patch': 'partial_update', 'delete': 'destroy'})
+review_list = ProductReviewAPIViewSet.as_view({'get': 'list', 'post': 'create'})
+
+
+urlpatterns = [
+    path('api/user/login/', UserLoginAsyncAPIView.as_view(), name='user-login'),
+    path('api/orders/', OrderListAsyncAPIView.as_view(sync_view=OrderListCreateView.as_view()),
+         name='order-list-create'),
+    path('api/products/', ProductAsyncAPIView.as_view(sync_view=product_list), name='product-list'),
+    path('api/products/<int:pk>/', ProductAsyncAPIView.as_view(sync_view=product_detail), name='product-detail'),
+    path('api/products/<int:product_id>/reviews/', ProductReviewAsyncAPIView.as_view(sync_view=review_list),
+         name='product-review-list'),
+] + urls.urlpatterns
@@ -0,0 +1,18 @@
+"""
+Celery application of the project, running the background tasks of the apps (``tasks.py`` modules), e.g.:
+
+    celery -A ecommerce_project worker -l info
+
+The configuration is read from the ``CELERY_`` settings. Without a broker configured, the tasks run eagerly
+in the process sending them.
+"""
+
+import os
+
+from celery import Celery
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'ecommerce_project.settings')
+
+app = Celery('ecommerce_project')
+app.config_from_object('django.conf:settings', namespace='CELERY')
+app.autodiscover_tasks()
@@ -11,6 +11,8 @@ https://docs.djangoproject.com/en/2.2/ref/settings/
 """
 
 import os
+import sys
+import tempfile
 from datetime import timedelta
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
@@ -26,6 +28,8 @@ SECRET_KEY = '_g6ypc672l6810*kjdcw4w&kp!t9usuz-h2qpjc^+!+^^@j(_2'
 # SECURITY WARNING: don't run with debug turned on in production!
 DEBUG = True
 
+TESTING = sys.argv[1:2] == ['test']
+
 ALLOWED_HOSTS = []
 
 
@@ -63,6 +67,9 @@ LOCAL_APPS = [
 
 INSTALLED_APPS = ON_TOP_APPS + DJANGO_APPS + THIRD_PARTY_APPS + LOCAL_APPS
 
+# Set by asgi.py, the ASGI deployment serves the read-heavy endpoints with async views
+ASGI_MODE = os.environ.get('DJANGO_ASGI_MODE') == '1'
+
 
 # Middleware
 DEFAULT_MIDDLEWARE = [
@@ -76,14 +83,16 @@ DEFAULT_MIDDLEWARE = [
 ]
 
 ON_TOP_MIDDLEWARE = ['corsheaders.middleware.CorsMiddleware', ]
-THIRD_PARTY_MIDDLEWARE = ['debug_toolbar.middleware.DebugToolbarMiddleware',]
+# The debug toolbar middleware is sync only, under ASGI it would run every request in a worker thread
+THIRD_PARTY_MIDDLEWARE = [] if ASGI_MODE else ['debug_toolbar.middleware.DebugToolbarMiddleware',]
 LOCAL_MIDDLEWARE = [
+    'apps.base.middleware.InstrumentationMiddleware',
     'apps.base.middleware.RequestTrackerMiddleware',
 ]
 
 MIDDLEWARE = ON_TOP_MIDDLEWARE + DEFAULT_MIDDLEWARE + THIRD_PARTY_MIDDLEWARE + LOCAL_MIDDLEWARE
 
-ROOT_URLCONF = 'ecommerce_project.urls'
+ROOT_URLCONF = 'ecommerce_project.asgi_urls' if ASGI_MODE else 'ecommerce_project.urls'
 AUTH_USER_MODEL = 'user.User'
 
 
@@ -104,6 +113,7 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'ecommerce_project.wsgi.application'
+ASGI_APPLICATION = 'ecommerce_project.asgi.application'
 
 
 # Database
@@ -116,6 +126,13 @@ DATABASES = {
     }
 }
 
+if TESTING:
+    # A temporary file instead of the shared in-memory database, whose table locks fail the concurrent
+    # requests of the tests instead of making them wait
+    DATABASES['default']['TEST'] = {
+        'NAME': os.path.join(tempfile.gettempdir(), f'ecommerce_test_{os.getpid()}.sqlite3'),
+    }
+
 
 # Password validation
 # https://docs.djangoproject.com/en/2.2/ref/settings/#auth-password-validators
@@ -135,16 +152,98 @@ AUTH_PASSWORD_VALIDATORS = [
     },
 ]
 
+# Cache
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+# Without REDIS_URL every process uses local in-memory caches and cacheops stays disabled.
+
+REDIS_URL = os.environ.get('REDIS_URL')
+
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        },
+        'catalog': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+            'KEY_PREFIX': 'catalog',
+            'TIMEOUT': 60 * 15,
+        },
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'default',
+        },
+        'catalog': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'catalog',
+            'TIMEOUT': 60 * 15,
+            'OPTIONS': {'MAX_ENTRIES': 5000},
+        },
+    }
+
+# Serialized catalog responses, invalidated when any instance of these models is saved or deleted
+CATALOG_CACHE = {
+    'CACHE_ALIAS': 'catalog',
+    'MODELS': ['product.Product', 'product.ProductCategory', 'product.ProductReview', 'user.User'],
+    # Fields scoping the invalidation of a model, only the entries built from the rows with the same values as
+    # the changed instance are invalidated (see apps.base.cache.CatalogCache)
+    'SCOPES': {
+        'product.Product': ('created_by_id', 'pk'),
+        'product.ProductReview': ('product_id',),
+        'user.User': ('pk',),
+    },
+}
+
+# Queryset caching with event based invalidation, see https://github.com/Suor/django-cacheops
+CACHEOPS_ENABLED = bool(REDIS_URL)
+CACHEOPS_REDIS = REDIS_URL
+CACHEOPS_DEGRADE_ON_FAILURE = True
+CACHEOPS_DEFAULTS = {
+    'timeout': 60 * 15,
+}
+CACHEOPS = {
+    'product.product': {'ops': 'all'},
+    'product.productcategory': {'ops': 'all', 'timeout': 60 * 60},
+    'product.productreview': {'ops': 'all'},
+}
+
+# Password hashing cost, stored hashes made with another cost are re-hashed on the next login
+PASSWORD_HASHERS = [
+    'apps.user.hashers.ConfigurablePBKDF2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'django.contrib.auth.hashers.Argon2PasswordHasher',
+    'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
+    'django.contrib.auth.hashers.ScryptPasswordHasher',
+]
+PASSWORD_HASHER_ITERATIONS = int(os.environ.get('PASSWORD_HASHER_ITERATIONS', 600000))
+
+# Bounded thread pool verifying login passwords, see apps.user.login_pool
+LOGIN_POOL = {
+    'MAX_WORKERS': int(os.environ.get('LOGIN_POOL_WORKERS', 4)),
+    'MAX_QUEUE': int(os.environ.get('LOGIN_POOL_QUEUE', 16)),  # pending logins beyond this get a 429
+    'TIMEOUT': 5,  # seconds before a pending login gets a 503
+    'RETRY_AFTER': 1,
+}
+
 REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
     ],
     'DEFAULT_AUTHENTICATION_CLASSES': [
         'rest_framework.authentication.SessionAuthentication',
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'apps.user.authentication.StatelessJWTAuthentication',
+    ],
+    'DEFAULT_RENDERER_CLASSES': [
+        'apps.base.renderers.FastJSONRenderer',  # orjson, falls back to the standard library without it
+        'rest_framework.renderers.BrowsableAPIRenderer',
     ],
     'DEFAULT_FILTER_BACKENDS': ['django_filters.rest_framework.DjangoFilterBackend'],
-    'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',  # query param like ?page=2&size=10
+    # query param like ?page=2, or ?pagination=cursor&cursor=...&size=10 on views with a keyset_ordering
+    'DEFAULT_PAGINATION_CLASS': 'apps.base.pagination.HybridPagination',
     'PAGE_SIZE': 10,
     'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
 }
@@ -188,6 +287,85 @@ SIMPLE_JWT = {
     'SLIDING_TOKEN_REFRESH_LIFETIME': timedelta(days=1),
 }
 
+# Users of JWT authenticated requests are built from the token claims, see apps.user.authentication. Requires a
+# user cache shared by all processes (REDIS_URL), otherwise every request loads its user from the database.
+STATELESS_JWT = {
+    'USER_CACHE_ALIAS': 'default',
+    'USER_CACHE_TIMEOUT': 60,  # seconds a full user model is reused for tokens without user claims
+}
+
+# In-memory Bloom filter of the blacklisted refresh tokens, see apps.user.blacklist. Only used when the cache is
+# shared by all processes (REDIS_URL), otherwise every refresh token is checked in the database.
+TOKEN_BLACKLIST_INDEX = {
+    'CACHE_ALIAS': 'default',
+    'CAPACITY': 100000,
+    'ERROR_RATE': 0.001,
+}
+
+# Request metrics and query budgets, see apps.base.middleware.InstrumentationMiddleware
+INSTRUMENTATION = {
+    # Bearer token of the scrapes of /internal/metrics/, the endpoint is disabled without it
+    'METRICS_TOKEN': os.environ.get('METRICS_TOKEN', ''),
+    # 'warn' logs the requests going over the query budget of their view, 'raise' fails them, 'off'
+    'QUERY_BUDGET_MODE': os.environ.get('QUERY_BUDGET_MODE', 'raise' if TESTING else 'warn'),
+    # Maximum number of queries per request, by view label (e.g. 'ProductAPIViewSet.list') or class name
+    'QUERY_BUDGETS': {
+        'OrderListCreateView.get': 5,
+        'OrderRUDAPIView.get': 5,
+        'OrderSummaryAPIView.get': 2,
+        'ProductAPIViewSet.list': 10,  # up to 6 of them for the facets of ?facets=true
+        'ProductAPIViewSet.retrieve': 4,
+        'ProductReviewAPIViewSet.list': 4,
+        'ProductReviewAPIViewSet.retrieve': 4,
+    },
+}
+
+# Celery, see ecommerce_project/celery.py
+# Without CELERY_BROKER_URL or REDIS_URL, and in the tests, the tasks run eagerly in the process sending them.
+CELERY_BROKER_URL = os.environ.get('CELERY_BROKER_URL', REDIS_URL or 'memory://')
+CELERY_TASK_ALWAYS_EAGER = TESTING or CELERY_BROKER_URL == 'memory://'
+CELERY_TASK_EAGER_PROPAGATES = TESTING
+CELERY_TASK_IGNORE_RESULT = True
+CELERY_TASK_ACKS_LATE = True  # a task lost with its worker is delivered again, the tasks are idempotent
+CELERY_WORKER_PREFETCH_MULTIPLIER = 1
+CELERY_BEAT_SCHEDULE = {
+    'sweep-expired-reservations': {
+        'task': 'apps.order.tasks.sweep_expired_reservations',
+        'schedule': 60,  # seconds
+    },
+    'purge-idempotency-keys': {
+        'task': 'apps.base.tasks.purge_idempotency_keys',
+        'schedule': 60 * 60,
+    },
+}
+
+# Idempotency-Key header of the create endpoints, see apps.base.mixins.idempotency
+IDEMPOTENCY = {
+    'TTL': 60 * 60 * 24,  # seconds a key and its response are kept
+    # Seconds before the key of a request that never completed can be used again, longer than the slowest request
+    # (e.g. the worker timeout of the application server): a request outliving it is rolled back
+    'IN_FLIGHT_TIMEOUT': 60 * 10,
+    'LRU_SIZE': 1024,  # completed keys kept in the memory of each process
+}
+
+# Stock held by pending orders, see apps.order.models.StockReservation
+STOCK_RESERVATIONS = {
+    'TTL': int(os.environ.get('STOCK_RESERVATION_TTL', 60 * 30)),  # seconds before an unpaid order is canceled
+    'SWEEP_BATCH_SIZE': 500,  # orders released per transaction by the sweeper
+}
+
+# Follow-up work of the order changes, run by apps.order.tasks after the change is committed
+ORDER_EVENTS = {
+    # Email the customer and the owners of the ordered products. Only done by Celery workers: without a broker
+    # the tasks run eagerly in the request committing the order, which must not wait on the mail server.
+    'NOTIFY': TESTING or not CELERY_TASK_ALWAYS_EAGER,
+}
+
+# Emails are printed unless a mail server is configured, e.g. EMAIL_BACKEND=django.core.mail.backends.smtp.EmailBackend
+EMAIL_BACKEND = os.environ.get('EMAIL_BACKEND', 'django.core.mail.backends.console.EmailBackend')
+EMAIL_HOST = os.environ.get('EMAIL_HOST', 'localhost')
+EMAIL_PORT = int(os.environ.get('EMAIL_PORT', 25))
+
 INTERNAL_IPS = [
     "127.0.0.1",
 ]
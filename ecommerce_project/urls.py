@@ -15,6 +15,7 @@ Including another URLconf
 """
 from django.contrib import admin
 from django.urls import path, include
+from apps.base.views import metrics_view
 from drf_spectacular.views import (
     SpectacularAPIView,
     SpectacularRedocView,
@@ -26,6 +27,7 @@ urlpatterns = [
     path("__debug__/", include("debug_toolbar.urls")),
 
     path('admin/', admin.site.urls),
+    path('internal/metrics/', metrics_view, name='metrics'),
     path('api/', include("apps.order.urls")),
     path('api/', include("apps.product.urls")),
     path('api/', include("apps.user.urls")),